@@ -0,0 +1,144 @@
+from typing import Dict, Any, Tuple
+import math
+import numpy as np
+import logging
+
+from .scene import TimelineItem
+
+logger = logging.getLogger(__name__)
+
+# 滑入动画的位移距离（帧宽/帧高的比例），位移会被限制在帧内
+SLIDE_DISTANCE = 0.1
+# 高亮颜色 (BGR，粉笔黄) 及着色强度
+HIGHLIGHT_COLOR = (0, 215, 255)
+HIGHLIGHT_STRENGTH = 0.7
+
+# 入场动画：滑入方向对应的单位位移（元素从该方向移动到最终位置）
+SLIDE_DIRECTIONS = {
+    'slide_in_left': (-1, 0),
+    'slide_in_right': (1, 0),
+    'slide_in_top': (0, -1),
+    'slide_in_bottom': (0, 1),
+}
+# draw_path 只对几何图形有效，按路径长度逐帧画出图形（见 GeometryPathAnimator）
+ENTER_EFFECTS = ('fade_in', 'highlight', 'draw_path') + tuple(SLIDE_DIRECTIONS)
+EXIT_EFFECTS = ('fade_out',)
+DEFAULT_ENTER = 'fade_in'
+DEFAULT_EXIT = 'fade_out'
+
+def resolve_effects(animation: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    从 JSON 的 animation 字段解析入场/退场效果，不支持的效果回退为淡入/淡出
+
+    Returns:
+        (入场效果, 退场效果)；没有 exit 字段时退场效果为 None
+    """
+    enter = animation.get('enter', DEFAULT_ENTER)
+    if enter not in ENTER_EFFECTS:
+        logger.warning(f"不支持的入场动画 {enter}，使用 {DEFAULT_ENTER}")
+        enter = DEFAULT_ENTER
+    exit_effect = animation.get('exit')
+    if exit_effect is not None and exit_effect not in EXIT_EFFECTS:
+        logger.warning(f"不支持的退场动画 {exit_effect}，使用 {DEFAULT_EXIT}")
+        exit_effect = DEFAULT_EXIT
+    return enter, exit_effect
+
+def enter_fades(item: TimelineItem) -> bool:
+    """入场效果是否伴随透明度淡入（高亮和路径绘制效果直接以不透明状态出现）"""
+    return item.enter not in ('highlight', 'draw_path')
+
+def _enter_progress(item: TimelineItem, frame_idx: int):
+    """入场动画的进度 (0-1)；不在入场动画期间返回 None"""
+    start = item.start_frame
+    if item.fade_in_frames <= 0 or not (start <= frame_idx < item.end_frame):
+        return None
+    elapsed = frame_idx - start
+    if elapsed >= item.fade_in_frames:
+        return None
+    return elapsed / item.fade_in_frames
+
+def ease_out_cubic(t: float) -> float:
+    return 1.0 - (1.0 - t) ** 3
+
+def item_offset(item: TimelineItem, frame_idx: int, rect: Tuple[int, int, int, int],
+                frame_shape: Tuple[int, ...]) -> Tuple[int, int]:
+    """
+    计算元素在指定帧相对最终位置的像素平移
+
+    Args:
+        item: 时间轴元素
+        frame_idx: 帧序号（相对于步骤开始）
+        rect: 元素最终位置的矩形 (x_start, y_start, x_end, y_end)
+        frame_shape: 帧尺寸
+
+    Returns:
+        (dx, dy)，平移后的矩形保证仍在帧内
+    """
+    direction = SLIDE_DIRECTIONS.get(item.enter)
+    if direction is None:
+        return 0, 0
+    progress = _enter_progress(item, frame_idx)
+    if progress is None:
+        return 0, 0
+    remaining = 1.0 - ease_out_cubic(progress)
+    frame_h, frame_w = frame_shape[:2]
+    dx = int(round(direction[0] * SLIDE_DISTANCE * frame_w * remaining))
+    dy = int(round(direction[1] * SLIDE_DISTANCE * frame_h * remaining))
+    # 与 compute_blend_rect 一致：元素始终完整位于帧内
+    dx = min(max(dx, -rect[0]), frame_w - rect[2])
+    dy = min(max(dy, -rect[1]), frame_h - rect[3])
+    return dx, dy
+
+def item_tint_u8(item: TimelineItem, frame_idx: int) -> int:
+    """
+    高亮着色的权重 (0-255)：入场期间按正弦曲线先增强后减弱
+
+    Returns:
+        高亮变体叠加到元素上的透明度；不在高亮动画期间返回 0
+    """
+    if item.enter != 'highlight':
+        return 0
+    progress = _enter_progress(item, frame_idx)
+    if progress is None:
+        return 0
+    return int(round(math.sin(math.pi * progress) * 255))
+
+def item_path_progress(item: TimelineItem, frame_idx: int):
+    """
+    路径绘制动画在指定帧的进度
+
+    Returns:
+        入场期间为 0-1 的进度，入场完成后为 1.0；不是 draw_path 元素时返回 None
+    """
+    if item.enter != 'draw_path':
+        return None
+    progress = _enter_progress(item, frame_idx)
+    return 1.0 if progress is None else progress
+
+def tint_image(img: np.ndarray, color: Tuple[int, int, int] = HIGHLIGHT_COLOR,
+               strength: float = HIGHLIGHT_STRENGTH) -> np.ndarray:
+    """
+    生成元素图像的着色变体：颜色向 color 插值，alpha 通道不变
+
+    Args:
+        img: 预乘 BGRA 图像，或视为完全不透明的 BGR 图像
+        color: 目标颜色 (BGR)
+        strength: 着色强度 (0-1)
+
+    Returns:
+        与 img 形状相同的 uint8 图像（BGRA 输入时同样是预乘的）
+    """
+    tinted = img.copy()
+    tint = np.array(color, dtype=np.float32) * strength
+    if img.shape[2] == 4:
+        # 预乘形式下目标颜色也要乘以像素的 alpha
+        tint = tint * (img[..., 3:4] / np.float32(255))
+    tinted[..., :3] = np.clip(img[..., :3] * (1.0 - strength) + tint + 0.5, 0, 255).astype(np.uint8)
+    return tinted
+
+def prepare_item_variants(item: TimelineItem) -> None:
+    """为需要的效果预先生成并缓存元素图像的变体（如高亮着色版本），写入 item.variants"""
+    variants = {}
+    if item.enter == 'highlight':
+        variants['highlight'] = tint_image(item.content)
+    item.variants = variants
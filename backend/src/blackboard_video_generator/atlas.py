@@ -0,0 +1,249 @@
+from typing import List, Optional, Tuple
+import math
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 图集页边长的上限（像素）。pack 按一批精灵的总面积确定页宽，并把每页的高度收缩到实际占用的货架
+DEFAULT_PAGE_SIZE = 2048
+# pack 的候选页宽相对于精灵总面积平方根的倍数，取页面总面积最小的布局
+_PACK_WIDTH_FACTORS = (1.0, 1.25, 1.5, 2.0, 3.0)
+# 相邻精灵之间留出的透明像素，避免裁剪或缩放取样时读到邻居的墨迹
+DEFAULT_PADDING = 1
+
+class _Shelf:
+    """图集页中的一行货架：高度固定，精灵从左到右依次放置"""
+
+    __slots__ = ('y', 'height', 'x')
+
+    def __init__(self, y: int, height: int):
+        self.y = y
+        self.height = height
+        self.x = 0
+
+class _Page:
+    """图集的一页：一张 BGRA（或单通道）数组及其货架"""
+
+    __slots__ = ('height', 'width', 'channels', 'pixels', 'shelves', 'used_height', 'sealed')
+
+    def __init__(self, height: int, width: int, channels: int = 4, allocate: bool = True):
+        """
+        Args:
+            height: 页面高度上限
+            width: 页面宽度
+            channels: 每个像素的通道数
+            allocate: 是否立即分配像素；为 False 时只做布局，放置完成后由 materialize 按实际高度分配
+        """
+        self.height = height
+        self.width = width
+        self.channels = channels
+        # 页面初始化为全透明，未被占用的区域不会出现在任何精灵视图中。
+        # np.zeros 的内存由操作系统按需映射，货架从上往下分配，尚未用到的行不占用物理内存
+        self.pixels = np.zeros((height, width, channels), dtype=np.uint8) if allocate else None
+        self.shelves: List[_Shelf] = []
+        self.used_height = 0
+        # 已按内容收缩的页面不再接收新的精灵
+        self.sealed = False
+
+    def place(self, height: int, width: int, padding: int) -> Optional[Tuple[int, int]]:
+        """
+        按货架算法为 height x width 的精灵分配区域
+
+        Returns:
+            区域左上角 (y, x)；页面放不下时返回 None
+        """
+        page_height, page_width = self.height, self.width
+        # 优先放进浪费高度最少的已有货架
+        best = None
+        for shelf in self.shelves:
+            if height <= shelf.height and shelf.x + width <= page_width:
+                if best is None or shelf.height < best.height:
+                    best = shelf
+        if best is None:
+            if self.used_height + height > page_height or width > page_width:
+                return None
+            best = _Shelf(self.used_height, height)
+            self.shelves.append(best)
+            self.used_height = min(page_height, self.used_height + height + padding)
+        x = best.x
+        best.x = min(page_width, x + width + padding)
+        return best.y, x
+
+    def allocate(self, height: int, width: int, padding: int) -> Optional[np.ndarray]:
+        """与 place 相同，但返回页面中对应子矩形的视图（页面须已分配像素）"""
+        position = self.place(height, width, padding)
+        if position is None:
+            return None
+        y, x = position
+        return self.pixels[y:y + height, x:x + width]
+
+    def materialize(self) -> None:
+        """按货架实际占用的高度分配像素，页面之后不能再放入精灵"""
+        self.height = max((shelf.y + shelf.height for shelf in self.shelves), default=0)
+        self.used_height = self.height
+        self.pixels = np.zeros((self.height, self.width, self.channels), dtype=np.uint8)
+        self.sealed = True
+
+class SpriteAtlas:
+    """
+    一道题所有精灵的图集。
+    渲染好的预乘 BGRA 精灵按货架（shelf）算法打包进少数几张大的 BGRA 页面，
+    返回页面子矩形的视图（零拷贝），元素图像与时间轴都直接引用这些视图。
+    与每个精灵单独分配数组相比，内存集中在几块连续的大页中，没有逐个数组的对象开销和分配碎片。
+    pack 一次放入一个步骤的所有精灵：页宽取自这批精灵的总面积，页高收缩到实际使用的货架，
+    页面大小与内容相当；逐个 add 的精灵放入 page_size 见方的页。超过页面尺寸的精灵单独占用一页。
+    channels=1 时页面是单通道的覆盖率图，用于字形图集（见 renderers/glyph_atlas.py）。
+    """
+
+    def __init__(self, page_size: int = DEFAULT_PAGE_SIZE, padding: int = DEFAULT_PADDING, channels: int = 4):
+        """
+        Args:
+            page_size: 图集页的边长（像素）
+            padding: 相邻精灵之间的透明间隔（像素）
+            channels: 每个像素的通道数，4 为预乘 BGRA，1 为覆盖率
+        """
+        self.page_size = page_size
+        self.padding = padding
+        self.channels = channels
+        self._pages: List[_Page] = []
+        self._sprite_count = 0
+        self._sprite_bytes = 0
+        self._private_bytes = 0
+
+    def add(self, img: np.ndarray) -> np.ndarray:
+        """
+        把单个精灵复制进图集
+
+        Args:
+            img: 预乘 BGRA 图像（uint8）；单通道图集接受 (h, w) 的覆盖率
+
+        Returns:
+            图集页中的视图（与 img 的维数相同）；通道数不符的图像或空图像原样返回
+        """
+        if img is None or img.dtype != np.uint8 or img.size == 0:
+            return img
+        if img.ndim == 2 and self.channels == 1:
+            return self.add(img[:, :, None])[:, :, 0]
+        if img.ndim != 3 or img.shape[2] != self.channels:
+            return img
+        height, width = img.shape[:2]
+        view = None
+        for page in self._pages:
+            if not page.sealed:
+                view = page.allocate(height, width, self.padding)
+                if view is not None:
+                    break
+        if view is None:
+            if height > self.page_size or width > self.page_size:
+                page = _Page(height, width, self.channels)
+            else:
+                page = _Page(self.page_size, self.page_size, self.channels)
+            self._pages.append(page)
+            view = page.allocate(height, width, self.padding)
+        self._store(view, img)
+        return view
+
+    def track_private(self, img: np.ndarray) -> None:
+        """记录不在图集中、但与精灵同时存活的私有图像（如路径绘制动画器逐帧更新的画布），计入 stats"""
+        if img is not None:
+            self._private_bytes += img.nbytes
+
+    def _accepts(self, img: np.ndarray) -> bool:
+        return (img is not None and img.dtype == np.uint8 and img.size > 0
+                and img.ndim == 3 and img.shape[2] == self.channels)
+
+    def _store(self, view: np.ndarray, img: np.ndarray) -> None:
+        view[...] = img
+        self._sprite_count += 1
+        self._sprite_bytes += img.nbytes
+
+    def _pack_widths(self, images: List[np.ndarray]) -> List[int]:
+        """
+        一批精灵的候选页宽：从总面积（含间隔）的平方根（页面接近正方形）起逐步加宽；
+        都不小于最宽的精灵，不超过 page_size
+        """
+        padding = self.padding
+        area = sum((img.shape[0] + padding) * (img.shape[1] + padding) for img in images)
+        widest = max(img.shape[1] for img in images)
+        return sorted({min(self.page_size, max(widest, math.ceil(math.sqrt(area) * factor)))
+                       for factor in _PACK_WIDTH_FACTORS})
+
+    def _layout(self, images: List[np.ndarray], order: List[int], page_width: int) -> Tuple[List[_Page], list]:
+        """在不分配像素的页面上按货架算法完成布局，返回 (页面列表, [(序号, 页面, (y, x))])"""
+        pages = []
+        placements = []
+        for i in order:
+            height, width = images[i].shape[:2]
+            if height > self.page_size or width > page_width:
+                # 超过页面尺寸的精灵单独占用一页
+                page = _Page(height, width, self.channels, allocate=False)
+                pages.append(page)
+                placements.append((i, page, page.place(height, width, 0)))
+                continue
+            for page in pages:
+                position = page.place(height, width, self.padding) if page.width == page_width else None
+                if position is not None:
+                    break
+            else:
+                page = _Page(self.page_size, page_width, self.channels, allocate=False)
+                pages.append(page)
+                position = page.place(height, width, self.padding)
+            placements.append((i, page, position))
+        return pages, placements
+
+    def pack(self, images: List[np.ndarray]) -> List[np.ndarray]:
+        """
+        把一组精灵（一个步骤的所有元素图像）复制进新的图集页。
+        先按高度降序在不分配像素的页面上完成布局（货架的高度浪费最少），候选页宽中取总面积最小的一种，
+        再按各页实际占用的高度分配像素并复制，最后一页不会留下空白的行
+
+        Returns:
+            与 images 顺序一致的视图列表；通道数不符的图像或空图像原样返回
+        """
+        packed = list(images)
+        order = sorted((i for i, img in enumerate(images) if self._accepts(img)),
+                       key=lambda i: -images[i].shape[0])
+        if not order:
+            return packed
+        layouts = [self._layout(images, order, page_width)
+                   for page_width in self._pack_widths([images[i] for i in order])]
+        pages, placements = min(layouts, key=lambda layout: sum(
+            max((shelf.y + shelf.height for shelf in page.shelves), default=0) * page.width for page in layout[0]))
+        for page in pages:
+            page.materialize()
+        self._pages.extend(pages)
+        for i, page, (y, x) in placements:
+            height, width = images[i].shape[:2]
+            packed[i] = page.pixels[y:y + height, x:x + width]
+            self._store(packed[i], images[i])
+        return packed
+
+    def stats(self) -> dict:
+        """
+        图集的内存统计
+
+        Returns:
+            字典：pages 页数、sprites 精灵数、page_bytes 页面总字节数、
+            used_bytes 已分配货架覆盖的字节数（实际占用的物理内存）、sprite_bytes 精灵像素字节数、
+            fragmentation 已分配货架中未被精灵占用的比例、
+            private_bytes 由 track_private 记录的图集之外的图像字节数
+        """
+        page_bytes = sum(page.pixels.nbytes for page in self._pages)
+        used_bytes = sum(page.used_height * page.pixels.shape[1] * self.channels for page in self._pages)
+        return {
+            'pages': len(self._pages),
+            'sprites': self._sprite_count,
+            'page_bytes': page_bytes,
+            'used_bytes': used_bytes,
+            'sprite_bytes': self._sprite_bytes,
+            'fragmentation': 1.0 - self._sprite_bytes / used_bytes if used_bytes else 0.0,
+            'private_bytes': self._private_bytes,
+        }
+
+    def clear(self) -> None:
+        """丢弃所有页面（仍被元素引用的视图保持有效，直到元素释放图像）"""
+        self._pages = []
+        self._sprite_count = 0
+        self._sprite_bytes = 0
+        self._private_bytes = 0
@@ -0,0 +1,137 @@
+from typing import Callable, Dict, Tuple
+import os
+import tempfile
+import threading
+import numpy as np
+import logging
+
+from .utils.image_utils import create_blackboard_background
+
+logger = logging.getLogger(__name__)
+
+# 背景纹理注册表：名称 -> 生成函数 (width, height, seed) -> (h, w, 3) uint8 BGR 图像
+# 生成函数必须是确定性的：相同的参数总是生成逐像素相同的图像
+BACKGROUND_TEXTURES: Dict[str, Callable[[int, int, int], np.ndarray]] = {
+    'classic_blackboard': create_blackboard_background,
+}
+DEFAULT_BACKGROUND = 'classic_blackboard'
+DEFAULT_BACKGROUND_SEED = 0
+# 纹理生成算法变化时递增，使旧的磁盘缓存文件失效
+BACKGROUND_CACHE_VERSION = 1
+# 磁盘缓存目录的环境变量；设为空字符串时只使用内存缓存
+BACKGROUND_CACHE_ENV = 'BLACKBOARD_BACKGROUND_CACHE_DIR'
+
+_memory_cache: Dict[Tuple[str, int, int, int], np.ndarray] = {}
+_cache_lock = threading.Lock()
+
+def register_background(name: str, generator: Callable[[int, int, int], np.ndarray]) -> None:
+    """
+    注册新的背景纹理
+
+    Args:
+        name: 纹理名称（即 JSON 中 blackboard.background 的取值）
+        generator: 确定性的生成函数 (width, height, seed) -> BGR 图像
+    """
+    BACKGROUND_TEXTURES[name] = generator
+    clear_background_cache(memory_only=True)
+
+def background_cache_dir():
+    """磁盘缓存目录，默认位于系统临时目录下，同一节点上的所有任务共享；返回 None 表示禁用磁盘缓存"""
+    cache_dir = os.environ.get(BACKGROUND_CACHE_ENV)
+    if cache_dir is None:
+        return os.path.join(tempfile.gettempdir(), 'blackboard_backgrounds')
+    return cache_dir or None
+
+def _cache_path(cache_dir: str, name: str, seed: int, width: int, height: int) -> str:
+    return os.path.join(cache_dir, f"{name}_v{BACKGROUND_CACHE_VERSION}_s{seed}_{width}x{height}.npy")
+
+def _load_cached(path: str, shape: Tuple[int, int, int]):
+    """以只读内存映射方式打开磁盘缓存；文件不存在或损坏时返回 None"""
+    if not os.path.exists(path):
+        return None
+    try:
+        background = np.load(path, mmap_mode='r')
+    except (OSError, ValueError) as e:
+        logger.warning(f"背景缓存文件损坏，将重新生成: {path} ({e})")
+        return None
+    if background.shape != shape or background.dtype != np.uint8:
+        logger.warning(f"背景缓存文件尺寸不符，将重新生成: {path}")
+        return None
+    return background
+
+def _store_cached(path: str, background: np.ndarray) -> bool:
+    """写入临时文件后原子替换，并发任务不会读到写了一半的缓存"""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.npy.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, background)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        logger.warning(f"无法写入背景缓存 {path}: {e}")
+        return False
+    return True
+
+def get_background(width: int, height: int, name: str = DEFAULT_BACKGROUND,
+                   seed: int = DEFAULT_BACKGROUND_SEED) -> np.ndarray:
+    """
+    获取指定纹理、种子和分辨率的背景图像。
+    同一进程内按 (名称, 种子, 分辨率) 缓存；磁盘上缓存为 .npy 并以只读内存映射打开，
+    同一节点上的多个任务共享同一份页缓存，只有第一次需要生成。
+
+    Args:
+        width: 宽度
+        height: 高度
+        name: 纹理名称，未注册的名称回退为 DEFAULT_BACKGROUND
+        seed: 随机种子
+
+    Returns:
+        只读的 (height, width, 3) uint8 图像，调用方需要修改时必须先 copy()
+    """
+    if name not in BACKGROUND_TEXTURES:
+        logger.warning(f"不支持的背景纹理 {name}，使用 {DEFAULT_BACKGROUND}")
+        name = DEFAULT_BACKGROUND
+    seed = int(seed)
+    key = (name, seed, width, height)
+    with _cache_lock:
+        background = _memory_cache.get(key)
+        if background is not None:
+            return background
+
+        shape = (height, width, 3)
+        cache_dir = background_cache_dir()
+        path = _cache_path(cache_dir, name, seed, width, height) if cache_dir else None
+        background = _load_cached(path, shape) if path else None
+        if background is None:
+            background = np.ascontiguousarray(BACKGROUND_TEXTURES[name](width, height, seed), dtype=np.uint8)
+            if path and _store_cached(path, background):
+                logger.debug(f"背景纹理已缓存: {path}")
+                # 改用内存映射，生成时的私有副本随即释放
+                background = np.load(path, mmap_mode='r')
+            else:
+                background.flags.writeable = False
+        _memory_cache[key] = background
+        return background
+
+def clear_background_cache(memory_only: bool = False) -> None:
+    """
+    清空背景缓存
+
+    Args:
+        memory_only: 为 True 时只清空进程内缓存，保留磁盘缓存文件
+    """
+    with _cache_lock:
+        _memory_cache.clear()
+        cache_dir = background_cache_dir()
+        if memory_only or not cache_dir or not os.path.isdir(cache_dir):
+            return
+        for filename in os.listdir(cache_dir):
+            if filename.endswith('.npy'):
+                try:
+                    os.unlink(os.path.join(cache_dir, filename))
+                except OSError as e:
+                    logger.warning(f"无法删除背景缓存 {filename}: {e}")
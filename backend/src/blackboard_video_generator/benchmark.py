@@ -0,0 +1,594 @@
+"""
+黑板视频生成器的性能基准
+
+用法（在项目根目录下运行）:
+    python -m backend.src.blackboard_video_generator.benchmark compositor [--json 路径] [--max-frames N] [--effect 效果]
+    python -m backend.src.blackboard_video_generator.benchmark blend [--size WxH] [--iterations N]
+    python -m backend.src.blackboard_video_generator.benchmark pipeline [--json 路径] [--depth N]
+    python -m backend.src.blackboard_video_generator.benchmark vfr [--json 路径] [--preset P]
+    python -m backend.src.blackboard_video_generator.benchmark memory [--json 路径] [--repeat N]
+    python -m backend.src.blackboard_video_generator.benchmark filtergraph [--json 路径] [--preset P] [--effect 效果]
+    python -m backend.src.blackboard_video_generator.benchmark drawpath [--json 路径] [--frames N] [--size HxW]
+    python -m backend.src.blackboard_video_generator.benchmark background [--size WxH] [--repeat N]
+    python -m backend.src.blackboard_video_generator.benchmark formula [--json 路径]
+    python -m backend.src.blackboard_video_generator.benchmark text [--json 路径]
+"""
+import sys
+import json
+import time
+import os
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+import cv2
+import numpy as np
+from pathlib import Path
+from loguru import logger
+
+from .blackboard_video_generator import BlackboardVideoGenerator
+from .scene import Scene
+from .compositor import compose_frame, StepCompositor, Sprite
+from .filtergraph import render_step_filtergraph, iter_step_frames, filtergraph_supports
+from .animations import ENTER_EFFECTS, prepare_item_variants
+from .renderers.geometry_renderer import render_geometry, GeometryPathAnimator
+from .renderers.formula_renderer import _formula_parts, _normalize_formula, render_latex_as_image
+from .renderers.mathtext_renderer import mathtext_supported, render_mathtext_as_image
+from .renderers.text_renderer import (_render_text_glyphs, _render_text_matplotlib, _to_unicode,
+                                      _find_chinese_font, RENDER_DPI)
+from .backgrounds import get_background, clear_background_cache, BACKGROUND_CACHE_ENV
+from .utils.image_utils import create_blackboard_background, blend_image_to_frame_reference, alpha_ramp, premultiply_image
+from .utils.video_utils import create_video_writer, PipelinedFrameWriter
+from .utils.memory_utils import bytes_to_mb
+
+DEFAULT_SAMPLE = Path(__file__).resolve().parents[3] / "samples" / "math_problems" / "sample_math_problem_001.json"
+FPS = 30
+# 样本题目中没有可用的几何图形时使用的图形：圆、弦、弦心距及标签
+DEFAULT_GEOMETRY = {
+    "circle": {"type": "circle", "cx": 50, "cy": 50, "r": 40},
+    "line": [
+        {"path": "M 18 74 L 82 74", "style": {"stroke": "white", "stroke-width": 2}},
+        {"path": "M 50 50 L 50 74", "style": {"stroke": "yellow", "stroke-width": 2}},
+        {"path": "M 50 50 L 82 74", "style": {"stroke": "white", "stroke-width": 2}},
+    ],
+    "label": [
+        {"text": "O", "position": [50, 45]},
+        {"text": "A", "position": [14, 80]},
+        {"text": "B", "position": [86, 80]},
+        {"text": "D", "position": [50, 82]},
+    ],
+}
+
+def load_sample(json_path: str):
+    """
+    读取样本题目并完成元素渲染与布局
+
+    Returns:
+        (generator, 处理后的步骤列表, 背景图像)
+    """
+    with open(json_path, 'r', encoding='utf-8') as f:
+        scene = Scene.from_dict(json.load(f).get('blackboard', {}))
+    width, height = scene.resolution or (1920, 1080)
+    generator = BlackboardVideoGenerator(width=width, height=height)
+    steps = [generator._prepare_step(step) for step in scene.steps]
+    background = get_background(width, height, scene.background or 'classic_blackboard')
+    return generator, steps, background
+
+def _frames_per_second(frame_count: int, seconds: float) -> float:
+    return frame_count / seconds if seconds > 0 else float('inf')
+
+def bench_compositor(args) -> None:
+    """对比整帧合成（compose_frame）与脏矩形合成（StepCompositor）的帧率"""
+    generator, steps, background = load_sample(args.json)
+
+    total_full = total_dirty = 0.0
+    total_frames = 0
+    print(f"{'step':>6} {'frames':>8} {'full fps':>10} {'dirty fps':>10} {'speedup':>8}")
+    for step in steps:
+        timeline = generator._build_timeline(step, FPS)
+        frame_count = min(step.total_frames(FPS), args.max_frames)
+        if frame_count <= 0:
+            continue
+        if args.effect:
+            _force_effect(timeline, args.effect)
+
+        start = time.perf_counter()
+        for frame_idx in range(frame_count):
+            compose_frame(background, timeline, frame_idx)
+        full_seconds = time.perf_counter() - start
+
+        compositor = StepCompositor(background, timeline)
+        start = time.perf_counter()
+        for frame_idx in range(frame_count):
+            compositor.compose(frame_idx)
+        dirty_seconds = time.perf_counter() - start
+
+        total_full += full_seconds
+        total_dirty += dirty_seconds
+        total_frames += frame_count
+        print(f"{step.step_id:>6} {frame_count:>8} "
+              f"{_frames_per_second(frame_count, full_seconds):>10.1f} "
+              f"{_frames_per_second(frame_count, dirty_seconds):>10.1f} "
+              f"{full_seconds / max(dirty_seconds, 1e-9):>7.1f}x")
+
+    print(f"{'total':>6} {total_frames:>8} "
+          f"{_frames_per_second(total_frames, total_full):>10.1f} "
+          f"{_frames_per_second(total_frames, total_dirty):>10.1f} "
+          f"{total_full / max(total_dirty, 1e-9):>7.1f}x")
+
+def _measure_blend(blend_once, iterations: int):
+    """
+    测量混合函数的吞吐量和每次调用的峰值临时内存
+
+    Returns:
+        (每秒调用次数, 每次调用的峰值临时内存字节数)
+    """
+    # 预热：让按需分配的缓冲在计时前完成分配
+    blend_once(0)
+
+    start = time.perf_counter()
+    for i in range(iterations):
+        blend_once(i)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    peak_bytes = 0
+    for i in range(min(iterations, 20)):
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        blend_once(i)
+        _, peak = tracemalloc.get_traced_memory()
+        peak_bytes = max(peak_bytes, peak - baseline)
+    tracemalloc.stop()
+    return iterations / seconds, peak_bytes
+
+def bench_blend(args) -> None:
+    """对比 float64 参考实现 blend_image_to_frame_reference 与定点预乘混合内核的吞吐量和临时内存"""
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    rng = np.random.default_rng(0)
+    sprite_img = premultiply_image(rng.integers(0, 256, (height, width, 4), dtype=np.uint8))
+    frame = create_blackboard_background(1920, 1080).copy()
+    fade_frames = args.fade_frames
+    ramp = alpha_ramp(fade_frames)
+
+    def legacy(i):
+        blend_image_to_frame_reference(frame, sprite_img, 0.3, 0.4, (i % (fade_frames + 1)) / fade_frames)
+
+    sprite = Sprite(sprite_img, 0.3, 0.4, frame.shape)
+
+    def fixed_point(i):
+        sprite.blend(frame, ramp[i % (fade_frames + 1)])
+
+    megapixels = width * height / 1e6
+    print(f"{'kernel':>14} {'calls/s':>10} {'Mpix/s':>10} {'peak temp KB':>14}")
+    for name, blend_once in (("float64", legacy), ("fixed-point", fixed_point)):
+        calls_per_second, peak_bytes = _measure_blend(blend_once, args.iterations)
+        print(f"{name:>14} {calls_per_second:>10.1f} {calls_per_second * megapixels:>10.1f} {peak_bytes / 1024:>14.1f}")
+
+def bench_pipeline(args) -> None:
+    """对比串行写入与流水线写入（合成/编码重叠）的端到端耗时，并输出背压统计"""
+    generator, steps, background = load_sample(args.json)
+    height, width = background.shape[:2]
+
+    print(f"{'mode':>10} {'seconds':>9} {'producer stall':>15} {'consumer stall':>15} {'mean depth':>11}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for mode in ("serial", "pipelined"):
+            writer = create_video_writer(os.path.join(tmp_dir, f"{mode}.mp4"), FPS, width, height,
+                                         preset=args.preset)
+            metrics = None
+            if mode == "pipelined":
+                writer = PipelinedFrameWriter(writer, args.depth)
+                metrics = writer.metrics
+            start = time.perf_counter()
+            for step in steps:
+                generator._render_step(writer, background, step, FPS)
+            writer.release()
+            seconds = time.perf_counter() - start
+            if metrics is None:
+                print(f"{mode:>10} {seconds:>9.2f} {'-':>15} {'-':>15} {'-':>11}")
+            else:
+                print(f"{mode:>10} {seconds:>9.2f} {metrics.producer_stall:>14.2f}s "
+                      f"{metrics.consumer_stall:>14.2f}s {metrics.mean_queue_depth:>11.1f}")
+
+def _encode_synthetic(writer, width: int, height: int, moving_frames: int, hold_frames: int) -> None:
+    """过渡密集的合成内容：一个方块逐帧移动 moving_frames 帧，随后静止 hold_frames 帧"""
+    background = create_blackboard_background(width, height)
+    frame = background.copy()
+    for i in range(moving_frames):
+        np.copyto(frame, background)
+        x = int(i * (width - 200) / max(moving_frames - 1, 1))
+        frame[height // 2 - 100:height // 2 + 100, x:x + 200] = 255
+        writer.write(frame)
+    writer.write_hold(frame, hold_frames)
+
+def bench_vfr(args) -> None:
+    """
+    恒定帧率与可变帧率写入的端到端编码耗时：样本题目的全部步骤，
+    以及过渡密集的合成内容（逐帧移动后长时间静止）
+    """
+    generator, steps, background = load_sample(args.json)
+    height, width = background.shape[:2]
+
+    def sample(writer):
+        for step in steps:
+            generator._render_step(writer, background, step, FPS)
+
+    def synthetic(writer):
+        _encode_synthetic(writer, width, height, args.moving_frames, args.hold_frames)
+
+    print(f"{'content':>10} {'cfr s':>8} {'vfr s':>8} {'speedup':>8} {'cfr KB':>9} {'vfr KB':>9}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, produce in (("sample", sample), ("synthetic", synthetic)):
+            seconds, sizes = [], []
+            for vfr in (False, True):
+                output_path = os.path.join(tmp_dir, f"{name}_{'vfr' if vfr else 'cfr'}.mp4")
+                start = time.perf_counter()
+                writer = create_video_writer(output_path, FPS, width, height, preset=args.preset, vfr=vfr)
+                produce(writer)
+                writer.release()
+                seconds.append(time.perf_counter() - start)
+                sizes.append(os.path.getsize(output_path) / 1024)
+            print(f"{name:>10} {seconds[0]:>8.2f} {seconds[1]:>8.2f} {seconds[0] / seconds[1]:>7.1f}x "
+                  f"{sizes[0]:>9.0f} {sizes[1]:>9.0f}")
+
+def _run_memory_mode(args) -> None:
+    """在当前进程中只运行一种模式，输出一行 JSON 结果"""
+    with open(args.json, 'r', encoding='utf-8') as f:
+        blackboard_data = json.load(f).get('blackboard', {})
+    blackboard_data['resolution'] = [int(v) for v in args.size.lower().split('x')]
+    blackboard_data['steps'] = [json.loads(json.dumps(step)) for _ in range(args.repeat)
+                                for step in blackboard_data.get('steps', [])]
+    width, height = blackboard_data['resolution']
+
+    generator = BlackboardVideoGenerator(width=width, height=height, streaming=args.mode == "streaming")
+    start = time.perf_counter()
+    output_path = generator.generate_video(blackboard_data)
+    seconds = time.perf_counter() - start
+    if output_path and os.path.exists(output_path):
+        os.remove(output_path)
+    stats = generator.last_run_stats
+    atlas = stats.get('atlas') or {'used_bytes': 0, 'sprite_bytes': 0, 'fragmentation': 0.0, 'private_bytes': 0}
+    print(json.dumps({
+        'mode': args.mode,
+        'steps': len(blackboard_data['steps']),
+        'seconds': seconds,
+        'peak_rss_mb': stats['peak_rss_mb'],
+        'max_sampled_rss_mb': stats['max_sampled_rss_mb'],
+        'atlas_mb': bytes_to_mb(atlas['used_bytes']),
+        'sprite_mb': bytes_to_mb(atlas['sprite_bytes']),
+        'fragmentation': atlas['fragmentation'],
+        'private_mb': bytes_to_mb(atlas['private_bytes']),
+    }))
+
+def bench_memory(args) -> None:
+    """把样本题目的步骤重复 N 次模拟长题目，对比一次性准备与流式模式的峰值RSS"""
+    if args.mode:
+        _run_memory_mode(args)
+        return
+
+    # 峰值RSS是进程生命周期的统计，因此每种模式在独立的子进程中运行
+    print(f"{'mode':>10} {'steps':>6} {'seconds':>9} {'peak RSS MB':>12} {'max sampled MB':>15} "
+          f"{'sprite MB':>10} {'atlas MB':>9} {'frag':>6} {'private MB':>11}")
+    for mode in ("batch", "streaming"):
+        command = [sys.executable, "-m", __spec__.name, "memory", "--json", args.json,
+                   "--repeat", str(args.repeat), "--size", args.size, "--mode", mode]
+        output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:>10} {result['steps']:>6} {result['seconds']:>9.2f} "
+              f"{result['peak_rss_mb']:>12.1f} {result['max_sampled_rss_mb']:>15.1f} "
+              f"{result['sprite_mb']:>10.1f} {result['atlas_mb']:>9.1f} {result['fragmentation'] * 100:>5.1f}% "
+              f"{result['private_mb']:>11.1f}")
+
+def _force_effect(timeline, effect: str) -> None:
+    """把所有带入场动画的元素替换为指定效果"""
+    for item in timeline:
+        if item.fade_in_frames > 0:
+            item.enter = effect
+            prepare_item_variants(item)
+
+def bench_filtergraph(args) -> None:
+    """
+    对比 Python 合成 + 管道编码与 ffmpeg 滤镜图合成编码的耗时，并校验两者逐像素的差异。
+    含路径绘制动画的步骤在滤镜图执行方式下回退到 Python 合成器，只列出不比较
+    """
+    generator, steps, background = load_sample(args.json)
+    height, width = background.shape[:2]
+
+    print(f"{'step':>6} {'frames':>7} {'python s':>9} {'ffmpeg s':>9} {'speedup':>8} {'max diff':>9} {'mean diff':>10}"
+          f"  effects")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        background_path = os.path.join(tmp_dir, "background.png")
+        cv2.imwrite(background_path, background)
+        for idx, step in enumerate(steps):
+            frame_count = step.total_frames(FPS)
+            if frame_count <= 0:
+                continue
+            timeline = generator._build_timeline(step, FPS)
+            if args.effect:
+                _force_effect(timeline, args.effect)
+            effects = ','.join(sorted({item.enter for item in timeline if item.fade_in_frames > 0}))
+            if not filtergraph_supports(timeline):
+                print(f"{step.step_id:>6} {frame_count:>7} {'(Python 合成器回退)':>48}  {effects}")
+                continue
+
+            start = time.perf_counter()
+            writer = create_video_writer(os.path.join(tmp_dir, f"python_{idx}.mp4"), FPS, width, height,
+                                         preset=args.preset)
+            generator._render_step(writer, background, step, FPS, timeline)
+            writer.release()
+            python_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            render_step_filtergraph(background_path, timeline, background.shape, frame_count, FPS,
+                                    os.path.join(tmp_dir, f"ffmpeg_{idx}.mp4"), tmp_dir, f"step_{idx}",
+                                    preset=args.preset)
+            ffmpeg_seconds = time.perf_counter() - start
+
+            # 等价性校验在编码之前比较：两边都输出未压缩的 BGR 帧
+            compositor = StepCompositor(background, timeline)
+            ffmpeg_frames = iter_step_frames(background_path, timeline, background.shape, frame_count, FPS,
+                                             tmp_dir, f"check_{idx}")
+            max_diff = 0
+            total_diff = 0.0
+            for frame_idx, ffmpeg_frame in enumerate(ffmpeg_frames):
+                diff = cv2.absdiff(compositor.compose(frame_idx), ffmpeg_frame)
+                max_diff = max(max_diff, int(diff.max()))
+                total_diff += float(diff.mean())
+
+            print(f"{step.step_id:>6} {frame_count:>7} {python_seconds:>9.2f} {ffmpeg_seconds:>9.2f} "
+                  f"{python_seconds / max(ffmpeg_seconds, 1e-9):>7.1f}x {max_diff:>9} {total_diff / frame_count:>10.4f}  {effects}")
+
+def _load_geometries(json_path: str):
+    """读取样本题目中所有 draw_path 入场的几何图形数据，没有时返回内置图形"""
+    geometries = []
+    if json_path:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            scene = Scene.from_dict(json.load(f).get('blackboard', {}))
+        for step in scene.steps:
+            for element in step.elements:
+                if element.type == 'geometry' and isinstance(element.content, dict):
+                    geometries.append((element.content, element.scale))
+    return geometries or [(DEFAULT_GEOMETRY, 1.0)]
+
+def bench_drawpath(args) -> None:
+    """对比 draw_path 动画每帧重新解析并重绘、每帧在空白画布上重绘与增量绘制的耗时"""
+    target_size = tuple(int(v) for v in args.size.split('x')) if args.size else None
+    progresses = [frame_idx / args.frames for frame_idx in range(args.frames + 1)]
+
+    print(f"{'shape':>6} {'segments':>9} {'reparse ms':>11} {'redraw ms':>10} {'incr ms':>8} "
+          f"{'speedup':>8} {'dirty px':>9} {'image px':>9} {'equal':>6}")
+    for idx, (geometry, scale_factor) in enumerate(_load_geometries(args.json)):
+        animator = GeometryPathAnimator(geometry, scale_factor, target_size)
+
+        start = time.perf_counter()
+        if target_size is None:
+            # 朴素做法：每帧重新解析 SVG 并重绘整个图形（只在原尺寸下可比）
+            for progress in progresses:
+                render_geometry(geometry, progress, scale_factor)
+            reparse_ms = (time.perf_counter() - start) * 1000 / len(progresses)
+        else:
+            reparse_ms = float('nan')
+
+        start = time.perf_counter()
+        for progress in progresses:
+            animator.render_full(progress)
+        redraw_ms = (time.perf_counter() - start) * 1000 / len(progresses)
+
+        animator.reset()
+        dirty_pixels = 0
+        start = time.perf_counter()
+        for progress in progresses:
+            for x_start, y_start, x_end, y_end in animator.advance(progress):
+                dirty_pixels += (x_end - x_start) * (y_end - y_start)
+        incremental_ms = (time.perf_counter() - start) * 1000 / len(progresses)
+
+        # 增量绘制的每一帧都必须与整幅重绘逐像素一致
+        animator.reset()
+        equal = True
+        for progress in progresses:
+            animator.advance(progress)
+            equal = equal and np.array_equal(animator.image, animator.render_full(progress))
+        height, width = animator.image.shape[:2]
+        print(f"{idx:>6} {len(animator._segments):>9} {reparse_ms:>11.3f} {redraw_ms:>10.3f} {incremental_ms:>8.3f} "
+              f"{redraw_ms / max(incremental_ms, 1e-9):>7.1f}x {dirty_pixels // len(progresses):>9} "
+              f"{width * height:>9} {str(equal):>6}")
+
+def bench_background(args) -> None:
+    """对比每次重新生成背景、进程内缓存命中与从磁盘缓存内存映射打开的耗时"""
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        os.environ[BACKGROUND_CACHE_ENV] = cache_dir
+        try:
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                create_blackboard_background(width, height, seed=0)
+            generate_ms = (time.perf_counter() - start) * 1000 / args.repeat
+
+            clear_background_cache()
+            start = time.perf_counter()
+            reference = get_background(width, height)
+            first_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                get_background(width, height)
+            memory_ms = (time.perf_counter() - start) * 1000 / args.repeat
+
+            # 模拟同一节点上的新任务：进程内缓存为空，磁盘缓存已存在
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                clear_background_cache(memory_only=True)
+                # 按步长读取像素，计入首次访问页面的开销
+                checksum = int(get_background(width, height)[::64, ::64].sum())
+            mmap_ms = (time.perf_counter() - start) * 1000 / args.repeat
+
+            clear_background_cache(memory_only=True)
+            identical = np.array_equal(reference, get_background(width, height)) and \
+                np.array_equal(reference, create_blackboard_background(width, height, seed=0))
+        finally:
+            del os.environ[BACKGROUND_CACHE_ENV]
+            clear_background_cache(memory_only=True)
+
+    print(f"{'source':>22} {'ms/call':>9}")
+    print(f"{'generate':>22} {generate_ms:>9.2f}")
+    print(f"{'first call (+ store)':>22} {first_ms:>9.2f}")
+    print(f"{'memory cache':>22} {memory_ms:>9.4f}")
+    print(f"{'disk cache (mmap)':>22} {mmap_ms:>9.2f}")
+    print(f"deterministic: {identical} (checksum {checksum})")
+
+def _sample_latex_fragments(json_path: str):
+    """样本题目中所有去重后的 LaTeX 片段及其字体大小"""
+    with open(json_path, 'r', encoding='utf-8') as f:
+        scene = Scene.from_dict(json.load(f).get('blackboard', {}))
+    fragments = {}
+    for step in scene.steps:
+        for element in step.elements:
+            if element.type in ('formula', 'text') and isinstance(element.content, str):
+                for is_latex, part in _formula_parts(_normalize_formula(element.content)):
+                    if is_latex:
+                        fragments.setdefault(part, element.font_size)
+    return list(fragments.items())
+
+def _time_ms(render) -> float:
+    start = time.perf_counter()
+    render()
+    return (time.perf_counter() - start) * 1000
+
+def bench_formula(args) -> None:
+    """
+    样本题目中每个 LaTeX 片段的路由结果，以及 mathtext 快速路径与 TeX 路径的单个公式耗时。
+    两条路径都有各自的缓存，因此只计时每个片段的首次渲染（即每个新公式的实际开销）
+    """
+    fragments = _sample_latex_fragments(args.json)
+    if not fragments:
+        print("样本题目中没有 LaTeX 片段")
+        return
+
+    print(f"{'route':>8} {'mathtext ms':>12} {'tex ms':>9} {'speedup':>8}  fragment")
+    routed = 0
+    for latex, font_size in fragments:
+        supported = mathtext_supported(latex)
+        routed += supported
+        mathtext_ms = _time_ms(lambda: render_mathtext_as_image(latex, font_size)) if supported else None
+        tex_ms = _time_ms(lambda: render_latex_as_image(latex, font_size))
+        mathtext_col = f"{mathtext_ms:>12.2f}" if mathtext_ms is not None else f"{'-':>12}"
+        speedup = f"{tex_ms / mathtext_ms:>7.1f}x" if mathtext_ms else f"{'-':>8}"
+        print(f"{'mathtext' if supported else 'tex':>8} {mathtext_col} {tex_ms:>9.2f} {speedup}  {latex[:60]}")
+    print(f"mathtext 命中率: {routed}/{len(fragments)} ({routed / len(fragments) * 100:.1f}%)")
+
+def _sample_text_strings(json_path: str):
+    """样本题目中所有去重后的普通文本（包括混合内容拆分出的文本和几何图形的标签）及其字体大小"""
+    with open(json_path, 'r', encoding='utf-8') as f:
+        scene = Scene.from_dict(json.load(f).get('blackboard', {}))
+    strings = {}
+    for step in scene.steps:
+        for element in step.elements:
+            if element.type in ('formula', 'text') and isinstance(element.content, str):
+                for is_latex, part in _formula_parts(_normalize_formula(element.content)):
+                    if not is_latex and part.strip():
+                        strings.setdefault(part, element.font_size)
+            elif element.type == 'geometry' and isinstance(element.content, dict):
+                data = element.content.get('content', element.content)
+                for label in data.get('label') or []:
+                    if isinstance(label, dict) and label.get('text'):
+                        strings.setdefault(label['text'], label.get('font_size', 24))
+    return list(strings.items())
+
+def bench_text(args) -> None:
+    """
+    普通文本：matplotlib 图形路径 vs 字形图集路径的单个字符串耗时。
+    字形图集路径分别计时首次渲染（包括新字形的光栅化）与字形已在图集中时的渲染
+    """
+    strings = _sample_text_strings(args.json)
+    if not strings:
+        print("样本题目中没有普通文本")
+        return
+
+    print(f"{'figure ms':>10} {'glyph ms':>9} {'warm ms':>8} {'speedup':>8}  text")
+    totals = [0.0, 0.0, 0.0]
+    for text, font_size in strings:
+        text = _to_unicode(text)
+        chinese_font = _find_chinese_font(text)
+        family = chinese_font or 'sans-serif'
+        figure_ms = _time_ms(lambda: _render_text_matplotlib(text, font_size, chinese_font, RENDER_DPI))
+        glyph_ms = _time_ms(lambda: _render_text_glyphs(text, font_size, family, RENDER_DPI))
+        warm_ms = _time_ms(lambda: _render_text_glyphs(text, font_size, family, RENDER_DPI))
+        for i, value in enumerate((figure_ms, glyph_ms, warm_ms)):
+            totals[i] += value
+        print(f"{figure_ms:>10.2f} {glyph_ms:>9.2f} {warm_ms:>8.3f} {figure_ms / warm_ms:>7.0f}x  {text[:60]!r}")
+    print(f"{totals[0]:>10.2f} {totals[1]:>9.2f} {totals[2]:>8.3f} {totals[0] / totals[2]:>7.0f}x  (合计 {len(strings)} 个字符串)")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="黑板视频生成器性能基准")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compositor = subparsers.add_parser("compositor", help="整帧合成 vs 脏矩形合成的帧率")
+    compositor.add_argument("--json", default=str(DEFAULT_SAMPLE), help="样本题目JSON路径")
+    compositor.add_argument("--max-frames", type=int, default=300, help="每个步骤最多合成的帧数")
+    compositor.add_argument("--effect", choices=[effect for effect in ENTER_EFFECTS if effect != 'draw_path'],
+                            help="把所有入场动画替换为指定效果（draw_path 见 drawpath 子命令）")
+    compositor.set_defaults(func=bench_compositor)
+
+    blend = subparsers.add_parser("blend", help="float64 混合 vs 定点预乘混合内核")
+    blend.add_argument("--size", default="600x200", help="精灵尺寸 WxH")
+    blend.add_argument("--iterations", type=int, default=500, help="计时的混合次数")
+    blend.add_argument("--fade-frames", type=int, default=30, help="淡入帧数（决定透明度斜坡）")
+    blend.set_defaults(func=bench_blend)
+
+    pipeline = subparsers.add_parser("pipeline", help="串行写入 vs 流水线写入的端到端耗时")
+    pipeline.add_argument("--json", default=str(DEFAULT_SAMPLE), help="样本题目JSON路径")
+    pipeline.add_argument("--depth", type=int, default=4, help="流水线帧缓冲数量")
+    pipeline.add_argument("--preset", default="medium", help="libx264 预设")
+    pipeline.set_defaults(func=bench_pipeline)
+
+    vfr = subparsers.add_parser("vfr", help="恒定帧率 vs 可变帧率写入的编码耗时")
+    vfr.add_argument("--json", default=str(DEFAULT_SAMPLE), help="样本题目JSON路径")
+    vfr.add_argument("--preset", default="medium", help="libx264 预设")
+    vfr.add_argument("--moving-frames", type=int, default=60, help="合成内容中逐帧移动的帧数")
+    vfr.add_argument("--hold-frames", type=int, default=300, help="合成内容中静止的帧数")
+    vfr.set_defaults(func=bench_vfr)
+
+    memory = subparsers.add_parser("memory", help="一次性准备 vs 流式模式的内存占用")
+    memory.add_argument("--json", default=str(DEFAULT_SAMPLE), help="样本题目JSON路径")
+    memory.add_argument("--repeat", type=int, default=10, help="样本步骤的重复次数")
+    memory.add_argument("--size", default="960x540", help="视频分辨率 WxH")
+    memory.add_argument("--mode", choices=("batch", "streaming"), help="只在当前进程中运行指定模式")
+    memory.set_defaults(func=bench_memory)
+
+    filtergraph = subparsers.add_parser("filtergraph", help="Python 合成 vs ffmpeg 滤镜图合成")
+    filtergraph.add_argument("--json", default=str(DEFAULT_SAMPLE), help="样本题目JSON路径")
+    filtergraph.add_argument("--preset", default="medium", help="libx264 预设（两种方式相同）")
+    filtergraph.add_argument("--effect", choices=[effect for effect in ENTER_EFFECTS if effect != 'draw_path'],
+                             help="把所有带入场动画的元素替换为指定效果（默认使用题目中的效果）")
+    filtergraph.set_defaults(func=bench_filtergraph)
+
+    drawpath = subparsers.add_parser("drawpath", help="draw_path 动画：整幅重绘 vs 增量绘制")
+    drawpath.add_argument("--json", help="样本题目JSON路径（取其中的几何图形，默认使用内置图形）")
+    drawpath.add_argument("--frames", type=int, default=90, help="路径绘制动画的帧数")
+    drawpath.add_argument("--size", help="输出图像尺寸 HxW（默认与 render_geometry 相同）")
+    drawpath.set_defaults(func=bench_drawpath)
+
+    background = subparsers.add_parser("background", help="背景生成 vs 内存缓存 vs 磁盘内存映射缓存")
+    background.add_argument("--size", default="1920x1080", help="背景分辨率 WxH")
+    background.add_argument("--repeat", type=int, default=20, help="每种方式的重复次数")
+    background.set_defaults(func=bench_background)
+
+    formula = subparsers.add_parser("formula", help="LaTeX 片段路由：mathtext 快速路径 vs TeX 路径的单个公式耗时")
+    formula.add_argument("--json", default=str(DEFAULT_SAMPLE), help="样本题目JSON路径")
+    formula.set_defaults(func=bench_formula)
+
+    text = subparsers.add_parser("text", help="普通文本：matplotlib 图形 vs 字形图集的单个字符串耗时")
+    text.add_argument("--json", default=str(DEFAULT_SAMPLE), help="样本题目JSON路径")
+    text.set_defaults(func=bench_text)
+
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    # 基准测试只关心耗时，屏蔽渲染过程中的INFO日志
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
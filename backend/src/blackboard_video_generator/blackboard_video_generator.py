@@ -1,4 +1,4 @@
-from typing import List, Dict, Any, Tuple
+from typing import List, Tuple
 import numpy as np
 import cv2
 from loguru import logger
@@ -7,20 +7,52 @@ import matplotlib.pyplot as plt
 import os
 import time
 import json
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
-# 1️⃣ 添加常量定义：15% 高度专门留给字幕
-MIN_BOTTOM_SAFE = 0.15
-
-from .utils.image_utils import create_blackboard_background, blend_image_to_frame
-from .utils.video_utils import compress_video, get_z_index
+from .utils.video_utils import create_video_writer, PipelinedFrameWriter, concat_segments, get_z_index
+from .utils.memory_utils import current_rss_bytes, peak_rss_bytes, bytes_to_mb
 from .renderers.text_renderer import render_text
-from .renderers.formula_renderer import render_formula
-from .renderers.geometry_renderer import render_geometry
+from .renderers.formula_renderer import (render_formula, measure_formula, formula_max_width, compile_latex_batch,
+                                         reset_formula_route_stats, formula_route_stats)
+from .renderers.geometry_renderer import render_geometry, GeometryPathAnimator
+from .renderers.sprite_cache import sprite_cache_stats, reset_sprite_cache_stats
+from .compositor import compute_frame_spans, StepCompositor
+from .frame_ring import render_with_frame_ring
+from .filtergraph import render_step_filtergraph, filtergraph_supports
+from .animations import resolve_effects, prepare_item_variants
+from .backgrounds import get_background, DEFAULT_BACKGROUND, DEFAULT_BACKGROUND_SEED
+from .scene import Scene, Step, Element, TimelineItem
+from .atlas import SpriteAtlas
+
+# 帧合成的执行方式：
+#   serial        单进程逐步骤合成，写入同一个编码器
+#   pipelined     合成与编码分属两个线程，中间是有界的帧缓冲队列
+#   step_parallel 每个步骤在进程池中独立合成并编码为片段，最后流拷贝拼接
+#   shared_memory 多个合成进程把帧写入共享内存环形缓冲，由单一编码端按帧序读取
+#   filtergraph   把每个步骤编译为 ffmpeg 滤镜图（overlay + fade，平移与高亮用逐帧表达式），合成与编码都在ffmpeg中完成；
+#                 含路径绘制动画的步骤由 Python 合成器渲染为同样编码参数的片段
+EXECUTION_MODES = ('serial', 'pipelined', 'step_parallel', 'shared_memory', 'filtergraph')
+# 并行执行方式需要事先准备好所有步骤，不能与流式模式组合
+STREAMING_EXECUTION_MODES = ('serial', 'pipelined')
+
+DEFAULT_FPS = 30
+DEFAULT_PRESET = 'medium'
+# 草稿模式（供人工审核布局与时间轴的快速渲染）：输出分辨率与公式光栅化DPI的缩放比例、帧率、编码预设
+DRAFT_RENDER_SCALE = 0.5
+DRAFT_FPS = 15
+DRAFT_PRESET = 'ultrafast'
+# 布局测量值与光栅化结果的允许误差：光栅化后超出安全区不到该比例时不再缩放图像
+LAYOUT_TOLERANCE = 0.02
 
 class BlackboardVideoGenerator:
     """黑板视频生成器"""
     
-    def __init__(self, width: int = 1920, height: int = 1080, debug: bool = False):
+    def __init__(self, width: int = 1920, height: int = 1080, debug: bool = False,
+                 encoder: str = "ffmpeg", vfr: bool = False,
+                 execution: str = "serial", workers: int = None, pipeline_depth: int = 4,
+                 streaming: bool = False, draft: bool = False):
         """
         初始化黑板视频生成器
         
@@ -28,11 +60,46 @@ class BlackboardVideoGenerator:
             width: 视频宽度
             height: 视频高度
             debug: 是否启用调试模式
+            encoder: 视频编码后端，"ffmpeg"（管道直送libx264，单次编码）或 "opencv"（mp4v后再压缩）
+            vfr: 是否输出可变帧率视频（静止画面只编码为一帧长时长帧）
+            execution: 帧合成的执行方式，见 EXECUTION_MODES
+            workers: step_parallel / shared_memory 模式下的进程数，默认为 CPU 核数
+            pipeline_depth: pipelined 模式下合成端与编码端之间的帧缓冲数量
+            streaming: 流式模式，逐个步骤渲染元素、合成并释放，峰值内存只取决于最大的单个步骤
+                       （仅支持 STREAMING_EXECUTION_MODES 中的执行方式）
+            draft: 草稿模式，按 DRAFT_RENDER_SCALE 降低输出分辨率和公式DPI，并使用 DRAFT_FPS 与 DRAFT_PRESET。
+                   元素尺寸与输出分辨率同比缩小，布局（0-1 比例坐标）与正式输出一致
         """
+        if execution not in EXECUTION_MODES:
+            raise ValueError(f"未知的执行方式: {execution}，可选值: {EXECUTION_MODES}")
+        if streaming and execution not in STREAMING_EXECUTION_MODES:
+            raise ValueError(f"流式模式只支持以下执行方式: {STREAMING_EXECUTION_MODES}")
         self.width = width
         self.height = height
         self.debug = debug
+        self.encoder = encoder
+        self.vfr = vfr
+        self.execution = execution
+        self.workers = workers or os.cpu_count() or 1
+        self.pipeline_depth = pipeline_depth
+        # 最近一次 pipelined 渲染的背压统计（PipelineMetrics），用于判断瓶颈在合成端还是编码端
+        self.last_pipeline_metrics = None
+        self.streaming = streaming
+        self.draft = draft
+        self.render_scale = DRAFT_RENDER_SCALE if draft else 1.0
+        self.fps = DRAFT_FPS if draft else DEFAULT_FPS
+        self.preset = DRAFT_PRESET if draft else DEFAULT_PRESET
+        # 实际输出帧的像素尺寸；元素图像按同一比例渲染，因此尺寸比例和布局与 width/height 下一致
+        self.frame_width, self.frame_height = self._frame_size(width, height)
+        # 最近一次运行的统计（各步骤RSS采样与进程峰值RSS），见 generate_video
+        self.last_run_stats = None
+        # 本次任务所有精灵的图集，元素图像是图集页的视图
+        self.atlas = SpriteAtlas()
         self.logger = logger.bind(context="blackboard_video")
+        if execution == 'filtergraph' and vfr:
+            self.logger.warning("filtergraph 执行方式不支持VFR输出，将使用恒定帧率")
+        if draft:
+            self.logger.info(f"草稿模式: {self.frame_width}x{self.frame_height}@{self.fps}fps, 编码预设 {self.preset}")
         
         # 确保debug模式下日志级别生效
         if self.debug:
@@ -42,6 +109,13 @@ class BlackboardVideoGenerator:
         # 配置matplotlib
         self._setup_matplotlib()
         
+    def _frame_size(self, width: int, height: int) -> Tuple[int, int]:
+        """按 render_scale 计算输出帧尺寸；缩放后取偶数以满足 yuv420p 编码的要求"""
+        if self.render_scale == 1.0:
+            return width, height
+        return (max(2, int(width * self.render_scale) // 2 * 2),
+                max(2, int(height * self.render_scale) // 2 * 2))
+
     def _setup_matplotlib(self):
         """配置matplotlib的渲染设置"""
         # 设置中文字体
@@ -69,55 +143,33 @@ class BlackboardVideoGenerator:
             except Exception as e:
                 self.logger.warning(f"无法获取字体列表: {str(e)}")
     
-    def _scale_step_content(self, step: dict) -> None:
+    def _fit_scale(self, step: Step) -> float:
         """
-        计算 (1) 纵向可用高度、(2) 横向可用宽度 ，
-        取二者里更严格的缩放因子，等比缩小元素 & 行间距。
+        根据元素当前的 size 计算 (1) 纵向可用高度、(2) 横向可用宽度 ，
+        取二者里更严格的缩放因子（不大于 1）。
         """
-        safe = step.get("safe_zone") or {}
-        safe_left   = safe.get("left", 0.05) 
-        safe_top    = safe.get("top", 0.05)
-        safe_bottom = max(safe.get("bottom", MIN_BOTTOM_SAFE), MIN_BOTTOM_SAFE)
-        safe_right  = safe.get("right", 0.40)
-
-        vertical_spacing_val = step.get("vertical_spacing")
-        v_space = vertical_spacing_val if vertical_spacing_val is not None else 0.02
-        elems   = step.get("elements", [])
+        safe = step.safe_zone
+        v_space = step.vertical_spacing
+        elems = step.elements
+        if not elems:
+            return 1.0
 
         # ---------- ① 纵向约束 ----------
-        valid_elems_for_h_ratio = [el for el in elems if "size" in el and isinstance(el["size"], tuple) and len(el["size"]) == 2]
-        if not valid_elems_for_h_ratio and elems:
-             self.logger.warning(f"Step {step.get('step_id', 'N/A')}: No valid element sizes found for vertical scaling. Skipping vertical scaling constraint.")
-             scale_v = 1.0
-        elif not valid_elems_for_h_ratio:
+        total_h_ratio = sum(el.size[1] for el in elems) + v_space * (len(elems) - 1)
+        avail_h_ratio = safe.height
+        if avail_h_ratio <= 0:
+            self.logger.warning(f"Step {step.step_id}: Available height ratio non-positive ({avail_h_ratio:.3f}). Using scale_v=1.0.")
             scale_v = 1.0
+        elif total_h_ratio > 0:
+            scale_v = avail_h_ratio / total_h_ratio
         else:
-            total_h_ratio = sum(el["size"][1] for el in valid_elems_for_h_ratio) \
-                            + v_space * (len(valid_elems_for_h_ratio) - 1 if len(valid_elems_for_h_ratio) > 1 else 0)
-            avail_h_ratio = 1.0 - safe_top - safe_bottom
-            if avail_h_ratio <= 0:
-                self.logger.warning(f"Step {step.get('step_id', 'N/A')}: Available height ratio non-positive ({avail_h_ratio:.3f}). Using scale_v=1.0.")
-                scale_v = 1.0
-            elif total_h_ratio > 0:
-                scale_v = avail_h_ratio / total_h_ratio
-            else:
-                scale_v = 1.0
+            scale_v = 1.0
         
         # ---------- ② 横向约束 ----------
-        valid_elems_for_w_ratio = [el for el in elems if "size" in el and isinstance(el["size"], tuple) and len(el["size"]) == 2]
-        if not valid_elems_for_w_ratio and elems:
-            max_w_ratio = 0.0 # Or handle as error/warning
-            self.logger.warning(f"Step {step.get('step_id', 'N/A')}: No valid element sizes found for horizontal scaling. Skipping horizontal scaling constraint.")
-            scale_h = 1.0
-        elif not valid_elems_for_w_ratio: # No elements
-            max_w_ratio = 0.0
-            scale_h = 1.0
-        else:
-            max_w_ratio = max(el["size"][0] for el in valid_elems_for_w_ratio) if valid_elems_for_w_ratio else 0.0
-            
-        avail_w_ratio = 1.0 - safe_left - safe_right
+        max_w_ratio = max(el.size[0] for el in elems)
+        avail_w_ratio = safe.width
         if avail_w_ratio <= 0:
-            self.logger.warning(f"Step {step.get('step_id', 'N/A')}: Available width ratio non-positive ({avail_w_ratio:.3f}). Using scale_h=1.0.")
+            self.logger.warning(f"Step {step.step_id}: Available width ratio non-positive ({avail_w_ratio:.3f}). Using scale_h=1.0.")
             scale_h = 1.0
         elif max_w_ratio > 0:
             scale_h = avail_w_ratio / max_w_ratio
@@ -128,331 +180,630 @@ class BlackboardVideoGenerator:
         scale_h = max(0.001, scale_h)
 
         scale = min(scale_v, scale_h, 1.0)
-        if scale >= 1.0:    
-            for el in elems: # Ensure image and size keys exist
-                if "image" not in el: el["image"] = np.zeros((1,1,3), dtype=np.uint8)
-                if "size" not in el: el["size"] = (0.0, 0.0)
-            return
+        if self.debug and scale < 1.0:
+            self.logger.info(
+                f"Step {step.step_id} 自动缩放: scale_v={scale_v:.3f}, "
+                f"scale_h={scale_h:.3f}, 使用={scale:.3f}"
+            )
+        return scale
 
-        step["vertical_spacing"] = v_space * scale
+    def _resize_element(self, el: Element, scale: float) -> None:
+        """把已光栅化的元素图像等比缩小（INTER_AREA），并更新 size"""
+        h,  w = el.image.shape[:2]
+        new_w, new_h = max(1, int(w * scale)), max(1, int(h * scale))
+        el.image = cv2.resize(el.image, (new_w, new_h),
+                              interpolation=cv2.INTER_AREA)
+        el.size = (new_w / self.frame_width, new_h / self.frame_height)
 
-        for el in elems:
-            if "image" not in el or "size" not in el : # Should have been set by now
-                 self.logger.warning(f"Step {step.get('step_id', 'N/A')}, Element: Missing 'image' or 'size' during scaling. Element might not be rendered correctly.")
-                 if "image" not in el: el["image"] = np.zeros((1,1,3), dtype=np.uint8) # Placeholder
-                 if "size" not in el: el["size"] = (0.0,0.0) # Placeholder
+    def _scale_step_content(self, step: Step, tolerance: float = 0.0) -> None:
+        """
+        按 _fit_scale 等比缩小已光栅化的元素 & 行间距。
 
-            img = el["image"]
-            h,  w = img.shape[:2]
-            new_w, new_h = max(1, int(w * scale)), max(1, int(h * scale))
-            el["image"]  = cv2.resize(img, (new_w, new_h),
-                                    interpolation=cv2.INTER_AREA)
-            el["size"]   = (new_w / self.width, new_h / self.height)
+        Args:
+            step: 步骤（元素已带有 image）
+            tolerance: 允许的溢出比例，缩放因子不小于 1 - tolerance 时不缩放
+        """
+        scale = self._fit_scale(step)
+        if scale >= 1.0 - tolerance:    
+            return
 
-        if self.debug:
-            self.logger.info(
-                f"Step {step.get('step_id', 'N/A')} 自动缩放: scale_v={scale_v:.3f}, "
-                f"scale_h={scale_h:.3f}, 使用={scale:.3f}"
-            )
+        step.vertical_spacing *= scale
+        for el in step.elements:
+            self._resize_element(el, scale)
 
-    def _auto_vertical_stack(self, step: dict) -> None:
+    def _auto_vertical_stack(self, step: Step) -> None:
         """
         把 center 定义在可见内容区：
             左 = safe_left，右 = 1 - safe_right
         无论 text / formula / geometry 都水平居中摆放；
         有显式 'position' 的，用户给的 x 被解释为相对于安全区。
         """
-        safe  = step.get('safe_zone') or {}
-        safe_left   = safe.get('left', 0.05)       
-        safe_top    = safe.get('top', 0.05)
-        safe_bottom = max(safe.get('bottom', MIN_BOTTOM_SAFE), MIN_BOTTOM_SAFE)
-        safe_right  = safe.get('right', 0.40)
-
-        safe_area_w = 1.0 - safe_left - safe_right
-        step_id_for_log = step.get('step_id', 'N/A')
+        safe = step.safe_zone
+        safe_area_w = safe.width
         
         content_area_horizontal_center: float
         if safe_area_w <= 0:
             self.logger.warning(
-                f"Step {step_id_for_log} in _auto_vertical_stack: "
+                f"Step {step.step_id} in _auto_vertical_stack: "
                 f"Safe area width is non-positive ({safe_area_w:.3f}). "
                 f"Elements will be centered globally for X (0.5)."
             )
             content_area_horizontal_center = 0.5 
         else:
-            content_area_horizontal_center = safe_left + safe_area_w / 2
-
-        vertical_spacing_val = step.get("vertical_spacing")
-        v_space = vertical_spacing_val if vertical_spacing_val is not None else 0.02
+            content_area_horizontal_center = safe.left + safe_area_w / 2
 
-        y_cursor = safe_top 
-        for el in step.get('elements', []):
-            if "size" not in el or not isinstance(el["size"], tuple) or len(el["size"]) != 2:
-                self.logger.warning(f"Step {step_id_for_log}, Element type {el.get('type', 'Unknown')}: Skipping in _auto_vertical_stack due to missing or invalid 'size'.")
-                continue
-
-            _w_ratio, h_ratio = el['size'] 
+        y_cursor = safe.top 
+        for el in step.elements:
+            _w_ratio, h_ratio = el.size 
 
             current_x_global: float
-            if el.get('position') and el['position'][0] is not None:
-                json_rel_x = el['position'][0] 
+            if el.position is not None and el.position[0] is not None:
+                json_rel_x = el.position[0] 
                 if safe_area_w <= 0: 
                     current_x_global = 0.5 
-                    self.logger.warning(f"Step {step_id_for_log}, Element type {el.get('type', 'Unknown')}: Using global center X due to non-positive safe_area_w in _auto_vertical_stack with provided relative X.")
+                    self.logger.warning(f"Step {step.step_id}, Element type {el.type}: Using global center X due to non-positive safe_area_w in _auto_vertical_stack with provided relative X.")
                 else:
-                    current_x_global = safe_left + json_rel_x * safe_area_w
+                    current_x_global = safe.left + json_rel_x * safe_area_w
             else: 
                 current_x_global = content_area_horizontal_center
             
             anchor_y_global = y_cursor + h_ratio / 2
-            el['position'] = [current_x_global, anchor_y_global] 
+            el.center = (current_x_global, anchor_y_global)
+
+            y_cursor += h_ratio + step.vertical_spacing
+
+    def _measure_element(self, element: Element, step_id_for_log) -> None:
+        """
+        布局的测量阶段：不光栅化，只根据字体/TeX 盒子尺寸求出元素在 render_scale 下的 size。
+        几何图形（绘制本身很便宜）以及测量失败的元素在此直接光栅化，写入 element.image
+        """
+        element.image = None
+        element.raster_scale = 1.0
+        if element.type in ('formula', 'text'):
+            try:
+                width, height = measure_formula(element.content, element.font_size, self.render_scale, skip_scaling=True)
+                # 渲染器的最大宽度限制折算进元素自身的光栅化比例，光栅化后不再缩小图像
+                if width > formula_max_width(self.render_scale):
+                    element.raster_scale = formula_max_width(self.render_scale) / width
+                element.size = (width * element.raster_scale / self.frame_width,
+                                height * element.raster_scale / self.frame_height)
+                return
+            except Exception as e:
+                self.logger.warning(f"Step {step_id_for_log}, Element {element.type}: 测量失败 ({e})，先光栅化再缩放")
+        self._render_element(element, step_id_for_log)
+
+    def _render_element(self, element: Element, step_id_for_log, fit_scale: float = 1.0,
+                        measured: bool = False) -> None:
+        """
+        渲染单个元素的图像，写入 element.image 与 element.size
+
+        Args:
+            element: 元素
+            step_id_for_log: 步骤编号（用于日志）
+            fit_scale: 布局求解得到的缩放因子
+            measured: 元素已经过 _measure_element 测量，文本和公式直接以 render_scale * raster_scale * fit_scale
+                光栅化，不再经过渲染器的最大宽度缩放
+        """
+        img = None
+        if element.type in ('formula', 'text'):
+            # 文本也可能包含LaTeX公式，所以统一使用 render_formula
+            img = render_formula(element.content, element.font_size, self.debug,
+                                 self.render_scale * element.raster_scale * fit_scale, skip_scaling=measured)
+        elif element.type == 'geometry':
+            img = render_geometry(element.content, scale_factor=element.scale, debug=self.debug)
+            geometry_scale = self.render_scale * fit_scale
+            if geometry_scale != 1.0:
+                # 几何图形的画布尺寸固定，按输出分辨率与布局缩放同比缩小（路径动画器会按缩小后的尺寸重新绘制）
+                img = cv2.resize(img, (max(1, int(img.shape[1] * geometry_scale)),
+                                       max(1, int(img.shape[0] * geometry_scale))),
+                                 interpolation=cv2.INTER_AREA)
+        
+        if img is None:
+            element.image = np.zeros((1,1,4), dtype=np.uint8) # Use 4 channels for alpha
+            element.size = (0.0, 0.0)
+            self.logger.warning(f"Step {step_id_for_log}, Element type {element.type}: Failed to render. Using placeholder image.")
+        else:
+            element.image = img # This is BGRA from renderers
+            element.size = (img.shape[1] / self.frame_width, img.shape[0] / self.frame_height)
+
+    def _prepare_step(self, step: Step) -> Step:
+        """
+        渲染单个步骤的所有元素，并完成缩放与布局
+        
+        Args:
+            step: 场景中的步骤，布局结果直接写入其元素
+            
+        Returns:
+            同一个步骤（元素带有 image / size / 全局 center）
+        """
+        step_id_for_log = step.step_id
+        safe = step.safe_zone
+        safe_area_w = safe.width
+        safe_area_h = safe.height
 
-            y_cursor += h_ratio + v_space
+        if safe_area_w <= 0:
+            self.logger.warning(f"Step {step_id_for_log}: Safe area width non-positive ({safe_area_w:.3f}). Positioning may be affected.")
+        if safe_area_h <= 0:
+            self.logger.warning(f"Step {step_id_for_log}: Safe area height non-positive ({safe_area_h:.3f}). Positioning may be affected.")
+
+        # 两阶段布局：先测量所有元素并求解安全区缩放因子，再按最终尺寸光栅化，每个元素只光栅化一次
+        for element in step.elements:
+            self._measure_element(element, step_id_for_log)
+        fit_scale = self._fit_scale(step)
+        step.vertical_spacing *= fit_scale
+        for element in step.elements:
+            if element.image is None:
+                self._render_element(element, step_id_for_log, fit_scale, measured=True)
+            elif fit_scale < 1.0:
+                # 测量阶段已经光栅化的元素只能缩小图像
+                self._resize_element(element, fit_scale)
+        
+        # 测量值与实际图像有少量误差；误差超出 LAYOUT_TOLERANCE 时回退为缩放光栅化后的图像
+        self._scale_step_content(step, LAYOUT_TOLERANCE)
+        
+        if step.layout == 'vertical-stack':
+            self._auto_vertical_stack(step)
+        else:
+            # 对于自由布局，根据JSON中的位置进行渲染
+            # 新增：自动调整垂直重叠的文本元素
+            elements_to_render = step.elements
+            for i in range(1, len(elements_to_render)):
+                prev_el = elements_to_render[i-1]
+                curr_el = elements_to_render[i]
+                
+                # 确保元素有位置
+                if prev_el.position is None or curr_el.position is None:
+                    continue
+
+                # 只处理x坐标相近的文本元素
+                if prev_el.type == 'text' and curr_el.type == 'text':
+                    # 假设position[0]是相对安全区的x坐标
+                    is_vertically_aligned = abs(prev_el.position[0] - curr_el.position[0]) < 0.05
+                    
+                    if is_vertically_aligned:
+                        prev_h = prev_el.size[1]
+                        curr_h = curr_el.size[1]
+                        prev_y = prev_el.position[1]
+                        curr_y = curr_el.position[1]
+                        
+                        # 元素边界计算（以中心点为基准）
+                        prev_bottom = prev_y + prev_h / 2
+                        curr_top = curr_y - curr_h / 2
+                        
+                        vertical_gap = 0.02 # 定义一个最小的垂直间距
+
+                        if curr_top < prev_bottom + vertical_gap:
+                            # 重叠，调整当前元素的y坐标
+                            new_y = prev_bottom + curr_h / 2 + vertical_gap
+                            curr_el.position = (curr_el.position[0], new_y)
+                            if self.debug:
+                                self.logger.info(f"Step {step_id_for_log}: 自动调整重叠文本。元素 {i} 的Y坐标从 {curr_y:.3f} 调整为 {new_y:.3f}")
+
+            for element in step.elements:
+                if element.position is not None: 
+                    json_pos_x, json_pos_y = element.position
+                    
+                    global_center_x = 0.5 # Default global center X
+                    global_center_y = 0.5 # Default global center Y
 
-    def generate_video(self, blackboard_data: dict) -> str:
+                    if safe_area_w > 0:
+                        global_center_x = safe.left + json_pos_x * safe_area_w
+                    else:
+                        self.logger.warning(f"Step {step_id_for_log}, Element {element.type}: Using global center X due to non-positive safe_area_w for non-vertical_stack.")
+                    
+                    if safe_area_h > 0:
+                        global_center_y = safe.top + json_pos_y * safe_area_h
+                    else:
+                        self.logger.warning(f"Step {step_id_for_log}, Element {element.type}: Using global center Y due to non-positive safe_area_h for non-vertical_stack.")
+                        
+                    element.center = (global_center_x, global_center_y)
+                else:
+                    default_x = 0.5
+                    default_y = 0.5
+                    if safe_area_w > 0: default_x = safe.left + 0.5 * safe_area_w
+                    if safe_area_h > 0: default_y = safe.top + 0.5 * safe_area_h
+                    element.center = (default_x, default_y)
+                    self.logger.info(
+                        f"Step {step_id_for_log}, Element {element.type}: "
+                        f"No 'position' in JSON for non-vertical-stack. Defaulting to global {element.center} (safe area center if valid)."
+                    )
+        self._check_label_alignment(step)
+        # 布局完成后图像尺寸不再变化，打包进图集，元素改为引用图集页的视图
+        images = self.atlas.pack([element.image for element in step.elements])
+        for element, image in zip(step.elements, images):
+            element.image = image
+        return step
+
+    def _check_label_alignment(self, step: Step) -> None:
+        """检查步骤中几何图形与文本标签（O/A/B/C）是否需要对齐"""
+        has_geometry = any(element.type == 'geometry' for element in step.elements)
+        has_labels = any(element.type == 'text' and element.content in ['O', 'A', 'B', 'C'] for element in step.elements)
+        
+        if has_geometry and has_labels:
+            self.logger.info(f"Step {step.step_id}: 检测到几何图形和文本标签，调整位置以确保匹配 (此部分逻辑未实现)")
+
+    def _create_path_animator(self, element: Element, content: np.ndarray, step_id_for_log) -> GeometryPathAnimator:
+        """
+        为 draw_path 入场的元素创建增量路径动画器，输出尺寸与布局后的元素图像一致
+
+        Returns:
+            GeometryPathAnimator；元素不是几何图形或几何数据无效时返回 None（调用方回退为淡入）
+        """
+        if element.type != 'geometry':
+            self.logger.warning(f"Step {step_id_for_log}, Element {element.type}: draw_path 只支持几何图形，使用 fade_in")
+            return None
+        try:
+            return GeometryPathAnimator(element.content, element.scale, content.shape[:2], self.debug)
+        except Exception as e:
+            self.logger.warning(f"Step {step_id_for_log}, Element {element.type}: 创建路径动画失败 ({e})，使用 fade_in")
+            return None
+
+    def _build_timeline(self, step: Step, fps: int) -> List[TimelineItem]:
+        """
+        根据步骤中已渲染的元素构建按 z_index 排序的时间轴
+        
+        Args:
+            step: 处理后的步骤
+            fps: 帧率
+            
+        Returns:
+            时间轴元素列表
+        """
+        total_frames = step.total_frames(fps)
+        step_id_for_log = step.step_id
+        timeline = []
+        
+        for element in step.elements:
+            content = element.image # Should be scaled BGRA image
+            
+            if content is None or content.size == 0:
+                self.logger.warning(f"Step {step_id_for_log}, Element {element.type}: Content image is missing or invalid. Skipping element in timeline.")
+                continue
+
+            # Position should be global by now
+            position = element.center
+            if position is None:
+                self.logger.warning(f"Step {step_id_for_log}, Element {element.type}: Position is missing or invalid. Defaulting to [0.5, 0.5].")
+                position = (0.5, 0.5) # Default global center
+            
+            animation = element.animation
+            fade_in_frames = 0
+            fade_out_frames = 0
+            enter_effect = exit_effect = None
+            
+            if animation:
+                # fade_in_frames / fade_out_frames 是入场/退场动画的帧数，具体效果见 animations.py
+                enter_effect, exit_effect = resolve_effects(animation)
+                fade_duration = animation.get('duration', 1.0)
+                fade_in_frames = int(fade_duration * fps)
+                if 'exit' in animation: # Check key existence
+                    fade_out_frames = int(fade_duration * fps)
+
+            path_animator = None
+            if enter_effect == 'draw_path':
+                path_animator = self._create_path_animator(element, content, step_id_for_log)
+                if path_animator is None:
+                    enter_effect = 'fade_in'
+                else:
+                    # 静态显示时也使用动画器画出的完整图形，保证动画结束时画面不跳变
+                    content = path_animator.final_image
+            
+            # 元素在步骤内的出现/消失时间（秒，相对于步骤开始），未指定时覆盖整个步骤
+            start_frame = min(max(int(element.start_time * fps), 0), total_frames)
+            if element.end_time is not None:
+                end_frame = min(max(int(element.end_time * fps), start_frame), total_frames)
+            else:
+                end_frame = total_frames - fade_out_frames if fade_out_frames > 0 else total_frames
+            if end_frame <= start_frame:
+                self.logger.warning(f"Step {step_id_for_log}, Element {element.type}: start_time/end_time 超出步骤时长或顺序错误，元素不会显示")
+            
+            item = TimelineItem(
+                type=element.type,
+                content=content, # This is an image
+                position=position,
+                start_frame=start_frame,
+                end_frame=end_frame,
+                fade_in_frames=fade_in_frames,
+                fade_out_frames=fade_out_frames,
+                enter=enter_effect,
+                exit=exit_effect,
+                path_animator=path_animator,
+                z_index=get_z_index(element.type),
+            )
+            prepare_item_variants(item)
+            timeline.append(item)
+
+        # 路径动画的完整图形和高亮变体同样打包进图集，合成器从图集页的视图混合；
+        # 动画器原地更新的画布留在图集之外，计入图集统计的 private_bytes
+        packed_items = [item for item in timeline if item.path_animator is not None]
+        packed_variants = [(item, name) for item in timeline for name in item.variants]
+        images = self.atlas.pack([item.content for item in packed_items]
+                                 + [item.variants[name] for item, name in packed_variants])
+        for item, image in zip(packed_items, images):
+            item.content = image
+            self.atlas.track_private(item.path_animator.image)
+        for (item, name), image in zip(packed_variants, images[len(packed_items):]):
+            item.variants[name] = image
+
+        timeline.sort(key=lambda x: x.z_index)
+        return timeline
+
+    def _render_step(self, video_writer, background: np.ndarray, step: Step, fps: int,
+                     timeline: List[TimelineItem] = None) -> int:
+        """
+        合成单个步骤的所有帧并写入视频写入器
+        
+        Args:
+            video_writer: 视频帧写入器
+            background: 背景图像
+            step: 处理后的步骤
+            fps: 帧率
+            timeline: 已构建的时间轴，None 时由步骤构建
+            
+        Returns:
+            实际合成的帧数
+        """
+        total_frames = step.total_frames(fps)
+        step_id_for_log = step.step_id
+        if timeline is None:
+            timeline = self._build_timeline(step, fps)
+        
+        # 按淡入淡出区间切分：静止区间只合成一次，同一帧缓冲重复写入
+        compositor = StepCompositor(background, timeline)
+        composited_frames = 0
+        for span_start, span_end, is_static in compute_frame_spans(timeline, total_frames):
+            if is_static:
+                frame = compositor.compose(span_start)
+                composited_frames += 1
+                video_writer.write_hold(frame, span_end - span_start)
+            else:
+                for frame_idx in range(span_start, span_end):
+                    frame = compositor.compose(frame_idx)
+                    composited_frames += 1
+                    video_writer.write(frame)
+            
+            # 显示进度
+            self.logger.info(f"正在生成视频 {span_end}/{total_frames} 帧 ({span_end/total_frames*100:.1f}%)")
+        
+        self.logger.info(f"Step {step_id_for_log}: 共 {total_frames} 帧，实际合成 {composited_frames} 帧")
+        return composited_frames
+
+    def _record_memory(self, run_stats: dict, step: Step, phase: str) -> None:
+        """
+        记录一次RSS采样到运行统计中
+        
+        Args:
+            run_stats: 本次运行的统计字典
+            step: 当前步骤，None 表示全部步骤
+            phase: 采样时机（prepare / render）
+        """
+        rss_mb = bytes_to_mb(current_rss_bytes())
+        step_id = step.step_id if step is not None else None
+        run_stats['steps'].append({'step_id': step_id, 'phase': phase, 'rss_mb': rss_mb})
+        if rss_mb is not None:
+            self.logger.debug(f"Step {step_id if step_id is not None else 'all'} {phase} 后RSS: {rss_mb:.1f} MB")
+
+    def _record_atlas(self, run_stats: dict, step: Step = None) -> None:
+        """
+        记录图集的内存与碎片统计；流式模式下逐步骤记录，保留页面占用最大的一次
+
+        Args:
+            run_stats: 本次运行的统计字典
+            step: 当前步骤，None 表示全部步骤
+        """
+        stats = self.atlas.stats()
+        previous = run_stats.get('atlas')
+        if previous is None or stats['used_bytes'] >= previous['used_bytes']:
+            run_stats['atlas'] = stats
+        self.logger.debug(
+            f"Step {step.step_id if step is not None else 'all'} 图集: {stats['pages']} 页，{stats['sprites']} 个精灵，"
+            f"精灵 {bytes_to_mb(stats['sprite_bytes']):.1f} MB / 已用页面 {bytes_to_mb(stats['used_bytes']):.1f} MB，"
+            f"碎片率 {stats['fragmentation'] * 100:.1f}%，图集外 {bytes_to_mb(stats['private_bytes']):.1f} MB")
+
+    def _compile_formulas(self, scene: Scene) -> None:
+        """在布局之前把整道题的 LaTeX 片段一次性批量排版（见 compile_latex_batch）"""
+        formulas = [(element.content, element.font_size)
+                    for step in scene.steps for element in step.elements
+                    if element.type in ('formula', 'text') and isinstance(element.content, str)]
+        if not formulas:
+            return
+        start = time.perf_counter()
+        compiled = compile_latex_batch(formulas)
+        if compiled:
+            self.logger.info(f"LaTeX 批量排版: {compiled} 个片段，耗时 {time.perf_counter() - start:.2f}s")
+
+    def _render_steps_parallel(self, processed_steps: List[Step], background: np.ndarray, fps: int,
+                               width: int, height: int, output_path: str) -> None:
+        """
+        在进程池中把每个步骤独立合成并编码为封闭GOP的片段，再用 concat demuxer 流拷贝拼接
+        
+        Args:
+            processed_steps: 处理后的步骤列表
+            background: 背景图像
+            fps: 帧率
+            width: 视频宽度
+            height: 视频高度
+            output_path: 输出视频文件路径
+        """
+        steps = [step for step in processed_steps if step.total_frames(fps) > 0]
+        if not steps:
+            raise RuntimeError("没有可渲染的步骤")
+
+        workers = min(self.workers, len(steps))
+        # 各进程的编码器平分CPU，避免线程超额订阅
+        encoder_threads = max(1, (os.cpu_count() or 1) // workers)
+        generator_options = {
+            'width': self.width, 'height': self.height, 'debug': self.debug,
+            'encoder': self.encoder, 'vfr': self.vfr, 'draft': self.draft,
+        }
+
+        segment_dir = tempfile.mkdtemp(prefix='blackboard_segments_', dir=os.path.dirname(output_path) or None)
+        try:
+            segment_paths = [os.path.join(segment_dir, f"step_{idx:04d}.mp4") for idx in range(len(steps))]
+            self.logger.info(f"并行渲染 {len(steps)} 个步骤片段，进程数: {workers}")
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_step_worker,
+                                     initargs=(background,)) as executor:
+                futures = [
+                    executor.submit(_render_step_segment, generator_options, step, fps,
+                                    width, height, segment_path, encoder_threads)
+                    for step, segment_path in zip(steps, segment_paths)
+                ]
+                composited_frames = sum(future.result() for future in futures)
+            self.logger.info(f"所有步骤片段渲染完成，共合成 {composited_frames} 帧")
+            concat_segments(segment_paths, output_path, self.logger)
+        finally:
+            shutil.rmtree(segment_dir, ignore_errors=True)
+
+    def _render_steps_filtergraph(self, processed_steps: List[Step], background: np.ndarray, fps: int,
+                                  output_path: str) -> None:
+        """
+        每个步骤的精灵只写一次PNG，由ffmpeg按滤镜图合成并编码为片段，再流拷贝拼接。
+        滤镜图无法表达的步骤（路径绘制动画）由 StepCompositor 合成，管道送入编码参数相同的ffmpeg写入器
+        
+        Args:
+            processed_steps: 处理后的步骤列表
+            background: 背景图像
+            fps: 帧率
+            output_path: 输出视频文件路径
+        """
+        steps = [step for step in processed_steps if step.total_frames(fps) > 0]
+        if not steps:
+            raise RuntimeError("没有可渲染的步骤")
+
+        work_dir = tempfile.mkdtemp(prefix='blackboard_filtergraph_', dir=os.path.dirname(output_path) or None)
+        try:
+            background_path = os.path.join(work_dir, "background.png")
+            cv2.imwrite(background_path, background)
+            segment_paths = []
+            for idx, step in enumerate(steps):
+                total_frames = step.total_frames(fps)
+                timeline = self._build_timeline(step, fps)
+                segment_path = os.path.join(work_dir, f"step_{idx:04d}.mp4")
+                if filtergraph_supports(timeline):
+                    render_step_filtergraph(background_path, timeline, background.shape, total_frames, fps,
+                                            segment_path, work_dir, f"step_{idx:04d}", preset=self.preset)
+                    self.logger.info(f"Step {step.step_id}: ffmpeg滤镜图合成 {total_frames} 帧，"
+                                     f"{len(timeline)} 个精灵")
+                else:
+                    height, width = background.shape[:2]
+                    video_writer = create_video_writer(segment_path, fps, width, height, backend='ffmpeg',
+                                                       preset=self.preset, logger=self.logger)
+                    try:
+                        self._render_step(video_writer, background, step, fps, timeline)
+                        video_writer.release()
+                    except BaseException:
+                        video_writer.abort()
+                        raise
+                    self.logger.info(f"Step {step.step_id}: 含滤镜图不支持的入场效果，由Python合成器渲染")
+                segment_paths.append(segment_path)
+            concat_segments(segment_paths, output_path, self.logger)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def generate_video(self, blackboard_data) -> str:
         """
         生成黑板视频
         
         Args:
-            blackboard_data: 黑板数据字典
+            blackboard_data: 黑板数据字典，或已编译的 Scene
             
         Returns:
             临时视频文件路径
         """
+        video_writer = None
         try:
-            input_steps = blackboard_data.get('steps', [])
+            # 只解析和校验一次，之后的布局、时间轴与合成阶段共享同一个场景
+            scene = blackboard_data if isinstance(blackboard_data, Scene) else Scene.from_dict(blackboard_data)
+            input_steps = scene.steps
             if not input_steps:
                 self.logger.error("未找到步骤数据")
                 return ""
                 
-            processed_steps = []
-
-            for step_data in input_steps:
-                current_step = {key: value for key, value in step_data.items()} # Deepcopy if complex, shallow for dicts of primitives
-                elements_in_step_data = current_step.get('elements', [])
-                current_step['elements'] = [{key: value for key, value in el.items()} for el in elements_in_step_data]
-
-
-                step_id_for_log = current_step.get('step_id', 'N/A')
-
-                safe_settings = current_step.get("safe_zone") or {}
-                s_top = safe_settings.get("top", 0.05)
-                s_bottom = max(safe_settings.get("bottom", MIN_BOTTOM_SAFE), MIN_BOTTOM_SAFE)
-                s_right = safe_settings.get("right", 0.40)
-                s_left = safe_settings.get("left", 0.05) 
-
-                safe_area_w = 1.0 - s_left - s_right
-                safe_area_h = 1.0 - s_top - s_bottom
-
-                if safe_area_w <= 0:
-                    self.logger.warning(f"Step {step_id_for_log}: Safe area width non-positive ({safe_area_w:.3f}). Positioning may be affected.")
-                if safe_area_h <= 0:
-                    self.logger.warning(f"Step {step_id_for_log}: Safe area height non-positive ({safe_area_h:.3f}). Positioning may be affected.")
-
-                temp_processed_elements = []
-                for element_data in current_step.get('elements', []):
-                    element = element_data # Already a copy
-                    img = None
-                    if element['type'] == 'formula':
-                        img = render_formula(element['content'], element.get('font_size', 32), self.debug)
-                    elif element['type'] == 'text':
-                        # 文本也可能包含LaTeX公式，所以统一使用 render_formula
-                        img = render_formula(element['content'], element.get('font_size', 32), self.debug)
-                    elif element['type'] == 'geometry':
-                        img = render_geometry(element['content'], scale_factor=element.get('scale', 1.0), debug=self.debug)
-                    
-                    if img is None:
-                        element['image'] = np.zeros((1,1,4), dtype=np.uint8) # Use 4 channels for alpha
-                        element['size'] = (0.0, 0.0)
-                        self.logger.warning(f"Step {step_id_for_log}, Element type {element.get('type')}: Failed to render. Using placeholder image.")
-                    else:
-                        element['image'] = img # This is BGRA from renderers
-                        h_ratio = img.shape[0] / self.height
-                        w_ratio = img.shape[1] / self.width
-                        element['size'] = (w_ratio, h_ratio)
-                    temp_processed_elements.append(element)
-                current_step['elements'] = temp_processed_elements
-                
-                self._scale_step_content(current_step)
-                
-                is_vertical_stack_layout = current_step.get('layout') == 'vertical-stack'
-
-                if is_vertical_stack_layout:
-                    self._auto_vertical_stack(current_step)
-                else:
-                    # 对于自由布局，根据JSON中的位置进行渲染
-                    # 新增：自动调整垂直重叠的文本元素
-                    elements_to_render = current_step.get('elements', [])
-                    for i in range(1, len(elements_to_render)):
-                        prev_el = elements_to_render[i-1]
-                        curr_el = elements_to_render[i]
-                        
-                        # 确保元素有尺寸和位置
-                        if 'size' not in prev_el or 'size' not in curr_el or 'position' not in prev_el or 'position' not in curr_el:
-                            continue
-
-                        # 只处理x坐标相近的文本元素
-                        if prev_el['type'] == 'text' and curr_el['type'] == 'text':
-                            # 假设position[0]是相对安全区的x坐标
-                            is_vertically_aligned = abs(prev_el['position'][0] - curr_el['position'][0]) < 0.05
-                            
-                            if is_vertically_aligned:
-                                prev_h = prev_el['size'][1]
-                                curr_h = curr_el['size'][1]
-                                prev_y = prev_el['position'][1]
-                                curr_y = curr_el['position'][1]
-                                
-                                # 元素边界计算（以中心点为基准）
-                                prev_bottom = prev_y + prev_h / 2
-                                curr_top = curr_y - curr_h / 2
-                                
-                                vertical_gap = 0.02 # 定义一个最小的垂直间距
-
-                                if curr_top < prev_bottom + vertical_gap:
-                                    # 重叠，调整当前元素的y坐标
-                                    new_y = prev_bottom + curr_h / 2 + vertical_gap
-                                    curr_el['position'][1] = new_y
-                                    if self.debug:
-                                        self.logger.info(f"Step {step_id_for_log}: 自动调整重叠文本。元素 {i} 的Y坐标从 {curr_y:.3f} 调整为 {new_y:.3f}")
-
-                    for element in current_step.get('elements', []):
-                        element_type_for_log = element.get('type', 'Unknown')
-                        if element.get('position'): 
-                            json_pos_x = element['position'][0]
-                            json_pos_y = element['position'][1]
-                            
-                            global_center_x = 0.5 # Default global center X
-                            global_center_y = 0.5 # Default global center Y
-
-                            if safe_area_w > 0:
-                                global_center_x = s_left + json_pos_x * safe_area_w
-                            else:
-                                self.logger.warning(f"Step {step_id_for_log}, Element {element_type_for_log}: Using global center X due to non-positive safe_area_w for non-vertical_stack.")
-                            
-                            if safe_area_h > 0:
-                                global_center_y = s_top + json_pos_y * safe_area_h
-                            else:
-                                self.logger.warning(f"Step {step_id_for_log}, Element {element_type_for_log}: Using global center Y due to non-positive safe_area_h for non-vertical_stack.")
-                                
-                            element['position'] = [global_center_x, global_center_y]
-                        else:
-                            default_x = 0.5
-                            default_y = 0.5
-                            if safe_area_w > 0: default_x = s_left + 0.5 * safe_area_w
-                            if safe_area_h > 0: default_y = s_top + 0.5 * safe_area_h
-                            element['position'] = [default_x, default_y]
-                            self.logger.info(
-                                f"Step {step_id_for_log}, Element {element_type_for_log}: "
-                                f"No 'position' in JSON for non-vertical-stack. Defaulting to global {element['position']} (safe area center if valid)."
-                            )
-                processed_steps.append(current_step)
+            run_stats = {'streaming': self.streaming, 'steps': []}
+            self.last_run_stats = run_stats
+            self.atlas.clear()
+            reset_formula_route_stats()
+            reset_sprite_cache_stats()
+            self._compile_formulas(scene)
+            # 流式模式下步骤在渲染循环中逐个准备，渲染完即释放
+            processed_steps = None if self.streaming else [self._prepare_step(step) for step in input_steps]
+            if processed_steps is not None:
+                self._record_memory(run_stats, None, 'prepare')
+                self._record_atlas(run_stats)
                             
-            width = blackboard_data.get('resolution', [self.width, self.height])[0]
-            height = blackboard_data.get('resolution', [self.width, self.height])[1]
-            fps = 30  
+            width, height = self._frame_size(*(scene.resolution or (self.width, self.height)))
+            fps = self.fps
             
             temp_output_dir = "backend/output"
             if not os.path.exists(temp_output_dir):
                 os.makedirs(temp_output_dir)
             temp_output = os.path.join(temp_output_dir, f"temp_blackboard_{int(time.time())}.mp4")
             
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            video_writer = cv2.VideoWriter(temp_output, fourcc, fps, (width, height))
-            
-            background = create_blackboard_background(width, height)
-            
-            for step in processed_steps:
-                geometry_elements = []
-                text_elements = []
-                step_id_for_log = step.get('step_id', 'N/A')
-                
-                for element in step.get('elements', []):
-                    if element['type'] == 'geometry':
-                        geometry_elements.append(element)
-                    elif element['type'] == 'text' and element.get('content','') in ['O', 'A', 'B', 'C']: # Check content exists
-                        text_elements.append(element)
-                
-                if geometry_elements and text_elements:
-                    self.logger.info(f"Step {step_id_for_log}: 检测到几何图形和文本标签，调整位置以确保匹配 (此部分逻辑未实现)")
+            # 背景由纹理名称和种子确定，同一题目的多次渲染逐像素一致；只读，合成时先复制
+            background = get_background(width, height,
+                                        scene.background or DEFAULT_BACKGROUND,
+                                        scene.background_seed if scene.background_seed is not None else DEFAULT_BACKGROUND_SEED)
             
-            for step in processed_steps:
-                total_frames = int(step.get('duration',0) * fps) # Ensure duration exists
-                step_id_for_log = step.get('step_id', 'N/A')
-                timeline = []
-                
-                for element in step.get('elements', []):
-                    element_type = element.get('type', 'unknown')
-                    
-                    content = element.get('image') # Should be scaled BGRA image
-                    
-                    if content is None or not isinstance(content, np.ndarray) or content.size == 0 :
-                        self.logger.warning(f"Step {step_id_for_log}, Element {element_type}: Content image is missing or invalid. Skipping element in timeline.")
-                        continue
-
-                    # Position should be global by now
-                    position = element.get('position')
-                    if position is None or len(position) != 2:
-                        self.logger.warning(f"Step {step_id_for_log}, Element {element_type}: Position is missing or invalid. Defaulting to [0.5, 0.5].")
-                        position = [0.5, 0.5] # Default global center
-                    
-                    animation = element.get('animation', {})
-                    fade_in_frames = 0
-                    fade_out_frames = 0
-                    
-                    if animation and isinstance(animation, dict): # Check animation is a dict
-                        fade_duration = animation.get('duration', 1.0)
-                        fade_in_frames = int(fade_duration * fps)
-                        if 'exit' in animation: # Check key existence
-                            fade_out_frames = int(fade_duration * fps)
-                    
-                    timeline.append({
-                        'type': element_type,
-                        'content': content, # This is an image
-                        'position': position,
-                        'start_frame': 0, # Simplified start/end for now
-                        'end_frame': total_frames - fade_out_frames if fade_out_frames > 0 else total_frames,
-                        'fade_in_frames': fade_in_frames,
-                        'fade_out_frames': fade_out_frames,
-                        'z_index': get_z_index(element_type)
-                    })
-                
-                timeline.sort(key=lambda x: x['z_index'])
+            if self.execution == 'step_parallel':
+                self._render_steps_parallel(processed_steps, background, fps, width, height, temp_output)
+            elif self.execution == 'filtergraph':
+                self._render_steps_filtergraph(processed_steps, background, fps, temp_output)
+            else:
+                video_writer = create_video_writer(temp_output, fps, width, height, backend=self.encoder,
+                                                   preset=self.preset, vfr=self.vfr, logger=self.logger)
+                if self.execution == 'shared_memory':
+                    timelines = [self._build_timeline(step, fps) for step in processed_steps]
+                    frame_counts = [step.total_frames(fps) for step in processed_steps]
+                    composited_frames = render_with_frame_ring(video_writer, background, timelines,
+                                                               frame_counts, self.workers)
+                    self.logger.info(f"所有步骤合成完成，共合成 {composited_frames} 帧")
+                else:
+                    if self.execution == 'pipelined':
+                        video_writer = PipelinedFrameWriter(video_writer, self.pipeline_depth, self.logger)
+                        self.last_pipeline_metrics = video_writer.metrics
+                    if self.streaming:
+                        for step in input_steps:
+                            self._prepare_step(step)
+                            self._record_memory(run_stats, step, 'prepare')
+                            self._record_atlas(run_stats, step)
+                            self._render_step(video_writer, background, step, fps)
+                            self._record_memory(run_stats, step, 'render')
+                            # 先释放当前步骤的元素图像和图集页，再准备下一个步骤
+                            step.release()
+                            self.atlas.clear()
+                    else:
+                        for step in processed_steps:
+                            self._render_step(video_writer, background, step, fps)
+                            self._record_memory(run_stats, step, 'render')
                 
-                for frame_idx in range(total_frames):
-                    # 复制背景
-                    frame = background.copy()
-                    
-                    # 渲染当前帧的所有元素
-                    for item in timeline:
-                        if item['start_frame'] <= frame_idx < item['end_frame']:
-                            # 计算alpha值（淡入淡出效果）
-                            alpha = 1.0
-                            if item['fade_in_frames'] > 0 and frame_idx < item['fade_in_frames']:
-                                alpha = frame_idx / item['fade_in_frames']
-                            elif item['fade_out_frames'] > 0 and frame_idx >= item['end_frame'] - item['fade_out_frames']:
-                                alpha = (item['end_frame'] - frame_idx) / item['fade_out_frames']
-                            
-                            # 获取位置
-                            pos_x, pos_y = item['position']
-                            
-                            # 获取图像内容
-                            content = item['content']
-                            
-                            # 混合元素到帧中
-                            blend_image_to_frame(frame, content, pos_x, pos_y, alpha, self.debug)
-                    
-                    # 写入帧
-                    video_writer.write(frame)
-                    
-                    # 显示进度
-                    if frame_idx % 30 == 0:
-                        self.logger.info(f"正在生成视频 {frame_idx}/{total_frames} 帧 ({frame_idx/total_frames*100:.1f}%)")
+                # 释放视频写入器（ffmpeg后端在此完成编码，opencv后端在此压缩）
+                video_writer.release()
+                video_writer = None
             
-            # 释放视频写入器
-            video_writer.release()
-            
-            # 压缩视频
-            compress_video(temp_output, self.logger)
+            peak_rss = peak_rss_bytes()
+            run_stats['peak_rss_mb'] = bytes_to_mb(peak_rss)
+            sampled = [sample['rss_mb'] for sample in run_stats['steps'] if sample['rss_mb'] is not None]
+            run_stats['max_sampled_rss_mb'] = max(sampled) if sampled else None
+            if peak_rss is not None:
+                self.logger.info(f"内存统计: 进程峰值RSS {run_stats['peak_rss_mb']:.1f} MB"
+                                 + (f"，步骤采样最大RSS {run_stats['max_sampled_rss_mb']:.1f} MB" if sampled else ""))
+            routes = formula_route_stats()
+            run_stats['formula_routes'] = routes
+            if routes['hit_rate'] is not None:
+                self.logger.info(f"公式片段路由: mathtext {routes['mathtext']} 个，TeX {routes['tex']} 个，"
+                                 f"mathtext 命中率 {routes['hit_rate'] * 100:.1f}%")
+            sprite_cache = sprite_cache_stats()
+            run_stats['sprite_cache'] = sprite_cache
+            if sprite_cache['hit_rate'] is not None:
+                self.logger.info(f"精灵缓存: 命中 {sprite_cache['hits']} 次，未命中 {sprite_cache['misses']} 次，"
+                                 f"命中率 {sprite_cache['hit_rate'] * 100:.1f}%")
+            atlas_stats = run_stats.get('atlas')
+            if atlas_stats:
+                self.logger.info(f"精灵内存: {atlas_stats['sprites']} 个精灵打包为 {atlas_stats['pages']} 页图集，"
+                                 f"精灵 {bytes_to_mb(atlas_stats['sprite_bytes']):.1f} MB / "
+                                 f"已用页面 {bytes_to_mb(atlas_stats['used_bytes']):.1f} MB，"
+                                 f"碎片率 {atlas_stats['fragmentation'] * 100:.1f}%，"
+                                 f"图集外 {bytes_to_mb(atlas_stats['private_bytes']):.1f} MB")
             
             # 返回临时视频文件路径
             return temp_output
@@ -460,4 +811,33 @@ class BlackboardVideoGenerator:
         except Exception as e:
             self.logger.error(f"视频生成失败: {str(e)}")
             return ""
-
+        finally:
+            if video_writer is not None:
+                # 出错时中止写入器：结束ffmpeg进程与编码线程，删除中间文件（共享内存帧环由 render_with_frame_ring 自行释放）
+                video_writer.abort()
+
+
+
+# ---------- step_parallel 模式的进程池工作函数 ----------
+_worker_background = None
+
+def _init_step_worker(background: np.ndarray) -> None:
+    """进程池初始化：每个工作进程只接收一次背景图像"""
+    global _worker_background
+    _worker_background = background
+
+def _render_step_segment(generator_options: dict, step: Step, fps: int, width: int, height: int,
+                         segment_path: str, encoder_threads: int) -> int:
+    """在工作进程中合成单个步骤并编码为独立的视频片段，返回实际合成的帧数"""
+    generator = BlackboardVideoGenerator(**generator_options)
+    video_writer = create_video_writer(segment_path, fps, width, height,
+                                       backend=generator.encoder, preset=generator.preset, vfr=generator.vfr,
+                                       threads=encoder_threads, logger=generator.logger)
+    try:
+        frames = generator._render_step(video_writer, _worker_background, step, fps)
+        video_writer.release()
+    except BaseException:
+        # 出错时不完成编码，残缺的片段不会被拼接
+        video_writer.abort()
+        raise
+    return frames
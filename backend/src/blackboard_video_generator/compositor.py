@@ -0,0 +1,425 @@
+from typing import List, Tuple
+import numpy as np
+import logging
+
+from .timeline import ActiveSet
+from .scene import TimelineItem
+from .animations import enter_fades, item_offset, item_tint_u8, item_path_progress
+from .utils.image_utils import (
+    blend_image_to_frame,
+    compute_blend_rect,
+    alpha_bbox,
+    split_premultiplied,
+    blend_premultiplied,
+    alpha_ramp,
+    BlendScratch,
+)
+
+logger = logging.getLogger(__name__)
+
+def item_alpha(item: TimelineItem, frame_idx: int) -> float:
+    """
+    计算时间轴元素在指定帧的透明度（淡入淡出效果）
+
+    淡入从元素的 start_frame 开始计算，淡出在 end_frame 之前完成；
+    元素显示时间短于淡入+淡出时两者重叠，透明度取两者的乘积。
+
+    Args:
+        item: 时间轴元素
+        frame_idx: 帧序号（相对于步骤开始）
+
+    Returns:
+        0-1 之间的透明度；元素不可见时返回 0
+    """
+    start = item.start_frame
+    if not (start <= frame_idx < item.end_frame):
+        return 0.0
+
+    alpha = 1.0
+    if item.fade_in_frames > 0 and frame_idx - start < item.fade_in_frames and enter_fades(item):
+        alpha *= (frame_idx - start) / item.fade_in_frames
+    if item.fade_out_frames > 0 and frame_idx >= item.end_frame - item.fade_out_frames:
+        alpha *= (item.end_frame - frame_idx) / item.fade_out_frames
+    return alpha
+
+def item_alpha_u8(item: TimelineItem, frame_idx: int) -> int:
+    """
+    与 item_alpha 相同，但返回 0-255 的整数透明度，取自预先计算的淡入淡出斜坡
+    """
+    start = item.start_frame
+    if not (start <= frame_idx < item.end_frame):
+        return 0
+    alpha = 255
+    if item.fade_in_frames > 0 and frame_idx - start < item.fade_in_frames and enter_fades(item):
+        alpha = int(alpha_ramp(item.fade_in_frames)[frame_idx - start])
+    if item.fade_out_frames > 0 and frame_idx >= item.end_frame - item.fade_out_frames:
+        fade_out = int(alpha_ramp(item.fade_out_frames)[item.end_frame - frame_idx])
+        alpha = (alpha * fade_out + 127) // 255
+    return alpha
+
+def is_item_animating(item: TimelineItem, frame_idx: int) -> bool:
+    """判断元素在指定帧是否处于入场/退场动画过程中"""
+    start = item.start_frame
+    if not (start <= frame_idx < item.end_frame):
+        return False
+    if item.fade_in_frames > 0 and frame_idx - start < item.fade_in_frames:
+        return True
+    return item.fade_out_frames > 0 and frame_idx >= item.end_frame - item.fade_out_frames
+
+def compute_frame_spans(timeline: List[TimelineItem], total_frames: int) -> List[Tuple[int, int, bool]]:
+    """
+    根据时间轴中各元素的出现/消失及淡入淡出帧区间，把步骤切分为若干帧区间。
+    静止区间内每一帧的画面完全相同，只需合成一次。
+
+    Args:
+        timeline: 时间轴元素列表
+        total_frames: 步骤总帧数
+
+    Returns:
+        (起始帧, 结束帧(不含), 是否静止) 的列表，按时间顺序覆盖 [0, total_frames)
+    """
+    if total_frames <= 0:
+        return []
+
+    # 收集所有可能改变画面的帧边界
+    breakpoints = {0, total_frames}
+    # 元素出现/消失的帧：静止区间跨过这些帧时画面会变化，不能合并
+    change_frames = set()
+    transitions = []
+    for item in timeline:
+        start, end = item.start_frame, item.end_frame
+        breakpoints.update((start, end))
+        change_frames.update((start, end))
+        if item.fade_in_frames > 0:
+            fade_in_end = min(start + item.fade_in_frames, end)
+            breakpoints.add(fade_in_end)
+            transitions.append((start, fade_in_end))
+        if item.fade_out_frames > 0:
+            fade_out_start = max(end - item.fade_out_frames, start)
+            breakpoints.add(fade_out_start)
+            transitions.append((fade_out_start, end))
+
+    points = sorted(p for p in breakpoints if 0 <= p <= total_frames)
+
+    spans = []
+    for span_start, span_end in zip(points, points[1:]):
+        if span_start >= span_end:
+            continue
+        # 边界已包含所有过渡区间的端点，因此区间要么完全落在过渡内，要么完全在外
+        is_static = not any(t_start <= span_start < t_end for t_start, t_end in transitions)
+        if spans and is_static and spans[-1][2]:
+            # 相邻的静止区间若画面相同则合并（中间没有任何元素出现/消失）
+            prev_start, _, _ = spans[-1]
+            if span_start not in change_frames:
+                spans[-1] = (prev_start, span_end, True)
+                continue
+        spans.append((span_start, span_end, is_static))
+    return spans
+
+def compose_frame(background: np.ndarray, timeline: List[TimelineItem], frame_idx: int, debug: bool = False) -> np.ndarray:
+    """
+    完整合成一帧：复制背景并按 z 顺序混合所有可见元素（含平移、高亮、路径绘制等动画效果）
+
+    Args:
+        background: 背景图像
+        timeline: 按 z_index 排序的时间轴元素列表
+        frame_idx: 帧序号（相对于步骤开始）
+        debug: 是否输出调试信息
+
+    Returns:
+        合成后的帧
+    """
+    frame = background.copy()
+    for item in timeline:
+        alpha = item_alpha(item, frame_idx)
+        if alpha <= 0:
+            continue
+        content = item.content
+        path_progress = item_path_progress(item, frame_idx)
+        if path_progress is not None and path_progress < 1.0:
+            # 参考实现：每帧从空白画布重绘路径
+            content = item.path_animator.render_full(path_progress)
+        pos_x, pos_y = item.position
+        rect = compute_blend_rect(content.shape, frame.shape, pos_x, pos_y)
+        offset = item_offset(item, frame_idx, rect, frame.shape)
+        blend_image_to_frame(frame, content, pos_x, pos_y, alpha, debug, offset)
+        tint = item_tint_u8(item, frame_idx)
+        if tint > 0:
+            blend_image_to_frame(frame, item.variants['highlight'], pos_x, pos_y, alpha * tint / 255, debug, offset)
+    return frame
+
+
+def _rects_overlap(a: Tuple[int, int, int, int], b: Tuple[int, int, int, int]) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+def _shift_rect(rect: Tuple[int, int, int, int], offset: Tuple[int, int]) -> Tuple[int, int, int, int]:
+    dx, dy = offset
+    return (rect[0] + dx, rect[1] + dy, rect[2] + dx, rect[3] + dy)
+
+def _union_rect(a: Tuple[int, int, int, int], b: Tuple[int, int, int, int]) -> Tuple[int, int, int, int]:
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+def _merge_rects(rects: List[Tuple[int, int, int, int]]) -> List[Tuple[int, int, int, int]]:
+    """把相互重叠的矩形合并为外接矩形，避免重叠区域被重复恢复和混合"""
+    merged = []
+    for rect in rects:
+        while True:
+            for idx, other in enumerate(merged):
+                if _rects_overlap(rect, other):
+                    merged.pop(idx)
+                    rect = _union_rect(rect, other)
+                    break
+            else:
+                break
+        merged.append(rect)
+    return merged
+
+class Sprite:
+    """
+    放置在帧中固定位置的预乘 BGRA 元素图像。
+    完全透明的行和列在构造时裁掉，rect 只覆盖有墨迹的区域，混合开销与墨迹覆盖的面积成正比。
+    颜色与 alpha 是元素图像（通常是图集页，见 atlas.py）的跨步视图，逐帧混合直接读取图集，不复制像素。
+    """
+
+    __slots__ = ('premultiplied', 'alpha', 'rect', 'placement', '_scratch')
+
+    def __init__(self, img: np.ndarray, pos_x: float, pos_y: float, frame_shape: Tuple[int, ...],
+                 crop: bool = True, live: bool = False):
+        """
+        Args:
+            img: 预乘 BGRA 图像，或视为完全不透明的 BGR 图像
+            pos_x: 中心 x 坐标（0-1的比例值）
+            pos_y: 中心 y 坐标（0-1的比例值）
+            frame_shape: 帧尺寸
+            crop: 是否裁掉完全透明的行列
+            live: img 会被原地更新（路径绘制动画），精灵直接引用 img 的视图；
+                之后才画出的墨迹可能落在当前透明的区域中，因此不裁剪
+        """
+        x_start, y_start, x_end, y_end = compute_blend_rect(img.shape, frame_shape, pos_x, pos_y)
+        # 图像在帧中的放置区域，平移动画的位移按它计算（与 compose_frame 一致）
+        self.placement = (x_start, y_start, x_end, y_end)
+        img = img[:y_end - y_start, :x_end - x_start]
+        bbox = alpha_bbox(img) if crop and not live else (0, 0, x_end - x_start, y_end - y_start)
+        if bbox is None:
+            # 完全透明：空矩形，不参与混合和脏区域计算
+            bbox = (0, 0, 0, 0)
+        img = img[bbox[1]:bbox[3], bbox[0]:bbox[2]]
+        self.rect = (x_start + bbox[0], y_start + bbox[1], x_start + bbox[2], y_start + bbox[3])
+        premultiplied, alpha = split_premultiplied(img)
+        if not live and alpha is not None and alpha.min() == 255:
+            # 完全不透明的精灵直接拷贝，不需要 alpha 混合
+            alpha = None
+        self.premultiplied, self.alpha = premultiplied, alpha
+        self._scratch = None
+
+    def blend(self, frame: np.ndarray, alpha: int = 255, clip: Tuple[int, int, int, int] = None,
+              offset: Tuple[int, int] = (0, 0)) -> None:
+        """
+        以全局透明度 alpha 把精灵原地混合到帧中
+
+        Args:
+            frame: 目标帧
+            alpha: 全局透明度，0-255 的整数
+            clip: 可选的裁剪矩形 (x_start, y_start, x_end, y_end)，只混合该区域内的像素
+            offset: 相对 rect 的像素平移 (dx, dy)，平移后的矩形须位于帧内
+        """
+        rect = _shift_rect(self.rect, offset)
+        x_start, y_start, x_end, y_end = rect
+        if x_start >= x_end or y_start >= y_end:
+            return
+        if clip is not None:
+            x_start, y_start = max(x_start, clip[0]), max(y_start, clip[1])
+            x_end, y_end = min(x_end, clip[2]), min(y_end, clip[3])
+            if x_start >= x_end or y_start >= y_end:
+                return
+        # 精灵内部坐标
+        sx, sy = x_start - rect[0], y_start - rect[1]
+        sw, sh = x_end - x_start, y_end - y_start
+        premultiplied = self.premultiplied[sy:sy + sh, sx:sx + sw]
+        alpha_map = self.alpha[sy:sy + sh, sx:sx + sw] if self.alpha is not None else None
+        if self._scratch is None and (alpha < 255 or alpha_map is not None):
+            # 混合用的临时缓冲按精灵尺寸分配一次，此后逐帧复用
+            self._scratch = BlendScratch(*self.premultiplied.shape[:2])
+        blend_premultiplied(frame[y_start:y_end, x_start:x_end], premultiplied, alpha_map, alpha, self._scratch)
+
+class StepCompositor:
+    """
+    单个步骤的合成器。
+    把当前不在动画中的元素预先烘焙进静态层（背景 + alpha=1 的元素，缓存为一帧），
+    并维护一个持久的帧缓冲：每帧只根据精灵的位置、尺寸、透明度和着色变化计算脏矩形，
+    从静态层恢复这些区域后重新混合其中的精灵，开销与变化区域的面积成正比。
+    平移、高亮等动画效果同样只作用于脏矩形内，高亮使用预先着色的精灵变体；
+    路径绘制由 GeometryPathAnimator 增量更新精灵图像，脏区域只包含新画出的笔画。
+    时间轴中的路径动画器是有状态的，同一时间轴同时只能由一个合成器使用。
+    """
+
+    def __init__(self, background: np.ndarray, timeline: List[TimelineItem]):
+        """
+        Args:
+            background: 背景图像
+            timeline: 按 z_index 排序的时间轴元素列表
+        """
+        self.background = background
+        self.timeline = timeline
+        # 路径绘制元素的精灵与动画器输出图像共用同一矩形（见 _path_sprite），不裁剪透明行列
+        self.sprites = [
+            Sprite(item.content, item.position[0], item.position[1], background.shape,
+                   crop=item.path_animator is None)
+            for item in timeline
+        ]
+        self._active = ActiveSet(timeline)
+        # 动画变体（如高亮着色版本）的精灵，首次使用时创建
+        self._variant_sprites = {}
+        # 元素在整个动画过程中可能覆盖的区域，用于判断静态元素是否与动画元素重叠
+        self._envelopes = [
+            _union_rect(sprite.rect, _shift_rect(
+                sprite.rect, item_offset(item, item.start_frame, sprite.placement, background.shape)))
+            for item, sprite in zip(timeline, self.sprites)
+        ]
+        self._static_key = None
+        self._static_layer = None
+        # 持久帧缓冲；每个输出缓冲上一次绘制时的静态层与各精灵的状态
+        # {缓冲键: (静态层元素, {元素序号: (rect, alpha, tint, offset, path)})}，持久帧缓冲的键为 None
+        self._frame = None
+        self._buffer_state = {}
+        # 最近一次绘制的缓冲，路径动画器新画出的笔画只对它是增量
+        self._last_buffer = None
+
+    def _split_layers(self, frame_idx: int) -> Tuple[Tuple[int, ...], List[int]]:
+        """
+        把当前帧可见的元素分为静态层元素和逐帧混合的精灵。
+        静态元素若与 z 顺序在其之下的精灵重叠，必须在其之后绘制，因此也作为精灵处理；
+        这样提升的精灵同样会提升其上与之重叠的静态元素（A↔B↔C 的重叠链）。
+        """
+        static_items = []
+        sprite_items = []
+        sprite_rects = []
+        for idx in self._active.at(frame_idx):
+            rect = self._envelopes[idx]
+            if (is_item_animating(self.timeline[idx], frame_idx)
+                    or any(_rects_overlap(rect, other) for other in sprite_rects)):
+                sprite_items.append(idx)
+                sprite_rects.append(rect)
+            else:
+                static_items.append(idx)
+        return tuple(static_items), sprite_items
+
+    def _get_static_layer(self, static_items: Tuple[int, ...]) -> np.ndarray:
+        if static_items != self._static_key:
+            layer = self.background.copy()
+            for idx in static_items:
+                self.sprites[idx].blend(layer)
+            self._static_key = static_items
+            self._static_layer = layer
+        return self._static_layer
+
+    def _variant_sprite(self, idx: int, name: str) -> Sprite:
+        key = (idx, name)
+        if key not in self._variant_sprites:
+            item = self.timeline[idx]
+            self._variant_sprites[key] = Sprite(item.variants[name], item.position[0], item.position[1],
+                                                self.background.shape)
+        return self._variant_sprites[key]
+
+    def _path_sprite(self, idx: int) -> Sprite:
+        key = (idx, 'draw_path')
+        if key not in self._variant_sprites:
+            item = self.timeline[idx]
+            # 精灵直接引用动画器的输出图像，动画器原地更新后无需重建精灵
+            self._variant_sprites[key] = Sprite(item.path_animator.image, item.position[0],
+                                                item.position[1], self.background.shape, live=True)
+        return self._variant_sprites[key]
+
+    def _advance_path(self, idx: int, sprite_state: Tuple) -> List[Tuple[int, int, int, int]]:
+        """把路径动画推进到精灵状态中的进度，返回帧坐标下发生变化的矩形"""
+        rect, _, _, _, path = sprite_state
+        changed = self.timeline[idx].path_animator.advance(path)
+        width, height = rect[2] - rect[0], rect[3] - rect[1]
+        # 精灵只显示图像位于帧内的部分，变化区域也裁剪到该范围
+        return [(rect[0] + x_start, rect[1] + y_start, rect[0] + min(x_end, width), rect[1] + min(y_end, height))
+                for x_start, y_start, x_end, y_end in changed if x_start < width and y_start < height]
+
+    def _blend_sprite(self, frame: np.ndarray, idx: int, sprite_state: Tuple,
+                      clip: Tuple[int, int, int, int] = None) -> None:
+        """按精灵状态 (rect, alpha, tint, offset, path) 混合一个精灵及其高亮变体"""
+        _, alpha, tint, offset, path = sprite_state
+        sprite = self._path_sprite(idx) if path is not None and path < 1.0 else self.sprites[idx]
+        sprite.blend(frame, alpha, clip, offset)
+        if tint > 0:
+            self._variant_sprite(idx, 'highlight').blend(frame, (alpha * tint + 127) // 255, clip, offset)
+
+    def compose(self, frame_idx: int, out: np.ndarray = None) -> np.ndarray:
+        """
+        合成指定帧
+
+        Args:
+            frame_idx: 帧序号
+            out: 可选的输出缓冲（如共享内存中的槽位），帧直接合成进其中。
+                合成器按内存地址记住每个缓冲上一次绘制的内容，同一缓冲再次传入时只重绘脏矩形，
+                因此调用方在两次合成之间不得修改它
+
+        Returns:
+            提供 out 时返回 out；否则返回缓存的静态层或持久帧缓冲，调用方不得修改，
+            并且须在下一次调用 compose 之前用完
+        """
+        static_items, sprite_items = self._split_layers(frame_idx)
+        static_layer = self._get_static_layer(static_items)
+        if out is None:
+            if not sprite_items:
+                # 静止帧直接返回静态层，持久帧缓冲保持上一次绘制的内容
+                return static_layer
+            if self._frame is None:
+                self._frame = np.empty_like(static_layer)
+            frame, buffer_key = self._frame, None
+        else:
+            frame, buffer_key = out, (out.__array_interface__['data'][0], out.shape, out.strides)
+        frame_key, drawn_state = self._buffer_state.get(buffer_key, (None, {}))
+
+        state = {}
+        for idx in sprite_items:
+            item = self.timeline[idx]
+            alpha = item_alpha_u8(item, frame_idx)
+            if alpha > 0:
+                offset = item_offset(item, frame_idx, self.sprites[idx].placement, self.background.shape)
+                state[idx] = (_shift_rect(self.sprites[idx].rect, offset), alpha,
+                              item_tint_u8(item, frame_idx), offset, item_path_progress(item, frame_idx))
+
+        # 推进路径动画，记录每个精灵新画出的区域
+        path_rects = {idx: self._advance_path(idx, sprite_state)
+                      for idx, sprite_state in state.items() if sprite_state[4] is not None}
+
+        if frame_key != static_items:
+            # 静态层发生变化（或缓冲首次使用）：整帧恢复并重新混合所有精灵
+            np.copyto(frame, static_layer)
+            for idx, sprite_state in state.items():
+                self._blend_sprite(frame, idx, sprite_state)
+        else:
+            # 只处理位置/尺寸/透明度/着色发生变化的精灵所覆盖的区域（新旧矩形都算脏）
+            dirty_rects = []
+            for idx in set(state) | set(drawn_state):
+                old_state = drawn_state.get(idx)
+                new_state = state.get(idx)
+                if old_state == new_state:
+                    continue
+                # 只有路径绘制进度变化：脏区域只是新画出的笔画。
+                # 笔画是相对于最近绘制的缓冲的增量，换了缓冲时按普通变化重绘整个精灵
+                if (old_state is not None and new_state is not None and old_state[:4] == new_state[:4]
+                        and buffer_key == self._last_buffer):
+                    dirty_rects.extend(path_rects[idx])
+                    continue
+                if old_state is not None:
+                    dirty_rects.append(old_state[0])
+                if new_state is not None:
+                    dirty_rects.append(new_state[0])
+
+            for rect in _merge_rects(dirty_rects):
+                x_start, y_start, x_end, y_end = rect
+                frame[y_start:y_end, x_start:x_end] = static_layer[y_start:y_end, x_start:x_end]
+                # 按 z 顺序重新混合与该区域相交的所有精灵
+                for idx in sprite_items:
+                    if idx in state and _rects_overlap(state[idx][0], rect):
+                        self._blend_sprite(frame, idx, state[idx], clip=rect)
+
+        self._buffer_state[buffer_key] = (static_items, state)
+        self._last_buffer = buffer_key
+        return frame
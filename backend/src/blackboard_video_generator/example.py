@@ -1,4 +1,5 @@
 import json
+import argparse
 from pathlib import Path
 from loguru import logger
 import sys
@@ -10,18 +11,24 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirna
 
 # 使用绝对导入
 from backend.src.blackboard_video_generator import BlackboardVideoGenerator
+from backend.src.blackboard_video_generator.blackboard_video_generator import EXECUTION_MODES, STREAMING_EXECUTION_MODES
 
 # 配置loguru日志
 log_path = Path(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))) / "logs" / "blackboard_video_generator.log"
 logger.add(log_path, rotation="10 MB", retention="1 week", level="DEBUG", encoding="utf-8")
 
-def generate_blackboard_video(json_path: str, output_path: str):
+def generate_blackboard_video(json_path: str, output_path: str, vfr: bool = False, streaming: bool = False,
+                              draft: bool = False, mode: str = "serial"):
     """
     生成黑板视频
     
     Args:
         json_path: 输入JSON文件路径
         output_path: 输出视频文件路径
+        vfr: 是否输出可变帧率视频
+        streaming: 是否逐个步骤渲染并释放（限制峰值内存）
+        draft: 是否以草稿模式快速渲染（低分辨率、低帧率、ultrafast 编码，布局与正式输出一致）
+        mode: 帧合成的执行方式，见 EXECUTION_MODES
     """
     try:
         # 读取JSON数据
@@ -37,7 +44,8 @@ def generate_blackboard_video(json_path: str, output_path: str):
         height = blackboard_data.get('resolution', [1920, 1080])[1]
         logger.info(f"创建视频生成器，分辨率：{width}x{height}")
         
-        generator = BlackboardVideoGenerator(width=width, height=height, debug=True)
+        generator = BlackboardVideoGenerator(width=width, height=height, debug=True, vfr=vfr,
+                                             streaming=streaming, draft=draft, execution=mode)
         
         # 生成视频
         logger.info("开始生成视频...")
@@ -71,15 +79,21 @@ def generate_blackboard_video(json_path: str, output_path: str):
         raise
 
 if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        print("用法: python example.py <输入JSON文件路径> <输出视频文件路径>")
-        sys.exit(1)
-        
-    json_path = sys.argv[1]
-    output_path = sys.argv[2]
+    parser = argparse.ArgumentParser(description="生成黑板视频")
+    parser.add_argument("json_path", help="输入JSON文件路径")
+    parser.add_argument("output_path", help="输出视频文件路径")
+    parser.add_argument("--vfr", action="store_true", help="输出可变帧率视频（静止画面编码为单个长时长帧）")
+    parser.add_argument("--streaming", action="store_true", help="逐个步骤渲染、合成并释放，峰值内存只取决于最大的单个步骤")
+    parser.add_argument("--draft", action="store_true", help="草稿模式：半分辨率、15fps、ultrafast 编码，用于快速审核布局与时间轴")
+    parser.add_argument("--mode", choices=EXECUTION_MODES, default="serial",
+                        help="帧合成的执行方式（说明见 blackboard_video_generator.py 中的 EXECUTION_MODES），默认 serial")
+    args = parser.parse_args()
+    if args.streaming and args.mode not in STREAMING_EXECUTION_MODES:
+        parser.error(f"--streaming 只支持以下执行方式: {', '.join(STREAMING_EXECUTION_MODES)}")
     
     # 确保输出目录存在
-    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    Path(args.output_path).parent.mkdir(parents=True, exist_ok=True)
     
     # 生成视频
-    generate_blackboard_video(json_path, output_path) 
\ No newline at end of file
+    generate_blackboard_video(args.json_path, args.output_path, vfr=args.vfr, streaming=args.streaming,
+                              draft=args.draft, mode=args.mode)
\ No newline at end of file
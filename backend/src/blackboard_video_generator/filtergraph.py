@@ -0,0 +1,279 @@
+from typing import List, Optional, Tuple, Iterator
+import os
+import subprocess
+import tempfile
+import cv2
+import numpy as np
+import logging
+
+from .utils.image_utils import compute_blend_rect, alpha_bbox, unpremultiply_image
+from .animations import enter_fades, SLIDE_DIRECTIONS, SLIDE_DISTANCE
+from .scene import TimelineItem
+
+logger = logging.getLogger(__name__)
+
+# 滤镜图无法表达的入场效果：路径绘制每帧的图像由 GeometryPathAnimator 在 Python 端画出
+UNSUPPORTED_ENTER_EFFECTS = ('draw_path',)
+# 把单帧图片在内存中无限重复：图片只解码、转换像素格式一次（-loop 1 输入每帧都重新解码 PNG）
+_LOOP_FOREVER = "loop=loop=-1:size=1"
+
+def filtergraph_supports(timeline: List[TimelineItem]) -> bool:
+    """步骤的所有入场/退场效果能否由滤镜图表达；不能时该步骤须由 Python 合成器渲染"""
+    return not any(item.enter in UNSUPPORTED_ENTER_EFFECTS for item in timeline)
+
+class FilterSprite:
+    """写成 PNG 的单个精灵：PNG 路径、时间轴元素、左上角像素坐标、放置区域及高亮变体的 PNG 路径"""
+
+    __slots__ = ('path', 'item', 'origin', 'placement', 'highlight_path')
+
+    def __init__(self, path: str, item: TimelineItem, origin: Tuple[int, int],
+                 placement: Tuple[int, int, int, int], highlight_path: Optional[str] = None):
+        self.path = path
+        self.item = item
+        self.origin = origin
+        self.placement = placement
+        self.highlight_path = highlight_path
+
+def _write_png(path: str, img: np.ndarray) -> None:
+    if img.shape[2] == 3:
+        # fade 滤镜需要 alpha 通道才能只淡化精灵本身
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
+    else:
+        # PNG 与 overlay 滤镜使用直通 alpha
+        img = unpremultiply_image(img)
+    cv2.imwrite(path, img)
+
+def write_step_sprites(timeline: List[TimelineItem], frame_shape: Tuple[int, ...],
+                       work_dir: str, prefix: str) -> List[FilterSprite]:
+    """
+    把时间轴中每个元素图像按其在帧中的放置区域裁剪后写为带 alpha 的 PNG，每个精灵只写一次；
+    高亮入场的元素另写一张同样裁剪的着色变体
+
+    Args:
+        timeline: 按 z_index 排序的时间轴元素列表
+        frame_shape: 帧尺寸 (h, w, ...)
+        work_dir: PNG 输出目录
+        prefix: 文件名前缀（区分不同步骤）
+
+    Returns:
+        精灵列表，保持 z 顺序；完全落在帧外或完全透明的元素被跳过
+    """
+    if not filtergraph_supports(timeline):
+        raise ValueError(f"滤镜图不支持以下入场效果: {UNSUPPORTED_ENTER_EFFECTS}")
+    sprites = []
+    for idx, item in enumerate(timeline):
+        img = item.content
+        pos_x, pos_y = item.position
+        placement = compute_blend_rect(img.shape, frame_shape, pos_x, pos_y)
+        x_start, y_start, x_end, y_end = placement
+        if x_start >= x_end or y_start >= y_end:
+            continue
+        # 与 Sprite 相同：超出帧的部分从右侧/下方裁掉，完全透明的行列不写出
+        img = img[:y_end - y_start, :x_end - x_start]
+        bbox = alpha_bbox(img)
+        if bbox is None:
+            continue
+        crop = (slice(bbox[1], bbox[3]), slice(bbox[0], bbox[2]))
+        sprite_path = os.path.join(work_dir, f"{prefix}_sprite_{idx:03d}.png")
+        _write_png(sprite_path, img[crop])
+        highlight_path = None
+        if 'highlight' in item.variants and _enter_frames(item) > 0:
+            # 着色变体与原图的 alpha 相同，按同一矩形裁剪
+            highlight_path = os.path.join(work_dir, f"{prefix}_highlight_{idx:03d}.png")
+            _write_png(highlight_path, item.variants['highlight'][:y_end - y_start, :x_end - x_start][crop])
+        sprites.append(FilterSprite(sprite_path, item, (x_start + bbox[0], y_start + bbox[1]),
+                                    placement, highlight_path))
+    return sprites
+
+def _enter_frames(item: TimelineItem) -> int:
+    """入场动画实际持续的帧数（与 _enter_progress 一致，不超过元素的显示时间）"""
+    return max(min(item.fade_in_frames, item.end_frame - item.start_frame), 0)
+
+def _slide_expr(sprite: FilterSprite, axis: int, frame_shape: Tuple[int, ...], fps: int) -> str:
+    """
+    overlay 的 x/y 表达式：与 item_offset 一致，入场期间位移按 (1-p)^3 衰减并限制在帧内。
+    帧号由主输入的时间戳 t 换算：overlay 在计算坐标时 n 已经计入当前帧，比帧序号大 1
+    """
+    item = sprite.item
+    origin = sprite.origin[axis]
+    direction = SLIDE_DIRECTIONS.get(item.enter, (0, 0))[axis]
+    frames = _enter_frames(item)
+    if direction == 0 or frames <= 0:
+        return str(origin)
+    frame_size = frame_shape[1 - axis]
+    distance = direction * SLIDE_DISTANCE * frame_size
+    low = -sprite.placement[axis]
+    high = frame_size - sprite.placement[axis + 2]
+    start = item.start_frame
+    frame = f"round(t*{fps})"
+    # 与 Python 的浮点运算顺序相同（1-ease_out_cubic(p)），并按 round() 的规则把 0.5 舍入到偶数
+    offset = f"{distance!r}*(1-(1-pow(1-({frame}-{start})/{item.fade_in_frames},3)))"
+    rounded = f"if(eq({offset}-floor({offset}),0.5),2*round({offset}/2),round({offset}))"
+    return f"{origin}+if(between({frame},{start},{start + frames - 1}),clip({rounded},{low},{high}),0)"
+
+def _highlight_alpha_expr(item: TimelineItem, frame: str) -> str:
+    """
+    高亮变体在入场期间的 8 位透明度，与 StepCompositor 一致：
+    着色权重 round(sin(pi*p)*255) 与淡出透明度相乘后取整
+
+    Args:
+        item: 时间轴元素
+        frame: 表示帧序号（相对于步骤开始）的表达式
+    """
+    start, end = item.start_frame, item.end_frame
+    tint = f"round(sin(PI*({frame}-{start})/{item.fade_in_frames})*255)"
+    fade_out = "255"
+    if item.fade_out_frames > 0:
+        fade_out = (f"if(gte({frame},{end - item.fade_out_frames}),"
+                    f"round(({end}-{frame})*255/{item.fade_out_frames}),255)")
+    return f"floor(({fade_out}*{tint}+127)/255)"
+
+def build_step_filtergraph(sprites: List[FilterSprite], frame_shape: Tuple[int, ...], fps: int) -> Tuple[str, str]:
+    """
+    根据步骤的精灵列表构建 filter_complex。
+    输入 0 是背景，之后按顺序是各精灵（及其高亮变体）的 PNG，各自转换像素格式后由 loop 滤镜重复为视频流；
+    每个精灵再用 fade 滤镜处理 alpha 淡入淡出，
+    再用带 enable 时间范围的 overlay 按 z 顺序叠加到背景上。
+    平移入场用随帧号 n 变化的 overlay 坐标表达式实现；高亮入场再叠加一层着色变体，
+    其 alpha 由 geq 按帧号逐帧缩放，只在入场的帧区间内存在。
+
+    Args:
+        sprites: write_step_sprites 的返回值
+        frame_shape: 帧尺寸 (h, w, ...)
+        fps: 帧率
+
+    Returns:
+        (filter_complex 字符串, 输出流标签)
+    """
+    chains = [f"[0:v]format=gbrp,{_LOOP_FOREVER}[base0]"]
+    base = "base0"
+    input_idx = 0
+    for sprite_idx, sprite in enumerate(sprites, start=1):
+        item = sprite.item
+        start, end = item.start_frame, item.end_frame
+        input_idx += 1
+        sprite_filters = ["format=rgba", _LOOP_FOREVER]
+        # 与 item_alpha 一致：淡入第 k 帧的透明度为 k/n，淡出从 1 线性降到 1/n，两者重叠时相乘
+        if item.fade_in_frames > 0 and enter_fades(item):
+            sprite_filters.append(f"fade=t=in:s={start}:n={item.fade_in_frames}:alpha=1")
+        if item.fade_out_frames > 0:
+            fade_out_start = max(end - item.fade_out_frames, 0)
+            sprite_filters.append(f"fade=t=out:s={fade_out_start}:n={item.fade_out_frames}:alpha=1")
+        chains.append(f"[{input_idx}:v]{','.join(sprite_filters)}[sprite{sprite_idx}]")
+
+        output = f"base{sprite_idx}"
+        x, y = _slide_expr(sprite, 0, frame_shape, fps), _slide_expr(sprite, 1, frame_shape, fps)
+        chains.append(
+            f"[{base}][sprite{sprite_idx}]overlay=x='{x}':y='{y}':format=gbrp"
+            f":enable='between(n,{start},{end - 1})'[{output}]"
+        )
+        base = output
+
+        if sprite.highlight_path is not None:
+            input_idx += 1
+            highlight_end = start + _enter_frames(item)
+            # trim 保留原时间戳，叠加层只在入场期间有帧；geq 的 N 从 trim 后的第一帧开始计数。
+            # geq 默认的双线性插值会把边缘向右下扩散一个像素，取最近邻以保持与精灵逐像素对齐
+            alpha = _highlight_alpha_expr(item, f"(N+{start})")
+            chains.append(
+                f"[{input_idx}:v]{_LOOP_FOREVER},trim=start_frame={start}:end_frame={highlight_end},format=gbrap,"
+                f"geq=interpolation=nearest:r='r(X,Y)':g='g(X,Y)':b='b(X,Y)':a='alpha(X,Y)*{alpha}/255'[highlight{sprite_idx}]"
+            )
+            output = f"base{sprite_idx}h"
+            chains.append(
+                f"[{base}][highlight{sprite_idx}]overlay=x={sprite.origin[0]}:y={sprite.origin[1]}:format=gbrp"
+                f":eof_action=pass:enable='between(n,{start},{highlight_end - 1})'[{output}]"
+            )
+            base = output
+    return ";".join(chains), base
+
+def build_step_command(background_path: str, sprites: List[FilterSprite], total_frames: int, fps: int,
+                       frame_shape: Tuple[int, ...], output_args: List[str]) -> List[str]:
+    """
+    构建用 ffmpeg 合成一个步骤的完整命令
+
+    Args:
+        background_path: 背景 PNG 路径
+        sprites: write_step_sprites 的返回值
+        total_frames: 步骤总帧数
+        fps: 帧率
+        frame_shape: 帧尺寸 (h, w, ...)
+        output_args: 输出参数（编码器参数和输出路径，或原始帧管道）
+
+    Returns:
+        ffmpeg 命令参数列表
+    """
+    command = ['ffmpeg', '-y', '-loglevel', 'error']
+    input_paths = [background_path]
+    for sprite in sprites:
+        input_paths.append(sprite.path)
+        if sprite.highlight_path is not None:
+            input_paths.append(sprite.highlight_path)
+    for input_path in input_paths:
+        # 每张图片作为单帧输入，由滤镜图中的 loop 重复为无限长的视频流，总帧数由 -frames:v 决定
+        command += ['-framerate', str(fps), '-i', input_path]
+    filter_complex, output_label = build_step_filtergraph(sprites, frame_shape, fps)
+    command += ['-filter_complex', filter_complex, '-map', f'[{output_label}]', '-frames:v', str(total_frames)]
+    return command + output_args
+
+def encode_args(output_path: str, preset: str = 'medium', crf: int = 23, threads: int = None) -> List[str]:
+    """与 FFmpegFrameWriter 一致的 libx264 编码参数"""
+    args = ['-an', '-c:v', 'libx264', '-preset', preset, '-crf', str(crf), '-pix_fmt', 'yuv420p']
+    if threads:
+        args += ['-threads', str(threads)]
+    return args + [output_path]
+
+def render_step_filtergraph(background_path: str, timeline: List[TimelineItem], frame_shape: Tuple[int, ...],
+                            total_frames: int, fps: int, output_path: str, work_dir: str, prefix: str,
+                            preset: str = 'medium', crf: int = 23, threads: int = None) -> None:
+    """
+    由 ffmpeg 在一个进程内完成单个步骤的合成与编码，Python 端没有逐帧循环
+
+    Args:
+        background_path: 背景 PNG 路径
+        timeline: 按 z_index 排序的时间轴元素列表
+        frame_shape: 帧尺寸 (h, w, ...)
+        total_frames: 步骤总帧数
+        fps: 帧率
+        output_path: 输出视频片段路径
+        work_dir: 精灵 PNG 的临时目录
+        prefix: 精灵文件名前缀
+        preset: libx264 预设
+        crf: libx264 质量参数
+        threads: 编码线程数
+    """
+    sprites = write_step_sprites(timeline, frame_shape, work_dir, prefix)
+    command = build_step_command(background_path, sprites, total_frames, fps, frame_shape,
+                                 encode_args(output_path, preset, crf, threads))
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg滤镜图合成失败: {result.stderr.decode(errors='replace').strip()}")
+    logger.debug(f"滤镜图合成完成: {output_path} ({len(sprites)} 个精灵, {total_frames} 帧)")
+
+def iter_step_frames(background_path: str, timeline: List[TimelineItem], frame_shape: Tuple[int, ...],
+                     total_frames: int, fps: int, work_dir: str, prefix: str) -> Iterator[np.ndarray]:
+    """
+    用同一个滤镜图合成步骤，但逐帧输出未经编码的 BGR 原始帧，用于与 Python 合成器逐像素对比
+
+    Yields:
+        形状为 (h, w, 3) 的 uint8 帧，按帧序排列
+    """
+    sprites = write_step_sprites(timeline, frame_shape, work_dir, prefix)
+    command = build_step_command(background_path, sprites, total_frames, fps, frame_shape,
+                                 ['-f', 'rawvideo', '-pix_fmt', 'bgr24', '-'])
+    height, width = frame_shape[:2]
+    frame_bytes = height * width * 3
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            while True:
+                data = process.stdout.read(frame_bytes)
+                if len(data) < frame_bytes:
+                    break
+                yield np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+        if returncode != 0:
+            stderr.seek(0)
+            raise RuntimeError(f"ffmpeg滤镜图合成失败: {stderr.read().decode(errors='replace').strip()}")
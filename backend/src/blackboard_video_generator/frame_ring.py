@@ -0,0 +1,166 @@
+from typing import List, Tuple
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+import logging
+
+from .compositor import compute_frame_spans, StepCompositor
+from .scene import TimelineItem
+
+logger = logging.getLogger(__name__)
+
+# 等待槽位时检查工作进程存活状态的间隔（秒）
+_POLL_INTERVAL = 1.0
+
+def plan_frame_units(timelines: List[List[TimelineItem]], frame_counts: List[int]) -> List[Tuple[int, int, int]]:
+    """
+    把所有步骤展开为按播放顺序排列的合成单元：静止区间为一个单元，动画区间每帧一个单元
+
+    Args:
+        timelines: 每个步骤的时间轴
+        frame_counts: 每个步骤的总帧数
+
+    Returns:
+        (步骤序号, 帧序号, 重复写入次数) 的列表
+    """
+    units = []
+    for step_idx, (timeline, total_frames) in enumerate(zip(timelines, frame_counts)):
+        for span_start, span_end, is_static in compute_frame_spans(timeline, total_frames):
+            if is_static:
+                units.append((step_idx, span_start, span_end - span_start))
+            else:
+                units.extend((step_idx, frame_idx, 1) for frame_idx in range(span_start, span_end))
+    return units
+
+class SharedFrameRing:
+    """
+    基于 multiprocessing.shared_memory 的帧环形缓冲。
+    每个槽位是一帧预分配的 BGR 图像，配有一对信号量：
+    free 表示槽位可以被合成进程写入，filled 表示槽位中的帧可以被编码端读取。
+    对象可作为 multiprocessing.Process 的参数传给子进程，子进程中按名称重新映射同一块共享内存。
+    """
+
+    def __init__(self, slot_count: int, frame_shape: Tuple[int, ...], ctx=None):
+        """
+        Args:
+            slot_count: 槽位数量
+            frame_shape: 单帧形状 (height, width, 3)
+            ctx: multiprocessing 上下文，用于创建信号量
+        """
+        ctx = ctx or mp.get_context()
+        self.slot_count = slot_count
+        self.frame_shape = tuple(frame_shape)
+        frame_bytes = int(np.prod(self.frame_shape))
+        self._shm = shared_memory.SharedMemory(create=True, size=frame_bytes * slot_count)
+        self.free = [ctx.Semaphore(1) for _ in range(slot_count)]
+        self.filled = [ctx.Semaphore(0) for _ in range(slot_count)]
+        self._map_slots()
+
+    def _map_slots(self):
+        frames = np.ndarray((self.slot_count,) + self.frame_shape, dtype=np.uint8, buffer=self._shm.buf)
+        self.slots = list(frames)
+
+    def __getstate__(self):
+        return {
+            'name': self._shm.name,
+            'slot_count': self.slot_count,
+            'frame_shape': self.frame_shape,
+            'free': self.free,
+            'filled': self.filled,
+        }
+
+    def __setstate__(self, state):
+        self.slot_count = state['slot_count']
+        self.frame_shape = state['frame_shape']
+        self.free = state['free']
+        self.filled = state['filled']
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._map_slots()
+
+    def close(self):
+        """解除当前进程对共享内存的映射"""
+        # 先丢弃指向共享内存的数组视图，否则 close 会因缓冲仍被引用而失败
+        self.slots = []
+        self._shm.close()
+
+    def unlink(self):
+        """释放共享内存，只应由创建者在所有进程结束后调用"""
+        self._shm.unlink()
+
+def _ring_worker(ring: SharedFrameRing, background: np.ndarray, timelines: List[List[TimelineItem]],
+                 units: List[Tuple[int, int, int]], worker_id: int, worker_count: int) -> None:
+    """
+    合成进程：处理序号 ≡ worker_id (mod worker_count) 的单元，直接合成进对应槽位（共享内存中没有额外的整帧拷贝）。
+    槽位数是进程数的整数倍，因此每个槽位只会被同一个进程写入，合成器记得每个槽位上一次的内容，只重绘脏矩形。
+    """
+    try:
+        compositor = None
+        compositor_step = None
+        for unit_idx in range(worker_id, len(units), worker_count):
+            step_idx, frame_idx, _ = units[unit_idx]
+            if step_idx != compositor_step:
+                compositor = StepCompositor(background, timelines[step_idx])
+                compositor_step = step_idx
+            slot_idx = unit_idx % ring.slot_count
+            ring.free[slot_idx].acquire()
+            compositor.compose(frame_idx, out=ring.slots[slot_idx])
+            ring.filled[slot_idx].release()
+    finally:
+        ring.close()
+
+def render_with_frame_ring(video_writer, background: np.ndarray, timelines: List[List[TimelineItem]],
+                           frame_counts: List[int], workers: int, slots_per_worker: int = 2) -> int:
+    """
+    用多个合成进程并行合成所有步骤，通过共享内存环形缓冲按帧序交给单一的编码端。
+    帧在进程间不经过序列化，编码端直接把槽位内存写入视频写入器。
+
+    Args:
+        video_writer: 视频帧写入器
+        background: 背景图像
+        timelines: 每个步骤的时间轴
+        frame_counts: 每个步骤的总帧数
+        workers: 合成进程数
+        slots_per_worker: 每个合成进程占用的槽位数，决定合成端最多领先编码端多少帧
+
+    Returns:
+        实际合成的帧数
+    """
+    units = plan_frame_units(timelines, frame_counts)
+    if not units:
+        return 0
+
+    workers = max(1, min(workers, len(units)))
+    ctx = mp.get_context()
+    ring = SharedFrameRing(workers * max(1, slots_per_worker), background.shape, ctx)
+    processes = [
+        ctx.Process(target=_ring_worker, args=(ring, background, timelines, units, worker_id, workers),
+                    name=f"frame-compositor-{worker_id}", daemon=True)
+        for worker_id in range(workers)
+    ]
+    try:
+        for process in processes:
+            process.start()
+        logger.info(f"共享内存帧环形缓冲: {workers} 个合成进程, {ring.slot_count} 个槽位, {len(units)} 个合成单元")
+
+        for unit_idx, (_, _, frame_count) in enumerate(units):
+            slot_idx = unit_idx % ring.slot_count
+            while not ring.filled[slot_idx].acquire(timeout=_POLL_INTERVAL):
+                failed = [p.name for p in processes if p.exitcode not in (None, 0)]
+                if failed:
+                    raise RuntimeError(f"合成进程异常退出: {', '.join(failed)}")
+            if frame_count == 1:
+                video_writer.write(ring.slots[slot_idx])
+            else:
+                video_writer.write_hold(ring.slots[slot_idx], frame_count)
+            ring.free[slot_idx].release()
+
+        for process in processes:
+            process.join()
+        return len(units)
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        ring.close()
+        ring.unlink()
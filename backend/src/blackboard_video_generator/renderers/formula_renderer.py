@@ -6,142 +6,391 @@ import io
 import re
 import logging
 import traceback
-from ..utils.image_utils import trim_image
-from .text_renderer import render_text_as_image
+from ..utils.image_utils import trim_image, premultiply_image, text_placeholder
+from .text_renderer import render_text_as_image, measure_text, RENDER_DPI
+from .latex_service import get_latex_service, LatexServiceError
+from .mathtext_renderer import (mathtext_supported, measure_mathtext, render_mathtext_as_image,
+                                MATHTEXT_RENDERER_VERSION, MATHTEXT_FONTSET)
+from .sprite_cache import cached_sprite, cached_metrics, is_cached
 
 logger = logging.getLogger(__name__)
 
-def render_latex_as_image(latex, font_size=24, skip_scaling=False, debug=False):
+LATEX_PREAMBLE = r'\usepackage{amsmath,amssymb,ctex}'
+# LaTeX 渲染算法变化时递增，使旧的精灵缓存失效
+LATEX_RENDERER_VERSION = 1
+# 混合内容中相邻片段的间距（scale=1.0 时的像素数）；
+# 片段已紧致裁剪，间距计入原先两侧各 2 像素的裁剪边距，保持视觉间距不变
+PART_GAP = 9
+
+# LaTeX 片段的渲染路由统计：mathtext 为进程内快速路径，tex 为完整 TeX 路径
+_route_counts = {'mathtext': 0, 'tex': 0}
+
+def reset_formula_route_stats():
+    """清零路由统计（每次生成视频开始时调用）"""
+    for route in _route_counts:
+        _route_counts[route] = 0
+
+def formula_route_stats():
+    """
+    LaTeX 片段的路由统计
+
+    Returns:
+        字典：mathtext / tex 片段数，以及 mathtext 快速路径的命中率 hit_rate（没有片段时为 None）
+    """
+    total = _route_counts['mathtext'] + _route_counts['tex']
+    return dict(_route_counts, hit_rate=_route_counts['mathtext'] / total if total else None)
+
+def _latex_source(latex):
+    """render_latex_as_image 实际交给 TeX 的源码：去掉 $ 并放入 align* 环境"""
+    latex_content = latex.strip('$').replace(r'\begin{align*}', '').replace(r'\end{align*}', '')
+    return r'\begin{align*}' + latex_content + r'\end{align*}'
+
+def _latex_max_width(scale):
+    """单个 LaTeX 片段的最大像素宽度（屏幕宽度去掉右侧 40% 的教师视频区域）"""
+    return int(int(1920 * scale) * (1 - 0.40))
+
+def formula_max_width(scale):
+    """整个公式元素的"理想最大宽度"（再减去一个假设的 5% 左边距）"""
+    return int(int(1920 * scale) * (1 - 0.40 - 0.05))
+
+def _clamp_width(size, max_width):
+    """按 cv2.resize 等比缩小到最大宽度时的 (width, height)"""
+    width, height = size
+    if width <= max_width:
+        return size
+    return float(max_width), height * max_width / width
+
+def _latex_dpi(scale):
+    """LaTeX 光栅化的 DPI，按光栅化比例缩放"""
+    return max(1, int(round(RENDER_DPI * scale)))
+
+def _latex_metrics_key(source, font_size):
+    """TeX 盒子尺寸在精灵缓存中的键字段（盒子尺寸与 DPI 无关）"""
+    return ('latex-metrics', LATEX_RENDERER_VERSION, source, font_size, LATEX_PREAMBLE)
+
+def _tex_box_metrics(source, font_size):
+    """TeX 盒子尺寸 (width, height, descent)，单位为点；优先读取批量排版的页面尺寸"""
+    service = get_latex_service(LATEX_PREAMBLE)
+    metrics = service.batch_metrics(source, font_size) if service is not None else None
+    if metrics is None:
+        from matplotlib.texmanager import TexManager
+        plt.rcParams['text.latex.preamble'] = LATEX_PREAMBLE
+        metrics = TexManager.get_text_width_height_descent(source, font_size)
+    return tuple(metrics)
+
+def measure_latex(latex, font_size=24, scale=1.0, skip_scaling=False):
+    """
+    不光栅化，只根据 TeX 的盒子尺寸测量 render_latex_as_image 输出图像的像素尺寸。
+    盒子尺寸缓存在磁盘上（见 sprite_cache.py）；未命中时，片段已由 compile_latex_batch 批量排版则直接读取其页面尺寸，
+    否则需要运行一次 latex 得到 DVI（matplotlib 按源码缓存 DVI，随后的光栅化直接复用，不会重复排版）
+
+    Args:
+        latex: LaTeX公式字符串
+        font_size: 字体大小
+        scale: 光栅化比例，与 render_latex_as_image 的 scale 含义相同
+        skip_scaling: 与 render_latex_as_image 相同，为 True 时不按最大宽度限制缩小
+
+    Returns:
+        (width, height) 像素尺寸（浮点数）
+    """
+    source = _latex_source(latex)
+    width, height, _descent = cached_metrics(lambda: _tex_box_metrics(source, font_size),
+                                             *_latex_metrics_key(source, font_size))
+    # 盒子尺寸以点为单位，按光栅化 DPI 换算为像素
+    px_per_point = _latex_dpi(scale) / 72
+    size = (width * px_per_point, height * px_per_point)
+    return size if skip_scaling else _clamp_width(size, _latex_max_width(scale))
+
+def _render_latex_matplotlib(latex, font_size, scale):
+    """
+    通过 matplotlib usetex 渲染 LaTeX 公式（LaTeX 服务不可用时的回退路径，每个公式启动一次 TeX）
+
+    Returns:
+        紧致裁剪的预乘 BGRA 图像
+    """
+    # 动态计算画布大小
+    content = latex.strip('$')
+    
+    # 检测特殊结构需要更宽的画布
+    has_fraction = '\\frac' in content
+    has_matrix = 'matrix' in content
+    has_align = 'align' in content
+    
+    # 基本宽度系数
+    width_factor = 0.25
+    # 根据特殊结构增加宽度
+    if has_fraction: width_factor += 0.1
+    if has_matrix: width_factor += 0.3
+    if has_align: width_factor += 0.2
+    
+    # 计算宽度，长公式给更宽的空间
+    content_length = len(content)
+    fig_width = min(max(content_length * width_factor, 2), 12)
+    
+    # 公式通常需要更多垂直空间，特别是分数和矩阵
+    fig_height = min(max(font_size / 30, 1.5), 4)
+    if has_fraction or has_matrix:
+        fig_height = min(fig_height * 1.5, 5)
+    
+    # 创建matplotlib图形，使用动态大小
+    fig = plt.figure(figsize=(fig_width, fig_height), dpi=_latex_dpi(scale), facecolor='none')
+    ax = fig.add_subplot(111)
+    
+    # 设置背景完全透明
+    fig.patch.set_alpha(0.0)
+    ax.set_facecolor((0, 0, 0, 0))
+    ax.patch.set_alpha(0.0)
+    
+    # 移除坐标轴和边框
+    ax.axis('off')
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    
+    # 设置LaTeX导言区
+    plt.rcParams['text.latex.preamble'] = LATEX_PREAMBLE
+    
+    # 渲染LaTeX公式
+    ax.text(0.5, 0.5, _latex_source(latex),
+           fontsize=font_size,
+           color='white',
+           horizontalalignment='center',
+           verticalalignment='center',
+           transform=ax.transAxes,
+           usetex=True)
+    
+    # 调整边距
+    plt.tight_layout(pad=0.5)
+    
+    # 将图形转换为图像
+    buf = io.BytesIO()
+    plt.savefig(buf, format='png', 
+                bbox_inches='tight',
+                pad_inches=0.05,
+                facecolor='none',
+                edgecolor='none',
+                transparent=True)
+    plt.close(fig)
+    
+    # 读取图像数据
+    buf.seek(0)
+    img = cv2.imdecode(np.frombuffer(buf.read(), np.uint8), cv2.IMREAD_UNCHANGED)
+    
+    # 转换为紧致裁剪的预乘 BGRA 精灵：透明背景不参与混合
+    return trim_image(premultiply_image(img), margin=0)
+
+def _clamp_latex_image(canvas, scale, debug=False):
+    """单个 LaTeX 片段宽度超过 _latex_max_width 时等比缩小（预乘 alpha 下插值不会在边缘产生暗边）"""
+    target_max_content_width = _latex_max_width(scale)
+    h_canvas, w_canvas = canvas.shape[:2]
+    if debug:
+        logger.debug(f"LaTeX content (after trim): {w_canvas}x{h_canvas}. Target max width: {target_max_content_width}")
+    if w_canvas > target_max_content_width:
+        new_w = target_max_content_width
+        new_h = int(h_canvas * target_max_content_width / w_canvas)
+        canvas = cv2.resize(canvas, (new_w, new_h), interpolation=cv2.INTER_AREA)
+        if debug:
+            logger.debug(f"LaTeX content scaled to: {new_w}x{new_h}")
+    return canvas
+
+def render_latex_fragment(latex, font_size, skip_scaling=False, debug=False, scale=1.0):
+    """
+    渲染单个 LaTeX 片段并按路由统计：mathtext 支持的片段在进程内渲染，
+    多行环境、矩阵、中文等需要完整 TeX 的片段交给 render_latex_as_image
+
+    Args 与 Returns 同 render_latex_as_image
+    """
+    if mathtext_supported(latex):
+        try:
+            canvas = cached_sprite(lambda: render_mathtext_as_image(latex, font_size, scale),
+                                   'mathtext', MATHTEXT_RENDERER_VERSION, latex, font_size,
+                                   _latex_dpi(scale), MATHTEXT_FONTSET)
+            _route_counts['mathtext'] += 1
+            return canvas if skip_scaling else _clamp_latex_image(canvas, scale, debug)
+        except Exception as e:
+            logger.warning(f"mathtext 渲染失败，改用 TeX: {latex} ({e})")
+    _route_counts['tex'] += 1
+    return render_latex_as_image(latex, font_size, skip_scaling=skip_scaling, debug=debug, scale=scale)
+
+def prefetch_latex(latex_parts, font_size, scale=1.0):
+    """
+    把多个 LaTeX 片段并发交给 LaTeX 服务的各个工作槽位渲染，之后的 render_latex_as_image 直接命中服务的结果缓存。
+    已在磁盘精灵缓存中的片段跳过。
+    服务不可用时什么也不做
+
+    Args:
+        latex_parts: LaTeX 片段列表（带 $ 包裹）
+        font_size: 字体大小
+        scale: 光栅化比例
+    """
+    service = get_latex_service(LATEX_PREAMBLE)
+    if service is not None:
+        dpi = _latex_dpi(scale)
+        service.prefetch([(_latex_source(part), font_size, dpi) for part in latex_parts
+                          if not mathtext_supported(part)
+                          and not is_cached('latex', LATEX_RENDERER_VERSION, _latex_source(part), font_size,
+                                            dpi, LATEX_PREAMBLE)])
+
+def _render_latex_canvas(latex, font_size, scale):
+    """
+    渲染 LaTeX 片段（不限制宽度）：优先使用常驻的 LaTeX 服务，不可用或失败时回退到 matplotlib usetex。
+    两条路径都失败时抛出异常
+
+    Returns:
+        紧致裁剪的预乘 BGRA 图像
+    """
+    service = get_latex_service(LATEX_PREAMBLE)
+    if service is not None:
+        try:
+            return service.render(_latex_source(latex), font_size, _latex_dpi(scale))
+        except LatexServiceError as e:
+            logger.warning(f"LaTeX 服务渲染失败，回退到 matplotlib: {e}")
+    return _render_latex_matplotlib(latex, font_size, scale)
+
+def render_latex_as_image(latex, font_size=24, skip_scaling=False, debug=False, scale=1.0):
     """
-    将LaTeX公式渲染为图像
+    将LaTeX公式渲染为图像。优先使用常驻的 LaTeX 服务（见 latex_service.py），不可用或失败时回退到 matplotlib usetex。
+    渲染结果按源码、字号、DPI 缓存在磁盘上（见 sprite_cache.py），命中时不启动 TeX
     
     Args:
         latex: LaTeX公式字符串
         font_size: 字体大小
         skip_scaling: 是否跳过缩放 (注意：此标志可能需要重新评估，但我们首先确保内部缩放逻辑正确)
         debug: 是否输出调试信息
+        scale: 光栅化比例，DPI 与最大宽度限制都按此比例缩放
         
     Returns:
-        渲染后的图像 (已裁剪和缩放)
+        渲染后的预乘 BGRA 图像 (已紧致裁剪和缩放)
     """
     try:
         logger.info(f"渲染LaTeX公式: {latex}, 字体大小: {font_size}")
         
-        # 动态计算画布大小
-        content = latex.strip('$')
+        canvas = cached_sprite(lambda: _render_latex_canvas(latex, font_size, scale),
+                               'latex', LATEX_RENDERER_VERSION, _latex_source(latex), font_size,
+                               _latex_dpi(scale), LATEX_PREAMBLE)
         
-        # 检测特殊结构需要更宽的画布
-        has_fraction = '\\frac' in content
-        has_matrix = 'matrix' in content
-        has_align = 'align' in content
-        
-        # 基本宽度系数
-        width_factor = 0.25
-        # 根据特殊结构增加宽度
-        if has_fraction: width_factor += 0.1
-        if has_matrix: width_factor += 0.3
-        if has_align: width_factor += 0.2
-        
-        # 计算宽度，长公式给更宽的空间
-        content_length = len(content)
-        fig_width = min(max(content_length * width_factor, 2), 12)
-        
-        # 公式通常需要更多垂直空间，特别是分数和矩阵
-        fig_height = min(max(font_size / 30, 1.5), 4)
-        if has_fraction or has_matrix:
-            fig_height = min(fig_height * 1.5, 5)
-        
-        # 创建matplotlib图形，使用动态大小
-        fig = plt.figure(figsize=(fig_width, fig_height), dpi=200, facecolor='none')
-        ax = fig.add_subplot(111)
-        
-        # 设置背景完全透明
-        fig.patch.set_alpha(0.0)
-        ax.set_facecolor((0, 0, 0, 0))
-        ax.patch.set_alpha(0.0)
-        
-        # 移除坐标轴和边框
-        ax.axis('off')
-        for spine in ax.spines.values():
-            spine.set_visible(False)
-        
-        # 设置LaTeX导言区
-        plt.rcParams['text.latex.preamble'] = r'\usepackage{amsmath,amssymb,ctex}'
-        
-        # 渲染LaTeX公式
-        latex_content = latex.strip('$').replace(r'\begin{align*}', '').replace(r'\end{align*}', '')
-        ax.text(0.5, 0.5, r'\begin{align*}' + latex_content + r'\end{align*}',
-               fontsize=font_size,
-               color='white',
-               horizontalalignment='center',
-               verticalalignment='center',
-               transform=ax.transAxes,
-               usetex=True)
-        
-        # 调整边距
-        plt.tight_layout(pad=0.5)
-        
-        # 将图形转换为图像
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', 
-                    bbox_inches='tight',
-                    pad_inches=0.05,
-                    facecolor='none',
-                    edgecolor='none',
-                    transparent=True)
-        plt.close(fig)
-        
-        # 读取图像数据
-        buf.seek(0)
-        img = cv2.imdecode(np.frombuffer(buf.read(), np.uint8), cv2.IMREAD_UNCHANGED)
-        
-        # 处理透明通道 (BGRA -> RGB)
-        if img.shape[2] == 4:  # BGRA
-            # 创建一个与黑板背景颜色匹配的画布
-            canvas = np.ones((img.shape[0], img.shape[1], 3), dtype=np.uint8) * np.array([30, 30, 30], dtype=np.uint8)
-            
-            # 提取透明通道作为蒙版
-            alpha = img[:, :, 3] / 255.0
-            
-            # 只将非透明部分渲染为白色
-            for c in range(3):  # RGB通道
-                canvas[:, :, c] = canvas[:, :, c] * (1 - alpha) + 255 * alpha
-            
-            # 裁剪图像
-            canvas = trim_image(canvas)
-            
-            # 检查是否需要缩放图像
-            if not skip_scaling: # This flag is important. If True, no scaling happens here.
-                max_width_screen = 1920
-                safe_right_factor = 0.40 # Use a consistent factor
-                target_max_content_width = int(max_width_screen * (1 - safe_right_factor))
-                
-                h_canvas, w_canvas = canvas.shape[:2]
-                if debug:
-                    logger.debug(f"LaTeX content (after trim): {w_canvas}x{h_canvas}. Target max width: {target_max_content_width}")
-                
-                if w_canvas > target_max_content_width:
-                    scale = target_max_content_width / w_canvas
-                    new_w = target_max_content_width
-                    new_h = int(h_canvas * scale)
-                    canvas = cv2.resize(canvas, (new_w, new_h), interpolation=cv2.INTER_AREA)
-                    if debug:
-                        logger.debug(f"LaTeX content scaled to: {new_w}x{new_h}")
-            
-            return canvas
-        else:
-            return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        if not skip_scaling: # This flag is important. If True, no scaling happens here.
+            canvas = _clamp_latex_image(canvas, scale, debug)
+        return canvas
             
     except Exception as e:
         logger.error(f"渲染LaTeX公式时出错: {latex}")
         logger.error(str(e))
         logger.error(traceback.format_exc())
         # 创建一个默认图像，使用与黑板背景匹配的颜色
-        img = np.ones((100, 300, 3), dtype=np.uint8) * np.array([30, 30, 30], dtype=np.uint8)
-        cv2.putText(img, "LaTeX Error", (10, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-        return img
+        return text_placeholder("LaTeX Error", (100, 300), (10, 50), thickness=2, scale=scale)
+
+def _normalize_formula(formula):
+    """修正中文标点被错误包含在 $...$ 中的问题"""
+    # 使用正则表达式将类似 "$...$。" 的模式修正为 "$...$ 。"
+    punctuation_pattern = r'(\$[^$]*?)([。，！？；：])\$'
+    formula = re.sub(punctuation_pattern, r'\1$\2', formula)
+    
+    # 同时处理 "$...[标点]$" 的情况
+    punctuation_pattern2 = r'\$([^$]*?)([。，！？；：])\$'
+    return re.sub(punctuation_pattern2, r'$\1$ \2', formula)
+
+def _formula_parts(formula, debug=False):
+    """
+    把（已修正标点的）公式拆分为按从左到右顺序排列的片段，渲染与测量共用
 
-def render_formula(formula, font_size, debug=False):
+    Returns:
+        (is_latex, 片段文本) 的列表；LaTeX 片段带 $ 包裹
+    """
+    has_chinese = any('\u4e00' <= c <= '\u9fff' for c in formula)
+    contains_dollar = '$' in formula
+    contains_backslash = '\\' in formula # 基本的LaTeX命令指示
+
+    if formula.startswith('$') and formula.endswith('$'):
+        # Case 1: 纯粹由 $...$ 包裹的 LaTeX, e.g., "$\frac{1}{2}$"
+        if debug: logger.debug(f"Formula '{formula[:30]}...': Case 1 - Purely enclosed LaTeX.")
+        return [(True, formula)]
+    
+    if contains_dollar:
+        # Case 2: 包含 '$'，因此是混合内容或需要分割的 LaTeX。
+        # e.g., "Text $\alpha$", or "B. $\frac{1}{2021}$"
+        if debug: logger.debug(f"Formula '{formula[:30]}...': Case 2 - Mixed content with '$', splitting.")
+        components = re.split(r'(\$[^$]*\$)', formula) # $...$ 标记一个 LaTeX 部分
+        # 跳过空字符串或纯空白字符串
+        parts = [(comp.startswith('$') and comp.endswith('$'), comp) for comp in components if comp.strip()]
+        if not parts:
+            logger.warning(f"Formula '{formula[:30]}...' resulted in no renderable parts after splitting. Rendering as plain text.")
+            return [(False, formula)] # 回退到纯文本渲染
+        return parts
+    
+    if contains_backslash and not has_chinese:
+        # Case 3: 包含反斜杠 (可能是简单 LaTeX 命令如 \frac), 不含美元符号, 且不含中文.
+        # e.g., "\frac{1}{2}" or "\alpha"
+        # 这对于用户输入简单LaTeX命令但不写$时比较方便，但如果反斜杠用于非LaTeX转义则可能出问题。
+        if debug: logger.debug(f"Formula '{formula[:30]}...': Case 3 - Backslash, no dollar, no Chinese. Wrapping with $.")
+        return [(True, f'${formula}$')] # 用$包裹后按纯LaTeX处理
+    
+    # Case 4: 纯文本 (可能包含中文, 或者包含反斜杠但同时也有中文或美元符号而被前述逻辑排除)
+    # e.g., "普通文本", "A", "一些中文\English"
+    if debug: logger.debug(f"Formula '{formula[:30]}...': Case 4 - Rendering as plain text.")
+    return [(False, formula)]
+
+def compile_latex_batch(formulas):
+    """
+    布局之前的预处理：收集一道题所有公式中的 LaTeX 片段（包括混合内容拆分出的片段），
+    在一次 latex 运行中排版为同一文档的各页。之后 measure_latex 直接读取页面尺寸，
+    render_latex_as_image 只需光栅化对应的页面，每道题只启动一次 TeX。
+    盒子尺寸已在磁盘缓存中的片段不再排版（其精灵通常也已缓存）。
+    LaTeX 服务不可用或批量排版失败时什么也不做，片段在渲染时逐个排版
+
+    Args:
+        formulas: (公式字符串, 字体大小) 列表
+
+    Returns:
+        批量排版成功的片段数
+    """
+    service = get_latex_service(LATEX_PREAMBLE)
+    if service is None:
+        return 0
+    entries = []
+    for formula, font_size in formulas:
+        for is_latex, part in _formula_parts(_normalize_formula(formula)):
+            # mathtext 能渲染的片段不需要 TeX
+            if is_latex and not mathtext_supported(part):
+                source = _latex_source(part)
+                if not is_cached(*_latex_metrics_key(source, font_size)):
+                    entries.append((source, font_size))
+    if not entries:
+        return 0
+    try:
+        return service.compile_batch(entries)
+    except LatexServiceError as e:
+        logger.warning(f"LaTeX 批量排版失败，片段将逐个排版: {e}")
+        return 0
+
+def measure_formula(formula, font_size, scale=1.0, skip_scaling=False):
+    """
+    不光栅化，只测量 render_formula 输出图像的像素尺寸，用于在光栅化之前求解布局缩放因子
+
+    Args:
+        formula: 公式字符串
+        font_size: 字体大小
+        scale: 光栅化比例，与 render_formula 的 scale 含义相同；尺寸与 scale 近似成正比
+        skip_scaling: 与 render_formula 相同，为 True 时不按最大宽度限制缩小
+
+    Returns:
+        (width, height) 像素尺寸（浮点数）；测量失败（如 LaTeX 无法排版）时抛出异常
+    """
+    sizes = []
+    for is_latex, part in _formula_parts(_normalize_formula(formula)):
+        if is_latex and mathtext_supported(part):
+            size = measure_mathtext(part, font_size, scale)
+            sizes.append(size if skip_scaling else _clamp_width(size, _latex_max_width(scale)))
+        elif is_latex:
+            sizes.append(measure_latex(part, font_size, scale, skip_scaling))
+        else:
+            sizes.append(measure_text(part, font_size, scale))
+    width = sum(w for w, _ in sizes) + max(1, int(round(PART_GAP * scale))) * (len(sizes) - 1)
+    height = max(h for _, h in sizes)
+    if skip_scaling:
+        return width, height
+    return _clamp_width((width, height), formula_max_width(scale))
+
+def render_formula(formula, font_size, debug=False, scale=1.0, skip_scaling=False):
     """
     渲染公式
     
@@ -149,146 +398,95 @@ def render_formula(formula, font_size, debug=False):
         formula: 公式字符串
         font_size: 字体大小
         debug: 是否输出调试信息
+        scale: 光栅化比例（草稿模式下降低DPI），图像像素尺寸与最大宽度限制都约为 scale=1.0 时的 scale 倍
+        skip_scaling: 跳过最大宽度限制（调用方已根据 measure_formula 求解了最终尺寸，图像不再二次缩放）
         
     Returns:
-        公式图像 (已确保宽度不超过安全区内容限制)
+        预乘 BGRA 公式图像 (已紧致裁剪；skip_scaling 为 False 时确保宽度不超过安全区内容限制)
     """
     try:
         logger.info(f"渲染公式: {formula}, 字体大小: {font_size}")
         
         # *** 关键修复：在处理之前，先处理中文标点被错误包含在$...$中的问题 ***
-        # 使用正则表达式将类似 "$...$。" 的模式修正为 "$...$ 。"
-        punctuation_pattern = r'(\$[^$]*?)([。，！？；：])\$'
-        formula = re.sub(punctuation_pattern, r'\1$\2', formula)
-        
-        # 同时处理 "$...[标点]$" 的情况
-        punctuation_pattern2 = r'\$([^$]*?)([。，！？；：])\$'
-        formula = re.sub(punctuation_pattern2, r'$\1$ \2', formula)
+        formula = _normalize_formula(formula)
         
         if debug:
             logger.info(f"标点修正后的公式: {formula}")
         
-        max_width_screen = 1920
         # 使用与 render_latex_as_image 中一致的右侧安全因子，尽管最终缩放由 blackboard_video_generator 控制，
         # 但这里可以用于指导单个元素渲染时的最大期望宽度。
-        # 最终的元素尺寸和位置是由 BlackboardVideoGenerator 的 _scale_step_content 和布局逻辑决定的。
+        # 最终的元素尺寸和位置是由 BlackboardVideoGenerator 的布局逻辑决定的。
         # 此处的 adjusted_max_content_width 更多是作为一个"理想最大宽度"，单个元素渲染器尽量不要超过它。
-        safe_right_factor = 0.40 
-        # 假设左侧也有一个安全边距，例如0.05，那么内容区大约是 1 - 0.05 - 0.40 = 0.55
-        # 但单个渲染器可能不知道全局的 safe_left，所以这里仅基于 safe_right 做一个大致约束
-        adjusted_max_content_width = int(max_width_screen * (1 - safe_right_factor - 0.05)) # 减去一个假设的左边距
-
-        has_chinese = any('\u4e00' <= c <= '\u9fff' for c in formula)
-        contains_dollar = '$' in formula
-        contains_backslash = '\\' in formula # 基本的LaTeX命令指示
+        # 单个渲染器不知道全局的 safe_left，所以这里假设左侧有 5% 的边距
+        adjusted_max_content_width = formula_max_width(scale)
 
-        rendered_image = None
+        parts = _formula_parts(formula, debug)
+        # 混合内容中需要 TeX 的多个 LaTeX 片段先并发渲染（LaTeX 服务有多个工作槽位时）
+        latex_parts = [comp_text for is_latex, comp_text in parts if is_latex]
+        if len(latex_parts) > 1:
+            prefetch_latex(latex_parts, font_size, scale)
 
-        if formula.startswith('$') and formula.endswith('$'):
-            # Case 1: 纯粹由 $...$ 包裹的 LaTeX, e.g., "$\frac{1}{2}$"
-            if debug: logger.debug(f"Formula '{formula[:30]}...': Case 1 - Purely enclosed LaTeX.")
-            rendered_image = render_latex_as_image(formula, font_size, skip_scaling=False, debug=debug)
-        
-        elif contains_dollar:
-            # Case 2: 包含 '$'，因此是混合内容或需要分割的 LaTeX。
-            # e.g., "Text $\alpha$", or "B. $\frac{1}{2021}$"
-            if debug: logger.debug(f"Formula '{formula[:30]}...': Case 2 - Mixed content with '$', splitting.")
-            components = re.split(r'(\$[^$]*\$)', formula) # $...$ 标记一个 LaTeX 部分
-            rendered_parts = []
-            valid_parts_found = False
-
-            for comp_text in components:
-                if not comp_text.strip(): # 跳过空字符串或纯空白字符串
-                    continue
-                valid_parts_found = True
-                if comp_text.startswith('$') and comp_text.endswith('$'):
-                    # 这是一个 LaTeX 部分
-                    part_img = render_latex_as_image(comp_text, font_size, skip_scaling=False, debug=debug)
-                else:
-                    # 这是一个纯文本部分
-                    part_img = render_text_as_image(comp_text, font_size, debug=debug)
-                
-                if part_img is None: # 渲染器可能返回None如果出错
-                    logger.warning(f"Component '{comp_text[:30]}' from '{formula[:30]}' failed to render. Skipping.")
-                    continue
-                rendered_parts.append(part_img)
-            
-            if not rendered_parts or not valid_parts_found:
-                logger.warning(f"Formula '{formula[:30]}...' resulted in no renderable parts after splitting. Rendering as plain text.")
-                rendered_image = render_text_as_image(formula, font_size, debug=debug) # 回退到纯文本渲染
+        rendered_parts = []
+        for is_latex, comp_text in parts:
+            if is_latex:
+                # 这是一个 LaTeX 部分
+                part_img = render_latex_fragment(comp_text, font_size, skip_scaling=skip_scaling, debug=debug, scale=scale)
             else:
-                # 拼接渲染后的各个部分
-                total_parts_width = sum(img.shape[1] for img in rendered_parts if img is not None and img.shape[1] > 0)
-                if len(rendered_parts) > 1:
-                    total_parts_width += 5 * (len([p for p in rendered_parts if p is not None]) - 1)
-                
-                max_parts_height = 0
-                if rendered_parts:
-                    valid_heights = [img.shape[0] for img in rendered_parts if img is not None and img.shape[0] > 0]
-                    if valid_heights: max_parts_height = max(valid_heights)
-                if max_parts_height == 0: max_parts_height = 50 # 最小高度回退
-
-                if total_parts_width <= 0 : total_parts_width = 1 # 最小宽度回退
-
-                combined_img = np.ones((max_parts_height, total_parts_width, 3), dtype=np.uint8) * np.array([30, 30, 30], dtype=np.uint8)
-                x_offset = 0
-                for img_part in rendered_parts:
-                    if img_part is None or img_part.shape[0] == 0 or img_part.shape[1] == 0:
-                        continue
-                    h_part, w_part = img_part.shape[:2]
-                    # 智能对齐：矮片段（如标点）底对齐，高片段（如公式）居中对齐
-                    if h_part < 0.6 * max_parts_height:
-                        y_offset = max_parts_height - h_part  # 底对齐，让标点贴近基线
-                    else:
-                        y_offset = (max_parts_height - h_part) // 2  # 居中对齐
-                    try:
-                        combined_img[y_offset:y_offset+h_part, x_offset:x_offset+w_part] = img_part
-                    except ValueError as e:
-                        logger.error(f"Error combining part for '{formula[:30]}...'. Part shape: {img_part.shape}, combined_img shape: {combined_img.shape}, x_offset: {x_offset}, y_offset: {y_offset}. Error: {e}")
-                        continue 
-                    x_offset += w_part + 5
-                rendered_image = combined_img
-        
-        elif contains_backslash and not has_chinese :
-            # Case 3: 包含反斜杠 (可能是简单 LaTeX 命令如 \frac), 不含美元符号, 且不含中文.
-            # e.g., "\frac{1}{2}" or "\alpha"
-            # 这对于用户输入简单LaTeX命令但不写$时比较方便，但如果反斜杠用于非LaTeX转义则可能出问题。
-            if debug: logger.debug(f"Formula '{formula[:30]}...': Case 3 - Backslash, no dollar, no Chinese. Wrapping with $.")
-            formula_to_render = f'${formula}$' # 用$包裹后按纯LaTeX处理
-            rendered_image = render_latex_as_image(formula_to_render, font_size, skip_scaling=False, debug=debug)
+                # 这是一个纯文本部分
+                part_img = render_text_as_image(comp_text, font_size, debug=debug, scale=scale)
             
+            if part_img is None: # 渲染器可能返回None如果出错
+                logger.warning(f"Component '{comp_text[:30]}' from '{formula[:30]}' failed to render. Skipping.")
+                continue
+            rendered_parts.append(part_img)
+
+        if len(rendered_parts) <= 1:
+            rendered_image = rendered_parts[0] if rendered_parts else None
         else:
-            # Case 4: 纯文本 (可能包含中文, 或者包含反斜杠但同时也有中文或美元符号而被前述逻辑排除)
-            # e.g., "普通文本", "A", "一些中文\English"
-            if debug: logger.debug(f"Formula '{formula[:30]}...': Case 4 - Rendering as plain text.")
-            rendered_image = render_text_as_image(formula, font_size, debug=debug)
+            # 拼接渲染后的各个部分，片段间距同样按光栅化比例缩放
+            part_gap = max(1, int(round(PART_GAP * scale)))
+            total_parts_width = sum(img.shape[1] for img in rendered_parts) + part_gap * (len(rendered_parts) - 1)
+            max_parts_height = max(img.shape[0] for img in rendered_parts)
+            if max_parts_height == 0: max_parts_height = 50 # 最小高度回退
+
+            # 各片段不重叠，直接拷贝到透明画布上即可
+            combined_img = np.zeros((max_parts_height, total_parts_width, 4), dtype=np.uint8)
+            x_offset = 0
+            for img_part in rendered_parts:
+                h_part, w_part = img_part.shape[:2]
+                if h_part == 0 or w_part == 0:
+                    continue
+                # 智能对齐：矮片段（如标点）底对齐，高片段（如公式）居中对齐
+                if h_part < 0.6 * max_parts_height:
+                    y_offset = max_parts_height - h_part  # 底对齐，让标点贴近基线
+                else:
+                    y_offset = (max_parts_height - h_part) // 2  # 居中对齐
+                combined_img[y_offset:y_offset+h_part, x_offset:x_offset+w_part] = img_part
+                x_offset += w_part + part_gap
+            rendered_image = combined_img
 
         # --- 后续统一处理：检查图像是否成功生成，然后裁剪和缩放 ---
         if rendered_image is None:
             logger.error(f"Formula '{formula[:30]}...' failed to produce an image through all processing cases.")
-            img = np.ones((50, 200, 3), dtype=np.uint8) * np.array([30, 30, 30], dtype=np.uint8)
-            cv2.putText(img, "Render Error", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 0, 0), 1)
-            return img # 直接返回错误图像
+            return text_placeholder("Render Error", (50, 200), (10, 30), color=(255, 0, 0), scale=scale) # 直接返回错误图像
         
-        # 1. 裁剪掉边缘空白
-        final_image = trim_image(rendered_image)
+        # 1. 裁剪掉边缘的透明区域
+        final_image = trim_image(rendered_image, margin=0)
         h_final, w_final = final_image.shape[:2]
         if w_final == 0 or h_final == 0: # trim_image 可能返回空图像
             logger.warning(f"Formula '{formula[:30]}...' resulted in zero-dimension image after trim. Using placeholder error image.")
-            img = np.ones((50, 200, 3), dtype=np.uint8) * np.array([30, 30, 30], dtype=np.uint8)
-            cv2.putText(img, "Empty Image", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 0, 0), 1)
-            return img
+            return text_placeholder("Empty Image", (50, 200), (10, 30), color=(255, 0, 0), scale=scale)
 
         if debug:
             logger.debug(f"Formula '{formula[:20]}...' (after local trim): {w_final}x{h_final}. Ideal max content width: {adjusted_max_content_width}")
 
         # 2. 如果裁剪后宽度仍然超出"理想最大宽度"，则缩放。
-        #    注意：这里的缩放是渲染器级别的初步缩放。
-        #    最终的缩放以适应步骤安全区是由 BlackboardVideoGenerator._scale_step_content 控制的。
-        if w_final > adjusted_max_content_width:
-            scale = adjusted_max_content_width / w_final
+        #    注意：这里的缩放是渲染器级别的初步缩放，measure_formula 按同样的规则预测缩放后的尺寸。
+        #    适应步骤安全区的缩放由 BlackboardVideoGenerator 在光栅化之前求解，并通过 scale 参数传入。
+        if not skip_scaling and w_final > adjusted_max_content_width:
+            fit = adjusted_max_content_width / w_final
             new_w = adjusted_max_content_width
-            new_h = max(1, int(h_final * scale)) # 确保 new_h 不为0
+            new_h = max(1, int(h_final * fit)) # 确保 new_h 不为0
             final_image = cv2.resize(final_image, (new_w, new_h), interpolation=cv2.INTER_AREA)
             if debug:
                 logger.debug(f"Formula '{formula[:20]}...' locally scaled to: {new_w}x{new_h} to fit ideal max width.")
@@ -298,6 +496,4 @@ def render_formula(formula, font_size, debug=False):
     except Exception as e:
         logger.error(f"渲染公式时发生严重错误: {formula[:30]}..., Error: {str(e)}")
         logger.error(traceback.format_exc())
-        img = np.ones((50, 200, 3), dtype=np.uint8) * np.array([30, 30, 30], dtype=np.uint8)
-        cv2.putText(img, "Formula Error", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 0, 0), 1)
-        return img 
\ No newline at end of file
+        return text_placeholder("Formula Error", (50, 200), (10, 30), color=(255, 0, 0), scale=scale) 
\ No newline at end of file
@@ -2,10 +2,11 @@ import numpy as np
 import cv2
 import re
 import math
+import bisect
 import logging
 import traceback
 from typing import List, Dict, Any, Tuple
-from ..utils.image_utils import trim_image
+from ..utils.image_utils import trim_image, alpha_bbox, text_placeholder
 from .text_renderer import render_text_as_image
 
 # 配置日志
@@ -387,107 +388,85 @@ def polar_to_cart(cx: float, cy: float, r: float, angle_deg: float):
     rad = math.radians(angle_deg)
     return cx + r * math.cos(rad), cy + r * math.sin(rad)
 
-def render_geometry(geometry_data: Dict[str, Any], progress: float = 1.0, scale_factor: float = 1.0, debug: bool = False) -> np.ndarray:
-    """渲染几何图形"""
-    try:
-        if debug:
-            logger.debug(f"开始渲染几何图形，数据类型: {type(geometry_data)}")
-        
-        # 创建透明画布
-        img_size = 400
-        canvas = np.zeros((img_size, img_size, 4), dtype=np.uint8)
-        
-        if not isinstance(geometry_data, dict):
-            logger.error(f"几何数据必须是字典类型，但收到了: {type(geometry_data)}")
-            raise ValueError("几何数据必须是字典类型")
-        
-        # 处理content字段包装的情况
-        actual_data = geometry_data.get('content', geometry_data)
-        
+# 几何图形画布的边长（像素）
+GEOMETRY_CANVAS_SIZE = 400
+
+def _layout_geometry(geometry_data: Dict[str, Any], scale_factor: float = 1.0, debug: bool = False) -> Dict[str, Any]:
+    """
+    解析几何数据中的所有形状和标签，并计算统一的变换参数
+
+    Args:
+        geometry_data: 几何图形数据
+        scale_factor: 缩放因子
+        debug: 是否输出调试信息
+
+    Returns:
+        包含 shapes_commands / actual_data / label_images / scale / offset_x / offset_y 的字典
+    """
+    img_size = GEOMETRY_CANVAS_SIZE
+    if not isinstance(geometry_data, dict):
+        logger.error(f"几何数据必须是字典类型，但收到了: {type(geometry_data)}")
+        raise ValueError("几何数据必须是字典类型")
+
+    # 处理content字段包装的情况
+    actual_data = geometry_data.get('content', geometry_data)
+
+    if debug:
+        logger.debug(f"处理几何数据结构: {actual_data.keys()}")
+        for key in actual_data.keys():
+            logger.debug(f"  - {key}类型: {type(actual_data[key])}")
+            if key == 'line' and isinstance(actual_data[key], list):
+                logger.debug(f"    线段数量: {len(actual_data[key])}")
+            elif key == 'label' and isinstance(actual_data[key], list):
+                logger.debug(f"    标签数量: {len(actual_data[key])}")
+
+    # 使用处理后的数据继续执行
+    shapes_commands = {}
+    combined_bbox = None
+
+    # 检查标签数据
+    has_labels = False
+    if 'label' in actual_data and isinstance(actual_data['label'], list) and len(actual_data['label']) > 0:
+        has_labels = True
         if debug:
-            logger.debug(f"处理几何数据结构: {actual_data.keys()}")
-            for key in actual_data.keys():
-                logger.debug(f"  - {key}类型: {type(actual_data[key])}")
-                if key == 'line' and isinstance(actual_data[key], list):
-                    logger.debug(f"    线段数量: {len(actual_data[key])}")
-                elif key == 'label' and isinstance(actual_data[key], list):
-                    logger.debug(f"    标签数量: {len(actual_data[key])}")
-        
-        # 使用处理后的数据继续执行
-        shapes_commands = {}
-        combined_bbox = None
-        
-        # 检查标签数据
-        has_labels = False
-        if 'label' in actual_data and isinstance(actual_data['label'], list) and len(actual_data['label']) > 0:
-            has_labels = True
+            logger.debug(f"检测到{len(actual_data['label'])}个标签")
+
+    # 修改这部分代码来处理不同类型的几何图形
+    for shape_name, shape_data in actual_data.items():
+        # 特殊处理标签数组
+        if shape_name == "label":
             if debug:
-                logger.debug(f"检测到{len(actual_data['label'])}个标签")
-        
-        # 修改这部分代码来处理不同类型的几何图形
-        for shape_name, shape_data in actual_data.items():
-            # 特殊处理标签数组
-            if shape_name == "label":
-                if debug:
-                    logger.debug(f"跳过标签数组处理，将在后续单独处理")
-                continue
-            
-            # 处理数组类型的几何元素（如线段）
-            if shape_name == "line" and isinstance(shape_data, list):
-                if debug:
-                    logger.debug(f"发现线段数组：{len(shape_data)}个线段")
-                
-                for i, item in enumerate(shape_data):
-                    if isinstance(item, dict) and 'path' in item:
-                        path_str = item['path']
-                        if debug:
-                            logger.debug(f"处理线段{i}的SVG路径: {path_str}, 样式: {item.get('style')}")
-                        
-                        item_key = f"line_{i}"  # 创建唯一键
-                        commands = parse_svg_path(path_str)
-                        if commands:
-                            shapes_commands[item_key] = commands
-                            
-                            # 保存原始样式信息
-                            style_key = f"{item_key}_style"
-                            shapes_commands[style_key] = item.get('style', {})
-                            if debug:
-                                logger.debug(f"为线段{i}保存样式信息，键名: {style_key}")
-                            
-                            # 计算当前形状的边界框
-                            bbox = calculate_bbox(commands)
-                            if bbox:
-                                if debug:
-                                    logger.debug(f"线段{i}的边界框: {bbox}")
-                                
-                                # 更新组合边界框
-                                if combined_bbox is None:
-                                    combined_bbox = bbox
-                                else:
-                                    combined_bbox = (
-                                        min(combined_bbox[0], bbox[0]),
-                                        min(combined_bbox[1], bbox[1]),
-                                        max(combined_bbox[2], bbox[2]),
-                                        max(combined_bbox[3], bbox[3])
-                                    )
-                    elif debug:
-                        logger.warning(f"线段{i}数据结构异常: {item}")
-            else:
-                # 原有的单个形状处理
-                if isinstance(shape_data, dict) and 'path' in shape_data:
-                    path_str = shape_data['path']
+                logger.debug(f"跳过标签数组处理，将在后续单独处理")
+            continue
+
+        # 处理数组类型的几何元素（如线段）
+        if shape_name == "line" and isinstance(shape_data, list):
+            if debug:
+                logger.debug(f"发现线段数组：{len(shape_data)}个线段")
+
+            for i, item in enumerate(shape_data):
+                if isinstance(item, dict) and 'path' in item:
+                    path_str = item['path']
                     if debug:
-                        logger.debug(f"处理形状 {shape_name} 的SVG路径: {path_str}")
+                        logger.debug(f"处理线段{i}的SVG路径: {path_str}, 样式: {item.get('style')}")
+
+                    item_key = f"line_{i}"  # 创建唯一键
                     commands = parse_svg_path(path_str)
                     if commands:
-                        shapes_commands[shape_name] = commands
-                        
+                        shapes_commands[item_key] = commands
+
+                        # 保存原始样式信息
+                        style_key = f"{item_key}_style"
+                        shapes_commands[style_key] = item.get('style', {})
+                        if debug:
+                            logger.debug(f"为线段{i}保存样式信息，键名: {style_key}")
+
                         # 计算当前形状的边界框
                         bbox = calculate_bbox(commands)
                         if bbox:
                             if debug:
-                                logger.info(f"形状 {shape_name} 的边界框: {bbox}")
-                            
+                                logger.debug(f"线段{i}的边界框: {bbox}")
+
                             # 更新组合边界框
                             if combined_bbox is None:
                                 combined_bbox = bbox
@@ -498,21 +477,25 @@ def render_geometry(geometry_data: Dict[str, Any], progress: float = 1.0, scale_
                                     max(combined_bbox[2], bbox[2]),
                                     max(combined_bbox[3], bbox[3])
                                 )
-                # ---------- 新增：兼容 {type:"circle", cx, cy, r} ----------
-                elif isinstance(shape_data, dict) and shape_data.get('type') == 'circle':
-                    cx = shape_data['cx']
-                    cy = shape_data['cy']
-                    r  = shape_data['r']
-                    # 转成"双弧"完整圆路径
-                    path_str = (
-                        f"M {cx} {cy} m -{r} 0 "        # 起点在圆左端
-                        f"a {r} {r} 0 1 0 {2*r} 0 "     # 第一段弧
-                        f"a {r} {r} 0 1 0 {-2*r} 0"     # 第二段弧
-                    )
-                    commands = parse_svg_path(path_str)
-                    if commands:
-                        shapes_commands[shape_name] = commands
-                        bbox = calculate_bbox(commands)
+                elif debug:
+                    logger.warning(f"线段{i}数据结构异常: {item}")
+        else:
+            # 原有的单个形状处理
+            if isinstance(shape_data, dict) and 'path' in shape_data:
+                path_str = shape_data['path']
+                if debug:
+                    logger.debug(f"处理形状 {shape_name} 的SVG路径: {path_str}")
+                commands = parse_svg_path(path_str)
+                if commands:
+                    shapes_commands[shape_name] = commands
+
+                    # 计算当前形状的边界框
+                    bbox = calculate_bbox(commands)
+                    if bbox:
+                        if debug:
+                            logger.info(f"形状 {shape_name} 的边界框: {bbox}")
+
+                        # 更新组合边界框
                         if combined_bbox is None:
                             combined_bbox = bbox
                         else:
@@ -522,283 +505,526 @@ def render_geometry(geometry_data: Dict[str, Any], progress: float = 1.0, scale_
                                 max(combined_bbox[2], bbox[2]),
                                 max(combined_bbox[3], bbox[3])
                             )
-                # ---------- 椭圆 ellipse ----------
-                elif isinstance(shape_data, dict) and shape_data.get('type') == 'ellipse':
-                    cx = shape_data['cx'];  cy  = shape_data['cy']
-                    rx = shape_data['rx'];  ry  = shape_data['ry']
-                    # 双弧完整椭圆：a rx ry …
-                    path_str = (
-                        f"M {cx} {cy} m -{rx} 0 "
-                        f"a {rx} {ry} 0 1 0 {2*rx} 0 "
-                        f"a {rx} {ry} 0 1 0 {-2*rx} 0"
-                    )
-                    commands = parse_svg_path(path_str)
-                    if commands:
-                        shapes_commands[shape_name] = commands
-                        bbox = calculate_bbox(commands)
-                        if combined_bbox is None: combined_bbox = bbox
-                        else:
-                            combined_bbox = (min(combined_bbox[0], bbox[0]),
-                                             min(combined_bbox[1], bbox[1]),
-                                             max(combined_bbox[2], bbox[2]),
-                                             max(combined_bbox[3], bbox[3]))
-                # ---------- 扇形/圆弧 sector | arc ----------
-                elif isinstance(shape_data, dict) and shape_data.get('type') in ('sector', 'arc'):
-                    cx = shape_data['cx']; cy = shape_data['cy']; r = shape_data['r']
-                    θ0 = shape_data['startAngle']   # 单位：度
-                    θ1 = shape_data['endAngle']     # 逆时针为正，保持与常规数学方向一致
-                    # 起止点
-                    x0, y0 = polar_to_cart(cx, cy, r, θ0)
-                    x1, y1 = polar_to_cart(cx, cy, r, θ1)
-                    # 角差与 SVG 标志
-                    dθ = (θ1 - θ0) % 360
-                    large_arc_flag = 1 if dθ > 180 else 0
-                    sweep_flag     = 1  # 逆时针
-                    arc_cmd = f"A {r} {r} 0 {large_arc_flag} {sweep_flag} {x1} {y1}"
-                    if shape_data['type'] == 'sector':
-                        # M->L 起点, 弧, L->中心, Z 闭合
-                        path_str = f"M {cx} {cy} L {x0} {y0} {arc_cmd} Z"
-                    else:  # 纯圆弧
-                        path_str = f"M {x0} {y0} {arc_cmd}"
-                    commands = parse_svg_path(path_str)
-                    if commands:
-                        shapes_commands[shape_name] = commands
-                        bbox = calculate_bbox(commands)
-                        if combined_bbox is None: combined_bbox = bbox
-                        else:
-                            combined_bbox = (min(combined_bbox[0], bbox[0]),
-                                             min(combined_bbox[1], bbox[1]),
-                                             max(combined_bbox[2], bbox[2]),
-                                             max(combined_bbox[3], bbox[3]))
-                else:
-                    if debug:
-                        logger.warning(f"形状 {shape_name} 数据结构异常: {shape_data}")
-        
-        # 处理标签 (在图像上渲染)
-        label_images = []
-        if 'label' in actual_data and isinstance(actual_data['label'], list):
-            for i, label_data in enumerate(actual_data['label']):
-                if isinstance(label_data, dict) and 'text' in label_data and 'position' in label_data:
-                    text = label_data['text']
-                    position = label_data['position']
-                    font_size = label_data.get('font_size', 24)  # 默认字体大小
-                    if debug:
-                        logger.info(f"处理标签{i}: 文本={text}, 位置={position}, 字体大小={font_size}")
-                    
-                    # 使用text_renderer渲染标签
-                    label_img = render_text_as_image(text, font_size, debug=debug)
-                    
-                    if label_img is None or label_img.size == 0:
-                        if debug:
-                            logger.warning(f"标签 '{text}' 渲染失败，跳过此标签")
-                        continue
-                    
-                    if debug:
-                        logger.info(f"标签图像 '{text}' 大小: {label_img.shape}, 最大值: {np.max(label_img)}")
-                    
-                    # 保存标签图像及其位置
-                    label_images.append((label_img, position[0], position[1]))
-                    
-                    # 更新边界框以包含标签
-                    h, w = label_img.shape[:2]
-                    label_bbox = (
-                        position[0] - w//2,
-                        position[1] - h//2,
-                        position[0] + w//2,
-                        position[1] + h//2
-                    )
-                    
-                    # 更新组合边界框
+            # ---------- 新增：兼容 {type:"circle", cx, cy, r} ----------
+            elif isinstance(shape_data, dict) and shape_data.get('type') == 'circle':
+                cx = shape_data['cx']
+                cy = shape_data['cy']
+                r  = shape_data['r']
+                # 转成"双弧"完整圆路径
+                path_str = (
+                    f"M {cx} {cy} m -{r} 0 "        # 起点在圆左端
+                    f"a {r} {r} 0 1 0 {2*r} 0 "     # 第一段弧
+                    f"a {r} {r} 0 1 0 {-2*r} 0"     # 第二段弧
+                )
+                commands = parse_svg_path(path_str)
+                if commands:
+                    shapes_commands[shape_name] = commands
+                    bbox = calculate_bbox(commands)
                     if combined_bbox is None:
-                        combined_bbox = label_bbox
+                        combined_bbox = bbox
                     else:
                         combined_bbox = (
-                            min(combined_bbox[0], label_bbox[0]),
-                            min(combined_bbox[1], label_bbox[1]),
-                            max(combined_bbox[2], label_bbox[2]),
-                            max(combined_bbox[3], label_bbox[3])
+                            min(combined_bbox[0], bbox[0]),
+                            min(combined_bbox[1], bbox[1]),
+                            max(combined_bbox[2], bbox[2]),
+                            max(combined_bbox[3], bbox[3])
                         )
-        
-        # 确保我们有有效的边界框
-        if combined_bbox is None:
-            logger.warning("没有找到有效的几何图形边界框")
-            # 创建默认边界框，覆盖整个画布区域
-            combined_bbox = (0, 0, img_size, img_size)
-        
-        if debug:
-            logger.info(f"所有几何形状的组合边界框: {combined_bbox}")
-        
-        # 计算统一的变换参数
-        scale, offset_x, offset_y = calculate_transform(
-            combined_bbox, (img_size, img_size), scale_factor, None
-        )
-        if debug:
-            logger.info(f"统一变换参数: scale={scale}, offset_x={offset_x}, offset_y={offset_y}")
-        
-        # 确保偏移量不会使图形完全移出画布
-        min_offset_x = -scale * (combined_bbox[2] - combined_bbox[0]) * 0.7
-        max_offset_x = scale * (img_size - (combined_bbox[2] - combined_bbox[0]) / 2)
-        offset_x = max(min_offset_x, min(offset_x, max_offset_x))
-
-        min_offset_y = -scale * (combined_bbox[3] - combined_bbox[1]) * 0.7
-        max_offset_y = scale * (img_size - (combined_bbox[3] - combined_bbox[1]) / 2)
-        offset_y = max(min_offset_y, min(offset_y, max_offset_y))
-        
-        # 第二遍：使用统一变换参数渲染所有形状
-        if debug:
-            logger.debug(f"开始渲染形状，共有 {len(shapes_commands)} 个形状命令")
-            logger.debug(f"形状命令键: {list(shapes_commands.keys())}")
-
-        for shape_name, commands in shapes_commands.items():
-            # 跳过样式信息键
-            if "_style" in shape_name:
-                continue
-            
-            if debug:
-                logger.debug(f"渲染形状: {shape_name}, 命令数: {len(commands)}")
-            
-            # 应用统一变换
-            transformed_commands = transform_commands(commands, scale, offset_x, offset_y)
-            
-            # 获取样式信息
-            style = {}
-            stroke_color = (255, 255, 255, 255)  # 默认白色
-            stroke_width = 2
-            
-            # 区分线段和其他形状
-            if shape_name.startswith("line_"):
-                style_key = f"{shape_name}_style"
-                if style_key in shapes_commands:
-                    style = shapes_commands[style_key]
-                    if debug:
-                        logger.debug(f"使用线段样式: {style}, 键名: {style_key}")
-                else:
-                    if debug:
-                        logger.warning(f"未找到线段样式: {style_key}")
+            # ---------- 椭圆 ellipse ----------
+            elif isinstance(shape_data, dict) and shape_data.get('type') == 'ellipse':
+                cx = shape_data['cx'];  cy  = shape_data['cy']
+                rx = shape_data['rx'];  ry  = shape_data['ry']
+                # 双弧完整椭圆：a rx ry …
+                path_str = (
+                    f"M {cx} {cy} m -{rx} 0 "
+                    f"a {rx} {ry} 0 1 0 {2*rx} 0 "
+                    f"a {rx} {ry} 0 1 0 {-2*rx} 0"
+                )
+                commands = parse_svg_path(path_str)
+                if commands:
+                    shapes_commands[shape_name] = commands
+                    bbox = calculate_bbox(commands)
+                    if combined_bbox is None: combined_bbox = bbox
+                    else:
+                        combined_bbox = (min(combined_bbox[0], bbox[0]),
+                                         min(combined_bbox[1], bbox[1]),
+                                         max(combined_bbox[2], bbox[2]),
+                                         max(combined_bbox[3], bbox[3]))
+            # ---------- 扇形/圆弧 sector | arc ----------
+            elif isinstance(shape_data, dict) and shape_data.get('type') in ('sector', 'arc'):
+                cx = shape_data['cx']; cy = shape_data['cy']; r = shape_data['r']
+                θ0 = shape_data['startAngle']   # 单位：度
+                θ1 = shape_data['endAngle']     # 逆时针为正，保持与常规数学方向一致
+                # 起止点
+                x0, y0 = polar_to_cart(cx, cy, r, θ0)
+                x1, y1 = polar_to_cart(cx, cy, r, θ1)
+                # 角差与 SVG 标志
+                dθ = (θ1 - θ0) % 360
+                large_arc_flag = 1 if dθ > 180 else 0
+                sweep_flag     = 1  # 逆时针
+                arc_cmd = f"A {r} {r} 0 {large_arc_flag} {sweep_flag} {x1} {y1}"
+                if shape_data['type'] == 'sector':
+                    # M->L 起点, 弧, L->中心, Z 闭合
+                    path_str = f"M {cx} {cy} L {x0} {y0} {arc_cmd} Z"
+                else:  # 纯圆弧
+                    path_str = f"M {x0} {y0} {arc_cmd}"
+                commands = parse_svg_path(path_str)
+                if commands:
+                    shapes_commands[shape_name] = commands
+                    bbox = calculate_bbox(commands)
+                    if combined_bbox is None: combined_bbox = bbox
+                    else:
+                        combined_bbox = (min(combined_bbox[0], bbox[0]),
+                                         min(combined_bbox[1], bbox[1]),
+                                         max(combined_bbox[2], bbox[2]),
+                                         max(combined_bbox[3], bbox[3]))
             else:
-                # 原有样式获取方式
-                original_shape_data = actual_data.get(shape_name)
-                if isinstance(original_shape_data, dict):
-                    style = original_shape_data.get('style', {})
-                    if debug:
-                        logger.debug(f"使用形状样式: {style}")
-                else:
+                if debug:
+                    logger.warning(f"形状 {shape_name} 数据结构异常: {shape_data}")
+
+    # 处理标签 (在图像上渲染)
+    label_images = []
+    if 'label' in actual_data and isinstance(actual_data['label'], list):
+        for i, label_data in enumerate(actual_data['label']):
+            if isinstance(label_data, dict) and 'text' in label_data and 'position' in label_data:
+                text = label_data['text']
+                position = label_data['position']
+                font_size = label_data.get('font_size', 24)  # 默认字体大小
+                if debug:
+                    logger.info(f"处理标签{i}: 文本={text}, 位置={position}, 字体大小={font_size}")
+
+                # 使用text_renderer渲染标签
+                label_img = render_text_as_image(text, font_size, debug=debug)
+
+                if label_img is None or label_img.size == 0:
                     if debug:
-                        logger.warning(f"形状 {shape_name} 没有有效的样式数据")
-            
-            # 设置绘制属性
-            stroke_width = int(style.get('stroke-width', 2))
-            if style.get('stroke') == 'yellow':
-                stroke_color = (255, 255, 0, 255)  # 黄色
-            else:
-                stroke_color = (255, 255, 255, 255)  # 白色
-            
-            # 渲染路径
-            last_pos = None
-            for cmd in transformed_commands:
-                if cmd['command'] == 'M':
-                    last_pos = (int(cmd['x']), int(cmd['y']))
-                elif cmd['command'] == 'L' and last_pos is not None:
-                    end_pos = (int(cmd['x']), int(cmd['y']))
-                    # 使用抗锯齿
-                    cv2.line(canvas, last_pos, end_pos, stroke_color, stroke_width, cv2.LINE_AA)
-                    last_pos = end_pos  # 更新起点位置
-                elif cmd['command'] == 'Z' and last_pos is not None and len(transformed_commands) > 0:
-                    # 闭合路径
-                    for start_cmd in transformed_commands:
-                        if start_cmd['command'] == 'M':
-                            start_pos = (int(start_cmd['x']), int(start_cmd['y']))
-                            cv2.line(canvas, last_pos, start_pos, stroke_color, stroke_width, cv2.LINE_AA)
-                            break
-        
-        # 渲染标签
-        for label_img, x, y in label_images:
-            # 转换坐标
-            tx = int(x * scale + offset_x)
-            ty = int(y * scale + offset_y)
-            
-            if debug:
-                logger.info(f"标签放置位置: 原始=({x}, {y}), 转换后=({tx}, {ty})")
-            
-            # 将标签图像放置在指定位置
-            h, w = label_img.shape[:2]
-            x_start = tx - w // 2
-            y_start = ty - h // 2
-            
-            # 确保坐标在有效范围内
-            x_start = max(0, min(x_start, img_size - w))
-            y_start = max(0, min(y_start, img_size - h))
-            
-            # 计算结束位置
-            x_end = min(x_start + w, img_size)
-            y_end = min(y_start + h, img_size)
-            
-            # 裁剪标签以适应画布
-            label_w = x_end - x_start
-            label_h = y_end - y_start
-            
-            if label_w > 0 and label_h > 0:
+                        logger.warning(f"标签 '{text}' 渲染失败，跳过此标签")
+                    continue
+
                 if debug:
-                    logger.info(f"混合标签图像到位置: ({x_start}, {y_start}), 大小: {label_w}x{label_h}")
-                
-                # 复制标签图像的一部分到画布上
-                if label_img.shape[2] == 4:  # RGBA
-                    # 提取alpha通道，确保值足够大以便于显示
-                    alpha = label_img[:label_h, :label_w, 3] / 255.0
-                    alpha = np.expand_dims(alpha, axis=2)
-                    
-                    # 混合RGB通道
-                    src_rgb = label_img[:label_h, :label_w, :3]
-                    dst_rgb = canvas[y_start:y_end, x_start:x_end, :3]
-                    
-                    # 确保文本是白色且清晰可见
-                    white_mask = np.any(src_rgb > 100, axis=2)
-                    for c in range(3):
-                        src_channel = src_rgb[:, :, c]
-                        src_channel[white_mask] = 255
-                    
-                    canvas[y_start:y_end, x_start:x_end, :3] = (
-                        dst_rgb * (1 - alpha) + src_rgb * alpha
-                    ).astype(np.uint8)
-                    
-                    # 更新Alpha通道
-                    canvas[y_start:y_end, x_start:x_end, 3] = np.maximum(
-                        canvas[y_start:y_end, x_start:x_end, 3],
-                        (label_img[:label_h, :label_w, 3]).astype(np.uint8)
+                    logger.info(f"标签图像 '{text}' 大小: {label_img.shape}, 最大值: {np.max(label_img)}")
+
+                # 保存标签图像及其位置
+                label_images.append((label_img, position[0], position[1]))
+
+                # 更新边界框以包含标签
+                h, w = label_img.shape[:2]
+                label_bbox = (
+                    position[0] - w//2,
+                    position[1] - h//2,
+                    position[0] + w//2,
+                    position[1] + h//2
+                )
+
+                # 更新组合边界框
+                if combined_bbox is None:
+                    combined_bbox = label_bbox
+                else:
+                    combined_bbox = (
+                        min(combined_bbox[0], label_bbox[0]),
+                        min(combined_bbox[1], label_bbox[1]),
+                        max(combined_bbox[2], label_bbox[2]),
+                        max(combined_bbox[3], label_bbox[3])
                     )
-                else:  # RGB
-                    # 简单叠加
-                    canvas[y_start:y_end, x_start:x_end, :3] = label_img[:label_h, :label_w]
-                    canvas[y_start:y_end, x_start:x_end, 3] = 255  # 设置完全不透明
-        
-        # 转换为RGB格式并裁剪
-        if canvas.shape[2] == 4:  # RGBA
-            # 创建一个与黑板背景颜色匹配的画布
-            rgb_canvas = np.ones((img_size, img_size, 3), dtype=np.uint8) * np.array([30, 30, 30], dtype=np.uint8)
-            
-            # 提取透明通道作为蒙版
-            alpha = (canvas[:, :, 3] / 255.0).reshape(img_size, img_size, 1)
-            
-            # 应用alpha混合（一次性处理所有通道）
-            rgb_canvas = (rgb_canvas * (1 - alpha) + canvas[:, :, :3] * alpha).astype(np.uint8)
-            
-            # 裁剪图像
-            return trim_image(rgb_canvas)
+
+    # 确保我们有有效的边界框
+    if combined_bbox is None:
+        logger.warning("没有找到有效的几何图形边界框")
+        # 创建默认边界框，覆盖整个画布区域
+        combined_bbox = (0, 0, img_size, img_size)
+
+    if debug:
+        logger.info(f"所有几何形状的组合边界框: {combined_bbox}")
+
+    # 计算统一的变换参数
+    scale, offset_x, offset_y = calculate_transform(
+        combined_bbox, (img_size, img_size), scale_factor, None
+    )
+    if debug:
+        logger.info(f"统一变换参数: scale={scale}, offset_x={offset_x}, offset_y={offset_y}")
+
+    # 确保偏移量不会使图形完全移出画布
+    min_offset_x = -scale * (combined_bbox[2] - combined_bbox[0]) * 0.7
+    max_offset_x = scale * (img_size - (combined_bbox[2] - combined_bbox[0]) / 2)
+    offset_x = max(min_offset_x, min(offset_x, max_offset_x))
+
+    min_offset_y = -scale * (combined_bbox[3] - combined_bbox[1]) * 0.7
+    max_offset_y = scale * (img_size - (combined_bbox[3] - combined_bbox[1]) / 2)
+    offset_y = max(min_offset_y, min(offset_y, max_offset_y))
+
+    return {
+        'shapes_commands': shapes_commands,
+        'actual_data': actual_data,
+        'label_images': label_images,
+        'scale': scale,
+        'offset_x': offset_x,
+        'offset_y': offset_y,
+    }
+
+def _shape_stroke_style(shape_name: str, shapes_commands: Dict[str, Any], actual_data: Dict[str, Any],
+                        debug: bool = False) -> Tuple[Tuple[int, int, int, int], int]:
+    """获取形状的描边颜色和线宽"""
+    style = {}
+    stroke_color = (255, 255, 255, 255)  # 默认白色
+    stroke_width = 2
+
+    # 区分线段和其他形状
+    if shape_name.startswith("line_"):
+        style_key = f"{shape_name}_style"
+        if style_key in shapes_commands:
+            style = shapes_commands[style_key]
+            if debug:
+                logger.debug(f"使用线段样式: {style}, 键名: {style_key}")
         else:
-            return canvas
-        
+            if debug:
+                logger.warning(f"未找到线段样式: {style_key}")
+    else:
+        # 原有样式获取方式
+        original_shape_data = actual_data.get(shape_name)
+        if isinstance(original_shape_data, dict):
+            style = original_shape_data.get('style', {})
+            if debug:
+                logger.debug(f"使用形状样式: {style}")
+        else:
+            if debug:
+                logger.warning(f"形状 {shape_name} 没有有效的样式数据")
+
+    # 设置绘制属性
+    stroke_width = int(style.get('stroke-width', 2))
+    if style.get('stroke') == 'yellow':
+        stroke_color = (255, 255, 0, 255)  # 黄色
+    else:
+        stroke_color = (255, 255, 255, 255)  # 白色
+    return stroke_color, stroke_width
+
+def _geometry_segments(layout: Dict[str, Any], debug: bool = False) -> List[Tuple[Tuple[int, int], Tuple[int, int], Tuple[int, int, int, int], int]]:
+    """
+    把所有形状按绘制顺序展开为画布坐标下的线段
+
+    Returns:
+        (起点, 终点, 颜色, 线宽) 的列表，依次用 cv2.line 绘制即得到完整图形
+    """
+    shapes_commands = layout['shapes_commands']
+    if debug:
+        logger.debug(f"开始渲染形状，共有 {len(shapes_commands)} 个形状命令")
+        logger.debug(f"形状命令键: {list(shapes_commands.keys())}")
+
+    segments = []
+    for shape_name, commands in shapes_commands.items():
+        # 跳过样式信息键
+        if "_style" in shape_name:
+            continue
+
+        if debug:
+            logger.debug(f"渲染形状: {shape_name}, 命令数: {len(commands)}")
+
+        # 应用统一变换
+        transformed_commands = transform_commands(commands, layout['scale'], layout['offset_x'], layout['offset_y'])
+        stroke_color, stroke_width = _shape_stroke_style(shape_name, shapes_commands, layout['actual_data'], debug)
+
+        last_pos = None
+        for cmd in transformed_commands:
+            if cmd['command'] == 'M':
+                last_pos = (int(cmd['x']), int(cmd['y']))
+            elif cmd['command'] == 'L' and last_pos is not None:
+                end_pos = (int(cmd['x']), int(cmd['y']))
+                segments.append((last_pos, end_pos, stroke_color, stroke_width))
+                last_pos = end_pos  # 更新起点位置
+            elif cmd['command'] == 'Z' and last_pos is not None and len(transformed_commands) > 0:
+                # 闭合路径
+                for start_cmd in transformed_commands:
+                    if start_cmd['command'] == 'M':
+                        start_pos = (int(start_cmd['x']), int(start_cmd['y']))
+                        segments.append((last_pos, start_pos, stroke_color, stroke_width))
+                        break
+    return segments
+
+def _draw_segment(canvas: np.ndarray, segment) -> None:
+    start_pos, end_pos, stroke_color, stroke_width = segment
+    # 使用抗锯齿
+    cv2.line(canvas, start_pos, end_pos, stroke_color, stroke_width, cv2.LINE_AA)
+
+def _segment_rect(start_pos: Tuple[int, int], end_pos: Tuple[int, int], stroke_width: int,
+                  canvas_shape: Tuple[int, ...]) -> Tuple[int, int, int, int]:
+    """线段（含线宽和抗锯齿边缘）在画布上覆盖的矩形 (x_start, y_start, x_end, y_end)"""
+    pad = stroke_width // 2 + 2
+    height, width = canvas_shape[:2]
+    return (max(min(start_pos[0], end_pos[0]) - pad, 0), max(min(start_pos[1], end_pos[1]) - pad, 0),
+            min(max(start_pos[0], end_pos[0]) + pad + 1, width), min(max(start_pos[1], end_pos[1]) + pad + 1, height))
+
+def _blend_geometry_labels(canvas: np.ndarray, layout: Dict[str, Any], debug: bool = False,
+                           canvas_scale: Tuple[float, float] = (1.0, 1.0)) -> List[Tuple[int, int, int, int]]:
+    """
+    把标签图像混合到画布上
+
+    Args:
+        canvas: 预乘 BGRA 画布
+        layout: _layout_geometry 的返回值
+        debug: 是否输出调试信息
+        canvas_scale: 画布相对 GEOMETRY_CANVAS_SIZE 的 (x, y) 缩放，标签图像按相同比例缩放
+
+    Returns:
+        各标签在画布上覆盖的矩形
+    """
+    scale, offset_x, offset_y = layout['scale'], layout['offset_x'], layout['offset_y']
+    canvas_h, canvas_w = canvas.shape[:2]
+    scale_x, scale_y = canvas_scale
+    rects = []
+    for label_img, x, y in layout['label_images']:
+        # 转换坐标
+        tx = int((x * scale + offset_x) * scale_x)
+        ty = int((y * scale + offset_y) * scale_y)
+
+        if debug:
+            logger.info(f"标签放置位置: 原始=({x}, {y}), 转换后=({tx}, {ty})")
+
+        if (scale_x, scale_y) != (1.0, 1.0):
+            h, w = label_img.shape[:2]
+            label_img = cv2.resize(label_img, (max(1, int(round(w * scale_x))), max(1, int(round(h * scale_y)))),
+                                   interpolation=cv2.INTER_AREA)
+
+        # 将标签图像放置在指定位置
+        h, w = label_img.shape[:2]
+        x_start = tx - w // 2
+        y_start = ty - h // 2
+
+        # 确保坐标在有效范围内
+        x_start = max(0, min(x_start, canvas_w - w))
+        y_start = max(0, min(y_start, canvas_h - h))
+
+        # 计算结束位置
+        x_end = min(x_start + w, canvas_w)
+        y_end = min(y_start + h, canvas_h)
+
+        # 裁剪标签以适应画布
+        label_w = x_end - x_start
+        label_h = y_end - y_start
+
+        if label_w > 0 and label_h > 0:
+            if debug:
+                logger.info(f"混合标签图像到位置: ({x_start}, {y_start}), 大小: {label_w}x{label_h}")
+
+            # 复制标签图像的一部分到画布上
+            if label_img.shape[2] == 4:  # 预乘 BGRA
+                # 预乘 alpha 的 over 合成，四个通道（含 alpha）使用同一公式
+                src = label_img[:label_h, :label_w]
+                dst = canvas[y_start:y_end, x_start:x_end]
+                inverse = 255 - src[:, :, 3:4].astype(np.uint16)
+                dst[:] = np.minimum((dst * inverse + 127) // 255 + src, 255)
+            else:  # RGB
+                # 简单叠加
+                canvas[y_start:y_end, x_start:x_end, :3] = label_img[:label_h, :label_w]
+                canvas[y_start:y_end, x_start:x_end, 3] = 255  # 设置完全不透明
+            rects.append((x_start, y_start, x_end, y_end))
+    return rects
+
+class GeometryPathAnimator:
+    """
+    draw_path 入场动画的增量渲染器。
+    构造时只解析一次 SVG 路径，并展开为带累计长度的线段序列；之后随进度推进，
+    只把新画出的线段绘制到持久画布上，输出图像（预乘 BGRA）只在这些线段覆盖的区域发生变化，
+    每帧开销与新画出的路径长度成正比。
+
+    完整的线段绘制在"已提交"画布上，当前正在绘制的线段只画在输出画布上，下一帧先从已提交画布恢复，
+    因此任意进度下的输出都与从空白画布一次性重绘（render_full）逐像素相同。标签在路径画完后出现。
+    """
+
+    def __init__(self, geometry_data: Dict[str, Any], scale_factor: float = 1.0,
+                 target_size: Tuple[int, int] = None, debug: bool = False):
+        """
+        Args:
+            geometry_data: 几何图形数据
+            scale_factor: 缩放因子，与 render_geometry 相同
+            target_size: 输出图像尺寸 (h, w)。与 render_geometry 裁剪后的尺寸不同时（例如步骤内容被整体缩小），
+                按比例缩放线段坐标、线宽和标签后重新绘制，而不是逐帧缩放图像
+            debug: 是否输出调试信息
+        """
+        self.layout = _layout_geometry(geometry_data, scale_factor, debug)
+        native_segments = _geometry_segments(self.layout, debug)
+
+        # 先按原尺寸完整绘制一次，得到与 render_geometry 相同的裁剪区域
+        canvas = np.zeros((GEOMETRY_CANVAS_SIZE, GEOMETRY_CANVAS_SIZE, 4), dtype=np.uint8)
+        for segment in native_segments:
+            _draw_segment(canvas, segment)
+        _blend_geometry_labels(canvas, self.layout)
+        bbox = alpha_bbox(canvas)
+        if bbox is None:
+            bbox = (0, 0, GEOMETRY_CANVAS_SIZE, GEOMETRY_CANVAS_SIZE)
+        x_start, y_start, x_end, y_end = bbox
+        native_h, native_w = y_end - y_start, x_end - x_start
+        target_h, target_w = target_size if target_size is not None else (native_h, native_w)
+
+        self._canvas_scale = (target_w / native_w, target_h / native_h)
+        scale_x, scale_y = self._canvas_scale
+        stroke_scale = min(scale_x, scale_y)
+        self._segments = [
+            ((int(round(p0[0] * scale_x)), int(round(p0[1] * scale_y))),
+             (int(round(p1[0] * scale_x)), int(round(p1[1] * scale_y))),
+             color, max(1, int(round(width * stroke_scale))))
+            for p0, p1, color, width in native_segments
+        ]
+        # 每条线段结束时的累计路径长度
+        lengths = np.array([math.hypot(p1[0] - p0[0], p1[1] - p0[1]) for p0, p1, _, _ in self._segments],
+                           dtype=np.float64)
+        self._cumulative = np.cumsum(lengths).tolist()
+        self.total_length = self._cumulative[-1] if self._cumulative else 0.0
+
+        crop_x, crop_y = int(round(x_start * scale_x)), int(round(y_start * scale_y))
+        self._crop = (crop_x, crop_y, crop_x + target_w, crop_y + target_h)
+        self._canvas_shape = (max(int(math.ceil(GEOMETRY_CANVAS_SIZE * scale_y)), self._crop[3]),
+                              max(int(math.ceil(GEOMETRY_CANVAS_SIZE * scale_x)), self._crop[2]), 4)
+
+        # 已提交的完整线段（及标签）和输出画布（已提交 + 当前线段的部分）。
+        # 画布本身就是预乘 BGRA（抗锯齿线段以 alpha=255 的颜色绘制在透明画布上即为预乘 over 合成），
+        # 输出图像直接是输出画布裁剪区域的视图
+        self._committed = np.zeros(self._canvas_shape, dtype=np.uint8)
+        self._canvas = np.zeros(self._canvas_shape, dtype=np.uint8)
+        self.image = self._canvas[self._crop[1]:self._crop[3], self._crop[0]:self._crop[2]]
+        self.reset()
+
+        self.advance(1.0)
+        self.final_image = self.image.copy()
+        self.reset()
+
+    def reset(self) -> None:
+        """回到进度 0（空白画布）"""
+        self._committed[:] = 0
+        self._canvas[:] = 0
+        self._committed_count = 0
+        self._labels_drawn = False
+        self._partial_rect = None
+        self.progress = 0.0
+
+    def _partial_segment(self, target_length: float):
+        """进度落在某条线段中间时，返回该线段已画出的部分 (起点, 终点, 颜色, 线宽)，否则返回 None"""
+        index = bisect.bisect_right(self._cumulative, target_length)
+        if index >= len(self._segments):
+            return None
+        segment_start = self._cumulative[index - 1] if index > 0 else 0.0
+        if target_length <= segment_start:
+            return None
+        (x0, y0), (x1, y1), color, width = self._segments[index]
+        t = (target_length - segment_start) / (self._cumulative[index] - segment_start)
+        return (x0, y0), (int(round(x0 + (x1 - x0) * t)), int(round(y0 + (y1 - y0) * t))), color, width
+
+    def advance(self, progress: float) -> List[Tuple[int, int, int, int]]:
+        """
+        把动画推进到指定进度，原地更新 self.image
+
+        Args:
+            progress: 路径绘制进度 (0-1)；小于当前进度时从空白画布重新开始
+
+        Returns:
+            self.image 中发生变化的矩形 (x_start, y_start, x_end, y_end) 列表
+        """
+        progress = min(max(progress, 0.0), 1.0)
+        crop_x, crop_y, crop_x_end, crop_y_end = self._crop
+        if progress == self.progress and progress > 0.0:
+            return []
+        dirty = []
+        if progress < self.progress:
+            self.reset()
+            dirty.append((crop_x, crop_y, crop_x_end, crop_y_end))
+        self.progress = progress
+        target_length = progress * self.total_length
+
+        # 撤销上一帧画在输出画布上的部分线段
+        if self._partial_rect is not None:
+            dirty.append(self._partial_rect)
+            self._partial_rect = None
+
+        # 提交进度已完整越过的线段
+        committed_count = bisect.bisect_right(self._cumulative, target_length)
+        for segment in self._segments[self._committed_count:committed_count]:
+            _draw_segment(self._committed, segment)
+            dirty.append(_segment_rect(segment[0], segment[1], segment[3], self._canvas_shape))
+        self._committed_count = committed_count
+
+        if progress >= 1.0 and not self._labels_drawn:
+            dirty.extend(_blend_geometry_labels(self._committed, self.layout, canvas_scale=self._canvas_scale))
+            self._labels_drawn = True
+
+        for x_start, y_start, x_end, y_end in dirty:
+            self._canvas[y_start:y_end, x_start:x_end] = self._committed[y_start:y_end, x_start:x_end]
+
+        partial = self._partial_segment(target_length)
+        if partial is not None:
+            _draw_segment(self._canvas, partial)
+            self._partial_rect = _segment_rect(partial[0], partial[1], partial[3], self._canvas_shape)
+            dirty.append(self._partial_rect)
+
+        # 输出图像是画布的视图，只需把变化区域换算到图像坐标
+        changed = []
+        for x_start, y_start, x_end, y_end in dirty:
+            x_start, y_start = max(x_start, crop_x), max(y_start, crop_y)
+            x_end, y_end = min(x_end, crop_x_end), min(y_end, crop_y_end)
+            if x_start >= x_end or y_start >= y_end:
+                continue
+            changed.append((x_start - crop_x, y_start - crop_y, x_end - crop_x, y_end - crop_y))
+        return changed
+
+    def render_full(self, progress: float) -> np.ndarray:
+        """
+        不使用增量状态，在空白画布上重绘指定进度的完整图像（用于对比和基准测试）
+
+        Returns:
+            与 self.image 尺寸相同的新图像
+        """
+        progress = min(max(progress, 0.0), 1.0)
+        target_length = progress * self.total_length
+        canvas = np.zeros(self._canvas_shape, dtype=np.uint8)
+        for segment in self._segments[:bisect.bisect_right(self._cumulative, target_length)]:
+            _draw_segment(canvas, segment)
+        partial = self._partial_segment(target_length)
+        if partial is not None:
+            _draw_segment(canvas, partial)
+        if progress >= 1.0:
+            _blend_geometry_labels(canvas, self.layout, canvas_scale=self._canvas_scale)
+        crop_x, crop_y, crop_x_end, crop_y_end = self._crop
+        return canvas[crop_y:crop_y_end, crop_x:crop_x_end].copy()
+
+def render_geometry(geometry_data: Dict[str, Any], progress: float = 1.0, scale_factor: float = 1.0, debug: bool = False) -> np.ndarray:
+    """
+    渲染几何图形
+
+    Args:
+        geometry_data: 几何图形数据
+        progress: 路径绘制进度 (0-1)。小于 1 时只画出按路径长度计算的前一部分，
+            图像尺寸与完整图形相同；逐帧动画请使用 GeometryPathAnimator
+        scale_factor: 缩放因子
+        debug: 是否输出调试信息
+
+    Returns:
+        紧致裁剪的预乘 BGRA 图像
+    """
+    img_size = GEOMETRY_CANVAS_SIZE
+    try:
+        if debug:
+            logger.debug(f"开始渲染几何图形，数据类型: {type(geometry_data)}")
+
+        if progress < 1.0:
+            return GeometryPathAnimator(geometry_data, scale_factor, debug=debug).render_full(progress)
+
+        layout = _layout_geometry(geometry_data, scale_factor, debug)
+
+        # 创建透明画布
+        canvas = np.zeros((img_size, img_size, 4), dtype=np.uint8)
+        for segment in _geometry_segments(layout, debug):
+            _draw_segment(canvas, segment)
+        _blend_geometry_labels(canvas, layout, debug)
+
+        # 画布即预乘 BGRA 精灵，紧致裁剪掉透明边缘
+        return trim_image(canvas, margin=0)
+
     except Exception as e:
         error_msg = f"渲染几何图形时出错: {str(e)}"
         logger.error(error_msg)
         logger.error(traceback.format_exc())
-        
+
         # 打印到控制台方便查看
         import sys
         print(error_msg, file=sys.stderr)
         print(traceback.format_exc(), file=sys.stderr)
-        
+
         # 返回错误图像
-        canvas = np.zeros((img_size, img_size, 4), dtype=np.uint8)
-        cv2.putText(canvas, "Geometry Error", (50, img_size//2), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 255, 255, 255), 2)
-        return canvas 
\ No newline at end of file
+        return text_placeholder("Geometry Error", (img_size, img_size), (50, img_size//2),
+                                font_scale=1.0, thickness=2)
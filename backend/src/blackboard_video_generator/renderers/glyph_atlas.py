@@ -0,0 +1,207 @@
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+import threading
+import numpy as np
+import logging
+from PIL import Image, ImageDraw, ImageFont
+from matplotlib.ft2font import FT2Font, KERNING_DEFAULT
+from ..atlas import SpriteAtlas
+
+logger = logging.getLogger(__name__)
+
+# 字形图集页的边长（像素）。200 DPI、32 号字的字形约 90 像素见方，一页可以容纳上百个字形
+GLYPH_PAGE_SIZE = 1024
+# 同时保留的（字体文件, 像素字号）图集数
+GLYPH_ATLAS_CACHE_SIZE = 32
+# 行距倍数，与 matplotlib Text 的默认 linespacing 一致
+LINESPACING = 1.2
+
+@lru_cache(maxsize=None)
+def _charmap(font_path: str) -> frozenset:
+    """字体文件（.ttc 取第一个字体）包含字形的码位集合"""
+    return frozenset(FT2Font(font_path).get_charmap())
+
+class _Glyph:
+    """单个字形：图集中的覆盖率视图、相对于笔位置和基线的偏移、水平步进"""
+
+    __slots__ = ('bitmap', 'left', 'top', 'advance')
+
+    def __init__(self, bitmap: Optional[np.ndarray], left: int, top: int, advance: float):
+        self.bitmap = bitmap
+        self.left = left
+        self.top = top
+        self.advance = advance
+
+class GlyphAtlas:
+    """
+    单个字体文件在单个像素字号下的字形图集。
+    字形首次出现时用 FreeType（Pillow ImageFont）光栅化一次，覆盖率打包进单通道的 SpriteAtlas，
+    之后排版同一字体、同一字号的文本只需查表和拷贝字形。
+    不做复杂排版，与 matplotlib 一样按字体的 kern 表逐对调整字距。
+    字距取自 matplotlib 的 FT2Font：Pillow BASIC 引擎把 kern 表的值按 1/64 像素累加，字距几乎不起作用
+    """
+
+    def __init__(self, font_path: str, pixel_size: float):
+        """
+        Args:
+            font_path: 字体文件路径
+            pixel_size: 字号（每 em 的像素数）
+        """
+        self.font_path = font_path
+        self.pixel_size = pixel_size
+        self.font = ImageFont.truetype(font_path, pixel_size, layout_engine=ImageFont.Layout.BASIC)
+        # 72 DPI 下的点数即像素数
+        self._ft_font = FT2Font(font_path)
+        self._ft_font.set_size(pixel_size, 72)
+        self._atlas = SpriteAtlas(page_size=GLYPH_PAGE_SIZE, channels=1)
+        self._glyphs = {}
+        self._kerning = {}
+        self._lock = threading.Lock()
+        # 多行文本行距的下限参照：与 matplotlib 一样取 "lp" 的基线以上高度与基线以下深度
+        _, lp_top, _, lp_bottom = self.font.getbbox('lp', anchor='ls')
+        self.lp_ascent = -lp_top
+        self.lp_descent = lp_bottom
+
+    def has_char(self, char: str) -> bool:
+        return ord(char) in _charmap(self.font_path)
+
+    def glyph(self, char: str) -> _Glyph:
+        """取字形，首次出现时光栅化并放入图集"""
+        glyph = self._glyphs.get(char)
+        if glyph is not None:
+            return glyph
+        with self._lock:
+            glyph = self._glyphs.get(char)
+            if glyph is None:
+                left, top, right, bottom = self.font.getbbox(char, anchor='ls')
+                bitmap = None
+                if right > left and bottom > top:
+                    image = Image.new('L', (right - left, bottom - top))
+                    ImageDraw.Draw(image).text((-left, -top), char, fill=255, font=self.font, anchor='ls')
+                    # getbbox 包含字形两侧的空白，裁剪到墨迹范围，测量与合成后的紧致裁剪一致
+                    ink = image.getbbox()
+                    if ink is not None:
+                        bitmap = self._atlas.add(np.asarray(image.crop(ink)))
+                        left, top = left + ink[0], top + ink[1]
+                glyph = _Glyph(bitmap, left, top, self.font.getlength(char))
+                self._glyphs[char] = glyph
+        return glyph
+
+    def kerning(self, left: str, right: str) -> float:
+        """一对相邻字符的字距调整（像素）"""
+        pair = left + right
+        kerning = self._kerning.get(pair)
+        if kerning is None:
+            with self._lock:
+                kerning = self._ft_font.get_kerning(self._ft_font.get_char_index(ord(left)),
+                                                    self._ft_font.get_char_index(ord(right)),
+                                                    KERNING_DEFAULT) / 64
+            self._kerning[pair] = kerning
+        return kerning
+
+    def stats(self) -> dict:
+        """字形数与图集的内存统计（见 SpriteAtlas.stats）"""
+        return dict(self._atlas.stats(), glyphs=len(self._glyphs))
+
+@lru_cache(maxsize=GLYPH_ATLAS_CACHE_SIZE)
+def get_glyph_atlas(font_path: str, pixel_size: float) -> GlyphAtlas:
+    """获取（字体文件, 像素字号）对应的字形图集，按最近使用保留 GLYPH_ATLAS_CACHE_SIZE 个"""
+    return GlyphAtlas(font_path, pixel_size)
+
+class FontChain:
+    """
+    按优先级排列的字体回退链：每个字符使用链中第一个包含该字符的字体，
+    所有字体都不包含时使用首选字体（显示其缺字符号，与 matplotlib 相同）
+    """
+
+    def __init__(self, font_paths: Sequence[str], pixel_size: float):
+        self.atlases = [get_glyph_atlas(path, pixel_size) for path in font_paths]
+        self._choice = {}
+
+    def atlas_for(self, char: str) -> GlyphAtlas:
+        atlas = self._choice.get(char)
+        if atlas is None:
+            atlas = next((atlas for atlas in self.atlases if atlas.has_char(char)), self.atlases[0])
+            self._choice[char] = atlas
+        return atlas
+
+@lru_cache(maxsize=GLYPH_ATLAS_CACHE_SIZE)
+def get_font_chain(font_paths: Tuple[str, ...], pixel_size: float) -> FontChain:
+    # 字号对齐到 FreeType 的 1/64 像素，浮点误差不会产生重复的图集
+    return FontChain(font_paths, round(pixel_size * 64) / 64)
+
+def layout_text(text: str, font_paths: Tuple[str, ...], pixel_size: float) -> List[Tuple[np.ndarray, int, int]]:
+    """
+    排版文本：逐字选择回退链中的字体并累加步进与字距。
+    多行文本逐行居中（与 ax.text 的 ha='center' 一致），行距按 matplotlib 的规则：
+    上一行的基线以下深度加本行基线以上高度的 LINESPACING 倍
+
+    Args:
+        text: 文本内容（可包含换行）
+        font_paths: 字体回退链，首个为首选字体
+        pixel_size: 字号（每 em 的像素数）
+
+    Returns:
+        [(字形覆盖率, x, y)]，坐标为字形左上角相对于首行基线起点的整数像素位置；空白字符不产生条目
+    """
+    chain = get_font_chain(font_paths, pixel_size)
+    lines = []
+    baseline = 0.0
+    descent = 0
+    for i, line in enumerate(text.split('\n')):
+        placements = []
+        pen = 0.0
+        ascent = chain.atlases[0].lp_ascent
+        line_descent = chain.atlases[0].lp_descent
+        previous = None
+        for char in line:
+            if char < ' ':
+                continue
+            atlas = chain.atlas_for(char)
+            if previous is not None and previous[0] is atlas:
+                pen += atlas.kerning(previous[1], char)
+            glyph = atlas.glyph(char)
+            if glyph.bitmap is not None:
+                placements.append((glyph.bitmap, int(round(pen)) + glyph.left, glyph.top))
+                ascent = max(ascent, -glyph.top)
+                line_descent = max(line_descent, glyph.top + glyph.bitmap.shape[0])
+            pen += glyph.advance
+            previous = (atlas, char)
+        if i > 0:
+            baseline += descent + LINESPACING * ascent
+        descent = line_descent
+        lines.append((placements, pen, int(round(baseline))))
+    max_width = max(width for _, width, _ in lines)
+    result = []
+    for placements, width, line_baseline in lines:
+        offset = int(round((max_width - width) / 2))
+        result.extend((bitmap, x + offset, y + line_baseline) for bitmap, x, y in placements)
+    return result
+
+def layout_bbox(placements: List[Tuple[np.ndarray, int, int]]) -> Optional[Tuple[int, int, int, int]]:
+    """排版结果的墨迹范围 (x0, y0, x1, y1)；没有可见字形时返回 None"""
+    if not placements:
+        return None
+    x0 = min(x for _, x, _ in placements)
+    y0 = min(y for _, _, y in placements)
+    x1 = max(x + bitmap.shape[1] for bitmap, x, _ in placements)
+    y1 = max(y + bitmap.shape[0] for bitmap, _, y in placements)
+    return x0, y0, x1, y1
+
+def rasterize_text(text: str, font_paths: Tuple[str, ...], pixel_size: float) -> Optional[np.ndarray]:
+    """
+    把文本排版并拷贝字形到一张覆盖率图上（重叠处取最大值）
+
+    Returns:
+        墨迹范围大小的 uint8 (h, w) 覆盖率；没有可见字形时返回 None
+    """
+    placements = layout_text(text, font_paths, pixel_size)
+    bbox = layout_bbox(placements)
+    if bbox is None:
+        return None
+    x0, y0, x1, y1 = bbox
+    coverage = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    for bitmap, x, y in placements:
+        region = coverage[y - y0:y - y0 + bitmap.shape[0], x - x0:x - x0 + bitmap.shape[1]]
+        np.maximum(region, bitmap, out=region)
+    return coverage
@@ -0,0 +1,447 @@
+"""
+常驻的 LaTeX 渲染服务。
+
+服务创建时把导言区预编译为 .fmt 格式文件，之后的公式加载该格式，不再读取 ctex 等宏包。
+单个公式仍然要启动一个 latex 进程和一个 dvipng 进程：它们直接在调用线程中以子进程运行
+（等待子进程时释放 GIL，多个线程可以并发排版），没有额外的工作进程与进程间通信。
+启动开销主要由 compile_batch 摊薄：一道题的所有片段只运行一次 latex，之后每个片段只需一次 dvipng。
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+import atexit
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import numpy as np
+import cv2
+import logging
+
+from ..utils.image_utils import trim_image, coverage_sprite
+
+logger = logging.getLogger(__name__)
+
+# 并发排版数（工作槽位数）的环境变量；设为 0 时禁用服务，公式回退为 matplotlib usetex 渲染
+LATEX_WORKERS_ENV = 'BLACKBOARD_LATEX_WORKERS'
+DEFAULT_LATEX_WORKERS = min(4, os.cpu_count() or 1)
+# 单次 latex / dvipng 调用的超时（秒）
+LATEX_TIMEOUT = 60
+# 服务端结果缓存的条目数（同一公式在一道题中重复出现时直接复用）
+RESULT_CACHE_SIZE = 256
+# 等待空闲工作槽位时重新检查服务是否已关闭的间隔（秒）
+_POLL_INTERVAL = 1.0
+# 预编译格式的名称（各工作目录中的 blackboard.fmt）
+FORMAT_NAME = 'blackboard'
+
+# 批量排版时每个片段页之前写入日志的标记，用于把排版错误归属到具体片段
+_FRAGMENT_MARKER = 'BLACKBOARD-FRAGMENT-'
+
+# 格式文件与每个公式文档共用的导言区；与 matplotlib usetex 一样使用 type1cm 以支持任意字号
+_PREAMBLE_TEMPLATE = '\\documentclass{article}\n\\usepackage{type1cm}\n%s\n\\pagestyle{empty}\n'
+
+class LatexServiceError(RuntimeError):
+    """LaTeX 服务无法渲染公式（排版失败、工具缺失、超时或服务已关闭），调用方应回退到 matplotlib 渲染"""
+
+def _run(command: List[str], work_dir: str) -> subprocess.CompletedProcess:
+    return subprocess.run(command, cwd=work_dir, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT, timeout=LATEX_TIMEOUT)
+
+def _build_format(work_dir: str, preamble: str) -> Optional[str]:
+    """
+    把导言区（ctex 等宏包）预编译为格式文件，之后每个公式只需加载格式，不再重新读取宏包
+
+    Returns:
+        格式名称；当前 TeX 发行版无法转储该导言区时返回 None（每个公式完整加载导言区）
+    """
+    with open(os.path.join(work_dir, f'{FORMAT_NAME}.tex'), 'w', encoding='utf-8') as f:
+        f.write(_PREAMBLE_TEMPLATE % preamble + '\\dump\n')
+    result = _run(['latex', '-ini', '-interaction=nonstopmode', '-halt-on-error',
+                   f'-jobname={FORMAT_NAME}', '&latex', f'{FORMAT_NAME}.tex'], work_dir)
+    if result.returncode == 0 and os.path.exists(os.path.join(work_dir, f'{FORMAT_NAME}.fmt')):
+        return FORMAT_NAME
+    logger.warning("LaTeX 导言区无法预编译为格式文件，每个公式将完整加载导言区")
+    return None
+
+def _fragment_page(source: str, font_size: float) -> str:
+    """
+    一个公式片段的页面内容。与 matplotlib usetex 一致：按字号设置 1.25 倍行距，使用无衬线字体族，
+    空的 \\hbox 保证即使内容为空也输出一页
+    """
+    return (f'{{\\fontsize{{{font_size}}}{{{font_size * 1.25}}}\\selectfont\\sffamily\\hbox{{}}{source}}}\n'
+            '\\clearpage\n')
+
+def _run_latex(work_dir: str, fmt: Optional[str], preamble: str, pages: List[str], output_dir: str,
+               jobname: str, halt_on_error: bool = True) -> subprocess.CompletedProcess:
+    """把若干页面内容写成一个文档并运行一次 latex，输出 output_dir/jobname.dvi"""
+    header = '' if fmt else _PREAMBLE_TEMPLATE % preamble
+    tex_path = os.path.join(output_dir, f'{jobname}.tex')
+    with open(tex_path, 'w', encoding='utf-8') as f:
+        f.write(header + '\\begin{document}\n' + ''.join(pages) + '\\end{document}\n')
+    command = ['latex', '-interaction=nonstopmode', f'-output-directory={output_dir}']
+    if halt_on_error:
+        command.append('-halt-on-error')
+    if fmt:
+        # 格式文件位于工作槽位自己的工作目录中
+        command.append(f'-fmt={fmt}')
+    return _run(command + [tex_path], work_dir)
+
+def _rasterize(work_dir: str, dvi_path: str, dpi: int, page: Optional[int] = None) -> np.ndarray:
+    """
+    用 dvipng 光栅化 DVI 的一页（page 从 1 开始，None 表示唯一的一页）
+
+    Returns:
+        紧致裁剪的白色预乘 BGRA 精灵
+    """
+    png_path = os.path.join(work_dir, 'formula.png')
+    command = ['dvipng', '-q', '-D', str(dpi), '-T', 'tight', '-bg', 'rgb 0 0 0', '-fg', 'rgb 1 1 1', '-z', '0']
+    if page is not None:
+        command += ['-pp', str(page)]
+    # 黑底白字光栅化，灰度即为墨迹覆盖率（与 matplotlib 读取 dvipng 输出的方式相同），不会带出背景色的半透明边缘
+    result = _run(command + ['-o', png_path, dvi_path], work_dir)
+    coverage = cv2.imread(png_path, cv2.IMREAD_GRAYSCALE)
+    if result.returncode != 0 or coverage is None:
+        raise LatexServiceError(f"dvipng 光栅化失败: {result.stdout.decode('utf-8', 'replace').strip()}")
+    return trim_image(coverage_sprite(coverage), margin=0)
+
+def _compile_formula(work_dir: str, fmt: Optional[str], preamble: str, source: str,
+                     font_size: float, dpi: int) -> np.ndarray:
+    """
+    在工作目录中排版并光栅化单个公式
+
+    Returns:
+        紧致裁剪的白色预乘 BGRA 精灵
+    """
+    result = _run_latex(work_dir, fmt, preamble, [_fragment_page(source, font_size)], work_dir, 'formula')
+    if result.returncode != 0:
+        log_tail = result.stdout.decode('utf-8', 'replace').strip().splitlines()[-5:]
+        raise LatexServiceError(f"latex 排版失败: {' | '.join(log_tail)}")
+    return _rasterize(work_dir, os.path.join(work_dir, 'formula.dvi'), dpi)
+
+def _failed_fragments(log_path: str) -> set:
+    """从 latex 日志中找出出错的片段序号：错误行（以 ! 开头）归属于它之前最近的片段标记"""
+    failed = set()
+    current = None
+    with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if line.startswith(_FRAGMENT_MARKER):
+                current = int(line[len(_FRAGMENT_MARKER):].strip() or -1)
+            elif line.startswith('!'):
+                failed.add(current)
+    return failed
+
+def _compile_batch(work_dir: str, fmt: Optional[str], preamble: str, output_dir: str, jobname: str,
+                   entries: List[Tuple[str, float]]) -> Tuple[str, List[Optional[Tuple[float, float, float]]]]:
+    """
+    把所有片段作为同一文档的各页，只运行一次 latex 排版
+
+    Returns:
+        (DVI 路径, 每个片段的盒子尺寸)：尺寸为 (width, height, descent)，单位为点，
+        height 包含基线以下的 descent（与 TexManager.get_text_width_height_descent 一致）；排版出错的片段为 None
+    """
+    from matplotlib import dviread
+    pages = [f'\\typeout{{{_FRAGMENT_MARKER}{idx}}}\n' + _fragment_page(source, font_size)
+             for idx, (source, font_size) in enumerate(entries)]
+    # 不在第一个错误处停止：出错的片段单独标记，其余片段照常输出
+    _run_latex(work_dir, fmt, preamble, pages, output_dir, jobname, halt_on_error=False)
+    dvi_path = os.path.join(output_dir, f'{jobname}.dvi')
+    if not os.path.exists(dvi_path):
+        raise LatexServiceError("批量排版没有生成 DVI")
+    with dviread.Dvi(dvi_path, 72) as dvi:
+        metrics = [(page.width, page.height + page.descent, page.descent) for page in dvi]
+    if len(metrics) != len(entries):
+        # 出错的片段打乱了分页，无法把页面对应回片段
+        raise LatexServiceError(f"批量排版输出 {len(metrics)} 页，预期 {len(entries)} 页")
+    failed = _failed_fragments(os.path.join(output_dir, f'{jobname}.log'))
+    return dvi_path, [None if idx in failed else m for idx, m in enumerate(metrics)]
+
+class _Worker:
+    """
+    一个工作槽位：独立的工作目录，同一时间只由一个线程使用。
+    latex 在该目录中运行并加载服务预编译的格式文件（硬链接或复制到目录中），dvipng 的输出也写在这里
+    """
+
+    __slots__ = ('work_dir', 'fmt')
+
+    def __init__(self, format_path: Optional[str]):
+        """
+        Args:
+            format_path: 服务预编译的格式文件路径；None 表示每个公式完整加载导言区
+        """
+        self.work_dir = tempfile.mkdtemp(prefix='blackboard_latex_')
+        self.fmt = None
+        if format_path is not None:
+            target = os.path.join(self.work_dir, os.path.basename(format_path))
+            try:
+                os.link(format_path, target)
+            except OSError:
+                shutil.copyfile(format_path, target)
+            self.fmt = FORMAT_NAME
+
+    def request(self, preamble: str, payload: tuple):
+        """
+        在调用线程中执行一个请求：
+            ('render', source, font_size, dpi)            排版并光栅化单个公式
+            ('batch', output_dir, jobname, entries)       一次排版所有片段，返回 DVI 路径与各页尺寸
+            ('rasterize', dvi_path, dpi, page)            光栅化批量 DVI 中的一页
+        """
+        op, args = payload[0], payload[1:]
+        if op == 'render':
+            return _compile_formula(self.work_dir, self.fmt, preamble, *args)
+        if op == 'batch':
+            return _compile_batch(self.work_dir, self.fmt, preamble, *args)
+        return _rasterize(self.work_dir, *args)
+
+    def close(self) -> None:
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+class LatexService:
+    """
+    常驻的 LaTeX 渲染服务。
+    创建时在调用线程中把导言区（amsmath、amssymb、ctex）预编译为格式文件，并准备 workers 个工作槽位；
+    之后每个公式在调用线程中启动一次加载该格式的 latex 与一次 dvipng，返回白色的预乘 BGRA 精灵，
+    省去的是每个公式重新读取 ctex 导言区的开销。
+    compile_batch 把一道题的所有片段在一次 latex 运行中排版为同一文档的各页，
+    之后这些片段的测量直接读取各页尺寸，光栅化只运行 dvipng，每道题只启动一次 TeX。
+    每个批次使用独立的临时目录；被替换的批次目录在其中的光栅化请求全部完成后才删除。
+    服务是线程安全的：并发的调用各自占用一个工作槽位，最多 workers 个同时排版，其余调用等待槽位空出。
+    """
+
+    def __init__(self, preamble: str, workers: int = DEFAULT_LATEX_WORKERS):
+        """
+        Args:
+            preamble: LaTeX 导言区（\\usepackage 等）
+            workers: 最多同时排版的公式数
+        """
+        self.preamble = preamble
+        self.workers = max(1, workers)
+        self._format_dir = tempfile.mkdtemp(prefix='blackboard_latex_fmt_')
+        try:
+            fmt = _build_format(self._format_dir, preamble)
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning(f"LaTeX 导言区预编译失败，每个公式将完整加载导言区: {e}")
+            fmt = None
+        format_path = os.path.join(self._format_dir, f'{fmt}.fmt') if fmt else None
+        self._idle = queue.Queue()
+        for _ in range(self.workers):
+            self._idle.put(_Worker(format_path))
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._closed = False
+        # 当前批量排版的结果 {(source, font_size): (DVI 路径, 页码, (width, height, descent))}
+        self._batch = {}
+        self._batch_dir = None
+        # 批次目录 -> 正在读取其中 DVI 的请求数；已被替换但仍在使用的目录
+        self._batch_readers = {}
+        self._retired_batch_dirs = set()
+
+    def _acquire(self) -> _Worker:
+        """取一个空闲的工作槽位，全部被占用时等待其他调用归还"""
+        while True:
+            if self._closed:
+                raise LatexServiceError("LaTeX 服务已关闭")
+            try:
+                return self._idle.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+
+    def render(self, source: str, font_size: float, dpi: int) -> np.ndarray:
+        """
+        渲染一段完整的 LaTeX 源码（如 align* 环境）
+
+        Args:
+            source: 放入文档正文的 LaTeX 源码
+            font_size: 字号（点）
+            dpi: 光栅化 DPI
+
+        Returns:
+            紧致裁剪的白色预乘 BGRA 精灵（调用方可以修改）
+
+        Raises:
+            LatexServiceError: 排版或光栅化失败、超时，或服务已关闭
+        """
+        key = (source, font_size, dpi)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached.copy()
+            batched = self._batch.get((source, font_size))
+            if batched is not None:
+                batch_dir = os.path.dirname(batched[0])
+                self._batch_readers[batch_dir] = self._batch_readers.get(batch_dir, 0) + 1
+        if batched is not None:
+            # 已在批量排版中：只光栅化 DVI 中对应的一页
+            try:
+                sprite = self._call(('rasterize', batched[0], dpi, batched[1]))
+            finally:
+                self._release_batch_dir(batch_dir)
+        else:
+            sprite = self._call(('render', source, font_size, dpi))
+        with self._lock:
+            self._cache[key] = sprite
+            if len(self._cache) > RESULT_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return sprite.copy()
+
+    def _call(self, payload: tuple):
+        """占用一个空闲的工作槽位，在调用线程中执行请求"""
+        worker = self._acquire()
+        try:
+            return worker.request(self.preamble, payload)
+        except LatexServiceError:
+            raise
+        except Exception as e:
+            # 工具缺失、超时、DVI 无法解析等同样交给调用方回退
+            raise LatexServiceError(f"LaTeX 渲染失败: {e}") from e
+        finally:
+            with self._lock:
+                closed = self._closed
+            if closed:
+                worker.close()
+            else:
+                self._idle.put(worker)
+
+    def _retire_batch_dir(self, batch_dir: Optional[str]) -> bool:
+        """
+        标记批次目录已被替换（调用方持有锁）
+
+        Returns:
+            没有请求在读取该目录、可以立即删除时返回 True
+        """
+        if batch_dir is None:
+            return False
+        if self._batch_readers.get(batch_dir):
+            self._retired_batch_dirs.add(batch_dir)
+            return False
+        return True
+
+    def _release_batch_dir(self, batch_dir: str) -> None:
+        """一个光栅化请求读完批次目录；目录已被替换且不再有读取者时删除"""
+        with self._lock:
+            self._batch_readers[batch_dir] -= 1
+            if self._batch_readers[batch_dir] > 0:
+                return
+            del self._batch_readers[batch_dir]
+            if batch_dir not in self._retired_batch_dirs:
+                return
+            self._retired_batch_dirs.discard(batch_dir)
+        shutil.rmtree(batch_dir, ignore_errors=True)
+
+    def compile_batch(self, entries: List[Tuple[str, float]]) -> int:
+        """
+        在一次 latex 运行中排版一道题的所有片段，替换之前的批量结果
+
+        Args:
+            entries: (source, font_size) 列表
+
+        Returns:
+            排版成功的片段数
+
+        Raises:
+            LatexServiceError: 批量排版失败（调用方可忽略，片段会在渲染时逐个排版）
+        """
+        entries = list(dict.fromkeys(entries))
+        # 每个批次写入新的目录：其他线程可能仍在光栅化上一批次的 DVI
+        batch_dir = tempfile.mkdtemp(prefix='blackboard_latex_batch_') if entries else None
+        with self._lock:
+            self._batch = {}
+            previous, self._batch_dir = self._batch_dir, batch_dir
+            remove_previous = self._retire_batch_dir(previous)
+            if batch_dir is not None:
+                # 排版期间同样算作读取者，并发的 compile_batch 不会删除正在写入的目录
+                self._batch_readers[batch_dir] = 1
+        if remove_previous:
+            shutil.rmtree(previous, ignore_errors=True)
+        if not entries:
+            return 0
+        try:
+            dvi_path, metrics = self._call(('batch', batch_dir, 'batch', entries))
+            batch = {entry: (dvi_path, page, m)
+                     for page, (entry, m) in enumerate(zip(entries, metrics), start=1) if m is not None}
+            with self._lock:
+                if self._batch_dir != batch_dir:
+                    # 排版期间已被更新的批次替换
+                    return 0
+                self._batch = batch
+            return len(batch)
+        finally:
+            self._release_batch_dir(batch_dir)
+
+    def batch_metrics(self, source: str, font_size: float) -> Optional[Tuple[float, float, float]]:
+        """
+        批量排版得到的片段盒子尺寸 (width, height, descent)，单位为点；片段不在当前批次中时返回 None
+        """
+        with self._lock:
+            batched = self._batch.get((source, font_size))
+        return None if batched is None else batched[2]
+
+    def prefetch(self, requests: List[Tuple[str, float, int]]) -> None:
+        """
+        把一组公式并发分派给所有工作槽位渲染并放入结果缓存，之后的 render 直接命中缓存。
+        渲染失败的公式在此忽略，之后的 render 会重新报告错误
+        """
+        pending = list(dict.fromkeys(requests))
+        if len(pending) <= 1:
+            return
+
+        def _render_quietly(request):
+            try:
+                self.render(*request)
+            except LatexServiceError:
+                pass
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(pending))) as executor:
+            list(executor.map(_render_quietly, pending))
+
+    def close(self) -> None:
+        """关闭服务，删除工作目录与格式文件（正在排版的槽位在归还时删除）"""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            batch_dirs = self._retired_batch_dirs | {self._batch_dir}
+            self._batch = {}
+            self._batch_dir = None
+            self._retired_batch_dirs = set()
+        for batch_dir in batch_dirs - {None}:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+        shutil.rmtree(self._format_dir, ignore_errors=True)
+
+_service = None
+_service_unavailable = False
+_service_lock = threading.Lock()
+
+def get_latex_service(preamble: str) -> Optional[LatexService]:
+    """
+    获取进程内共享的 LaTeX 服务
+
+    Returns:
+        LatexService；LATEX_WORKERS_ENV 为 0 或系统中没有 latex / dvipng 时返回 None（首次调用时判断）
+    """
+    global _service, _service_unavailable
+    with _service_lock:
+        if _service_unavailable:
+            return None
+        if _service is not None and _service.preamble == preamble and not _service._closed:
+            return _service
+        workers = os.environ.get(LATEX_WORKERS_ENV)
+        workers = DEFAULT_LATEX_WORKERS if workers in (None, '') else int(workers)
+        if workers <= 0 or shutil.which('latex') is None or shutil.which('dvipng') is None:
+            _service_unavailable = True
+            return None
+        if _service is not None:
+            _service.close()
+        _service = LatexService(preamble, workers)
+        return _service
+
+@atexit.register
+def _close_service() -> None:
+    if _service is not None:
+        _service.close()
@@ -0,0 +1,84 @@
+from functools import lru_cache
+import re
+import numpy as np
+import logging
+from matplotlib.font_manager import FontProperties
+from matplotlib.mathtext import MathTextParser
+from ..utils.image_utils import trim_image, coverage_sprite
+from .text_renderer import RENDER_DPI
+
+logger = logging.getLogger(__name__)
+
+# mathtext 渲染算法变化时递增，使旧的精灵缓存失效
+MATHTEXT_RENDERER_VERSION = 1
+# mathtext 使用 Computer Modern 字体，与 usetex 渲染的公式外观一致
+MATHTEXT_FONTSET = 'cm'
+
+# 需要完整 TeX 的结构：多行/对齐环境、矩阵、分段函数、显式换行与对齐符
+_TEX_ONLY_PATTERN = re.compile(r'\\begin|\\end|\\\\|&|matrix|\\substack|\\usepackage|\\newcommand|\\def\b')
+
+_raster_parser = MathTextParser('agg')
+_path_parser = MathTextParser('path')
+
+def _mathtext_source(latex):
+    """
+    mathtext 实际解析的源码：去掉 $ 后重新包裹为行内公式。
+    usetex 路径把公式放在 align* 中按行间样式排版，这里把 \\frac 换成 \\dfrac 保持分式的大小一致
+    """
+    content = latex.strip().strip('$')
+    return '$' + re.sub(r'\\frac(?![a-zA-Z])', r'\\dfrac', content) + '$'
+
+def _font(font_size):
+    return FontProperties(size=font_size, math_fontfamily=MATHTEXT_FONTSET)
+
+@lru_cache(maxsize=1024)
+def mathtext_supported(latex):
+    """
+    判断 LaTeX 片段能否由进程内的 mathtext 渲染（无需启动 TeX）
+
+    Args:
+        latex: LaTeX 片段（带 $ 包裹）
+
+    Returns:
+        片段不含中文、多行环境、矩阵等 mathtext 不支持的结构，且 mathtext 能够解析时返回 True
+    """
+    content = latex.strip().strip('$').strip()
+    if not content or _TEX_ONLY_PATTERN.search(content):
+        return False
+    # 中文需要 ctex
+    if any('\u4e00' <= c <= '\u9fff' for c in content):
+        return False
+    try:
+        _path_parser.parse(_mathtext_source(latex), dpi=72, prop=_font(24))
+    except ValueError:
+        return False
+    return True
+
+def measure_mathtext(latex, font_size, scale=1.0):
+    """
+    不光栅化，只根据 mathtext 的盒子尺寸测量 render_mathtext_as_image 输出图像的像素尺寸。
+    盒子包含字形两侧的留白，比裁剪后的墨迹略大，布局求解的缩放因子因此偏保守
+
+    Returns:
+        (width, height) 像素尺寸（浮点数）
+    """
+    parsed = _path_parser.parse(_mathtext_source(latex), dpi=72, prop=_font(font_size))
+    px_per_point = max(1, int(round(RENDER_DPI * scale))) / 72
+    return parsed.width * px_per_point, parsed.height * px_per_point
+
+def render_mathtext_as_image(latex, font_size, scale=1.0):
+    """
+    用 matplotlib mathtext 在进程内渲染 LaTeX 片段，不创建图形、不启动 TeX
+
+    Args:
+        latex: LaTeX 片段（带 $ 包裹），须满足 mathtext_supported
+        font_size: 字体大小
+        scale: 光栅化比例，与 render_latex_as_image 的 scale 含义相同
+
+    Returns:
+        紧致裁剪的白色预乘 BGRA 图像
+    """
+    parsed = _raster_parser.parse(_mathtext_source(latex), dpi=max(1, int(round(RENDER_DPI * scale))),
+                                  prop=_font(font_size))
+    # 光栅化结果是 uint8 的墨迹覆盖率
+    return trim_image(coverage_sprite(np.asarray(parsed.image)), margin=0)
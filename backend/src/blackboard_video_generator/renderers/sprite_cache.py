@@ -0,0 +1,289 @@
+from typing import Callable, Optional, Tuple
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import zipfile
+import numpy as np
+import matplotlib
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl 模块，淘汰时不加跨进程锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 磁盘缓存目录的环境变量；设为空字符串时禁用精灵缓存
+SPRITE_CACHE_ENV = 'BLACKBOARD_SPRITE_CACHE_DIR'
+# 缓存总大小上限（MB）的环境变量
+SPRITE_CACHE_MAX_MB_ENV = 'BLACKBOARD_SPRITE_CACHE_MAX_MB'
+DEFAULT_SPRITE_CACHE_MAX_MB = 512
+# 缓存文件格式变化时递增，使旧的缓存文件失效
+SPRITE_CACHE_VERSION = 1
+# 超出上限时淘汰到上限的该比例，避免每次写入都触发淘汰
+_EVICT_TARGET = 0.9
+# 每写入这么多个条目重新扫描一次目录，校正其他进程写入的大小
+_RESCAN_INTERVAL = 256
+
+_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+_stats_lock = threading.Lock()
+
+def _count(name: str, amount: int = 1) -> None:
+    with _stats_lock:
+        _stats[name] += amount
+
+def sprite_cache_key(*fields) -> str:
+    """
+    由渲染器名称、渲染器版本、文本、字号、DPI、颜色、字体等字段计算内容地址（SHA-256）。
+    matplotlib 版本同样计入，字体渲染细节变化后旧条目自动失效
+    """
+    payload = json.dumps([SPRITE_CACHE_VERSION, matplotlib.__version__, *fields],
+                         ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class SpriteCache:
+    """
+    以内容哈希为键的磁盘精灵缓存。
+    每个条目是一个压缩的 .npz 文件，包含预乘 BGRA 精灵和/或一组浮点度量值，按哈希前两位分目录存放。
+    写入先写临时文件再原子替换，多个进程可以同时读写同一目录；命中时更新文件的修改时间，
+    总大小超过上限时按修改时间淘汰最久未使用的条目（LRU）。
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        """
+        Args:
+            cache_dir: 缓存目录
+            max_bytes: 缓存总大小上限（字节）
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # 本进程估计的缓存总大小，首次写入时扫描目录得到
+        self._approx_bytes = None
+        self._stores_since_scan = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npz")
+
+    def get(self, key: str) -> Optional[Tuple[Optional[np.ndarray], Optional[np.ndarray]]]:
+        """
+        读取缓存条目
+
+        Returns:
+            (sprite, metrics)，条目中没有的部分为 None；未命中或文件损坏时返回 None
+        """
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                sprite = data['sprite'] if 'sprite' in data.files else None
+                metrics = data['metrics'] if 'metrics' in data.files else None
+        except FileNotFoundError:
+            _count('misses')
+            return None
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            logger.warning(f"精灵缓存文件损坏，将重新渲染: {path} ({e})")
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            _count('misses')
+            return None
+        try:
+            # LRU：命中即更新修改时间
+            os.utime(path)
+        except OSError:
+            pass
+        _count('hits')
+        return sprite, metrics
+
+    def contains(self, key: str) -> bool:
+        """条目是否存在（不计入命中统计，也不更新修改时间）"""
+        return os.path.exists(self._path(key))
+
+    def put(self, key: str, sprite: Optional[np.ndarray] = None, metrics=None) -> bool:
+        """
+        写入缓存条目（写入临时文件后原子替换，并发的进程不会读到写了一半的文件）
+
+        Args:
+            key: sprite_cache_key 计算的内容地址
+            sprite: 预乘 BGRA 精灵
+            metrics: 浮点度量值序列（如 TeX 盒子尺寸）
+
+        Returns:
+            是否写入成功
+        """
+        arrays = {}
+        if sprite is not None:
+            arrays['sprite'] = np.ascontiguousarray(sprite)
+        if metrics is not None:
+            arrays['metrics'] = np.asarray(metrics, dtype=np.float64)
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.npz.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.savez_compressed(f, **arrays)
+                size = os.path.getsize(tmp_path)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            logger.warning(f"无法写入精灵缓存 {path}: {e}")
+            return False
+        _count('stores')
+        with self._lock:
+            self._stores_since_scan += 1
+            needs_scan = (self._approx_bytes is None or self._stores_since_scan >= _RESCAN_INTERVAL)
+            if not needs_scan:
+                self._approx_bytes += size
+                needs_scan = self._approx_bytes > self.max_bytes
+        if needs_scan:
+            self._evict()
+        return True
+
+    def _evict(self) -> None:
+        """扫描缓存目录，总大小超过上限时删除最久未使用的条目；其他进程正在淘汰时直接跳过"""
+        lock_file = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            if fcntl is not None:
+                lock_file = open(os.path.join(self.cache_dir, '.evict.lock'), 'w')
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return
+            entries = []
+            for subdir in os.scandir(self.cache_dir):
+                if not subdir.is_dir():
+                    continue
+                for entry in os.scandir(subdir.path):
+                    if entry.name.endswith('.npz'):
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            if total > self.max_bytes:
+                evicted = 0
+                for _, size, path in sorted(entries):
+                    if total <= self.max_bytes * _EVICT_TARGET:
+                        break
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+                    evicted += 1
+                _count('evictions', evicted)
+                logger.debug(f"精灵缓存淘汰 {evicted} 个条目，剩余 {total / (1024 * 1024):.1f} MB")
+            with self._lock:
+                self._approx_bytes = total
+                self._stores_since_scan = 0
+        except OSError as e:
+            logger.warning(f"精灵缓存淘汰失败: {e}")
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+
+    def clear(self) -> None:
+        """删除所有缓存条目"""
+        with self._lock:
+            self._approx_bytes = None
+        if not os.path.isdir(self.cache_dir):
+            return
+        for subdir in os.scandir(self.cache_dir):
+            if subdir.is_dir():
+                for entry in os.scandir(subdir.path):
+                    try:
+                        os.unlink(entry.path)
+                    except OSError as e:
+                        logger.warning(f"无法删除精灵缓存 {entry.path}: {e}")
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def sprite_cache_dir():
+    """磁盘缓存目录，默认位于系统临时目录下，同一节点上的所有任务共享；返回 None 表示禁用缓存"""
+    cache_dir = os.environ.get(SPRITE_CACHE_ENV)
+    if cache_dir is None:
+        return os.path.join(tempfile.gettempdir(), 'blackboard_sprites')
+    return cache_dir or None
+
+def get_sprite_cache() -> Optional[SpriteCache]:
+    """获取当前目录配置对应的精灵缓存；缓存被禁用时返回 None"""
+    global _cache
+    cache_dir = sprite_cache_dir()
+    if cache_dir is None:
+        return None
+    max_mb = os.environ.get(SPRITE_CACHE_MAX_MB_ENV)
+    max_bytes = int((float(max_mb) if max_mb else DEFAULT_SPRITE_CACHE_MAX_MB) * 1024 * 1024)
+    with _cache_lock:
+        if _cache is None or _cache.cache_dir != cache_dir or _cache.max_bytes != max_bytes:
+            _cache = SpriteCache(cache_dir, max_bytes)
+        return _cache
+
+def cached_sprite(render: Callable[[], np.ndarray], *key_fields) -> np.ndarray:
+    """
+    按内容地址读取精灵，未命中时调用 render 渲染并写入缓存。
+    render 抛出的异常原样传出，出错时的占位图像因此不会被缓存
+
+    Args:
+        render: 无参数的渲染函数，返回预乘 BGRA 精灵
+        key_fields: 决定渲染结果的全部字段（渲染器名称与版本、文本、字号、DPI、颜色、字体等）
+
+    Returns:
+        预乘 BGRA 精灵（调用方可以修改）
+    """
+    cache = get_sprite_cache()
+    if cache is None:
+        return render()
+    key = sprite_cache_key(*key_fields)
+    entry = cache.get(key)
+    if entry is not None and entry[0] is not None:
+        return entry[0]
+    sprite = render()
+    cache.put(key, sprite=sprite)
+    return sprite
+
+def cached_metrics(measure: Callable[[], Tuple[float, ...]], *key_fields) -> Tuple[float, ...]:
+    """与 cached_sprite 相同，但缓存的是一组浮点度量值（如与 DPI 无关的 TeX 盒子尺寸）"""
+    cache = get_sprite_cache()
+    if cache is None:
+        return measure()
+    key = sprite_cache_key(*key_fields)
+    entry = cache.get(key)
+    if entry is not None and entry[1] is not None:
+        return tuple(float(value) for value in entry[1])
+    metrics = measure()
+    cache.put(key, metrics=metrics)
+    return metrics
+
+def is_cached(*key_fields) -> bool:
+    """按 cached_sprite / cached_metrics 相同的字段判断条目是否已在磁盘缓存中"""
+    cache = get_sprite_cache()
+    return cache is not None and cache.contains(sprite_cache_key(*key_fields))
+
+def sprite_cache_stats() -> dict:
+    """
+    本进程的精灵缓存统计
+
+    Returns:
+        字典：hits / misses / stores / evictions 次数，以及命中率 hit_rate（没有查询时为 None）
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else None
+    return stats
+
+def reset_sprite_cache_stats() -> None:
+    """清零统计（每次生成视频开始时调用）"""
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
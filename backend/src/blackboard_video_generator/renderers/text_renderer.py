@@ -2,12 +2,34 @@ import numpy as np
 import cv2
 import matplotlib
 import matplotlib.pyplot as plt
+from matplotlib.font_manager import FontProperties, findfont
+from functools import lru_cache
 import io
+import os
 import logging
-from ..utils.image_utils import trim_image
+from ..utils.image_utils import trim_image, premultiply_image, coverage_sprite, text_placeholder
+from .sprite_cache import cached_sprite
+from .glyph_atlas import layout_text, layout_bbox, rasterize_text
 
 logger = logging.getLogger(__name__)
 
+# 文本/公式光栅化的基准 DPI；scale 参数按比例降低 DPI（草稿模式）
+RENDER_DPI = 200
+# 文本渲染算法变化时递增，使旧的精灵缓存失效
+TEXT_RENDERER_VERSION = 3
+
+# 中文字体的优先级，同时也是首选字体缺字时的回退顺序
+CJK_FONT_PRIORITIES = [
+    'Noto Sans CJK SC',
+    'Noto Sans CJK JP',
+    'Source Han Sans CN',
+    'WenQuanYi Micro Hei',
+    'WenQuanYi Zen Hei',
+    'Microsoft YaHei',
+    'SimHei',
+    'STHeiti'
+]
+
 # --- 仅用于普通 text 的 Unicode 符号 ---------------------------
 UNICODE_REPLACEMENTS = {
     '⊥': '⊥',
@@ -24,138 +46,215 @@ UNICODE_REPLACEMENTS = {
     '≥': '≥',
 }
 
-def render_text_as_image(text, font_size, debug=False):
+def _to_unicode(text):
+    """把普通文本中的符号替换为 Unicode 字符（渲染与测量使用同一份文本）"""
+    for k, v in UNICODE_REPLACEMENTS.items():
+        text = text.replace(k, v)
+    return text
+
+def _find_chinese_font(text, debug=False):
+    """
+    文本含中文时按优先级查找可用的中文字体
+
+    Returns:
+        字体名称；文本不含中文或没有可用的中文字体时返回 None（使用 sans-serif 字体族）
+    """
+    if not any('\u4e00' <= c <= '\u9fff' for c in text):
+        return None
+    try:
+        from matplotlib.font_manager import fontManager
+        for font in CJK_FONT_PRIORITIES:
+            matching_fonts = [f.name for f in fontManager.ttflist if font.lower() in f.name.lower()]
+            if matching_fonts:
+                if debug:
+                    logger.info(f"文本渲染使用中文字体: {matching_fonts[0]}")
+                return matching_fonts[0]
+    except Exception as e:
+        if debug:
+            logger.warning(f"检测中文字体失败: {str(e)}")
+    return None
+
+@lru_cache(maxsize=16)
+def _font_chain(family):
+    """
+    字体族对应的字体回退链：首选字体文件，其后依次是已安装的中文字体和 DejaVu Sans。
+    首选字体缺少的字符（如西文字体中的全角标点、中文字体中的数学符号）从链中靠后的字体取字形
+
+    Returns:
+        去重后的字体文件路径元组
+    """
+    from matplotlib.font_manager import fontManager
+    paths = [findfont(FontProperties(family=[family]))]
+    for font in CJK_FONT_PRIORITIES:
+        paths.extend(f.fname for f in fontManager.ttflist if font.lower() in f.name.lower())
+    paths.append(findfont(FontProperties(family=['DejaVu Sans'])))
+    return tuple(dict.fromkeys(paths))
+
+def _font_fingerprint(family):
     """
-    将文本渲染为图像
+    字体回退链的缓存键字段：每个字体文件的路径、修改时间与大小。
+    已安装字体增删或更新后键随之变化，磁盘缓存不会返回用旧字体渲染的精灵
+
+    Returns:
+        (path, mtime_ns, size) 元组组成的元组；无法访问的文件记为 (path, None, None)
+    """
+    fingerprint = []
+    for path in _font_chain(family):
+        try:
+            st = os.stat(path)
+            fingerprint.append((path, st.st_mtime_ns, st.st_size))
+        except OSError:
+            fingerprint.append((path, None, None))
+    return tuple(fingerprint)
+
+def _pixel_size(font_size, dpi):
+    """字号（点）在光栅化 DPI 下每 em 的像素数"""
+    return font_size * dpi / 72
+
+def measure_text(text, font_size, scale=1.0):
+    """
+    不合成图像，只根据字形图集中的字形排版测量 render_text_as_image 输出图像的像素尺寸
+    （字形首次出现时光栅化一次，之后渲染同一文本直接复用）
+
+    Args:
+        text: 文本内容
+        font_size: 字体大小
+        scale: 光栅化比例，与 render_text_as_image 的 scale 含义相同
+
+    Returns:
+        (width, height) 像素尺寸（浮点数）；文本没有可见字形时返回 (0.0, 0.0)
+    """
+    text = _to_unicode(text)
+    if not text.strip():
+        return 0.0, 0.0
+    family = _find_chinese_font(text) or 'sans-serif'
+    dpi = max(1, int(round(RENDER_DPI * scale)))
+    bbox = layout_bbox(layout_text(text, _font_chain(family), _pixel_size(font_size, dpi)))
+    if bbox is None:
+        return 0.0, 0.0
+    x0, y0, x1, y1 = bbox
+    return float(x1 - x0), float(y1 - y0)
+
+def _render_text_glyphs(text, font_size, family, dpi):
+    """
+    用字形图集直接光栅化（已转换为 Unicode 的）文本，不创建 matplotlib 图形
+
+    Returns:
+        紧致裁剪的白色预乘 BGRA 文本图像；没有可见字形时为 1x1 的透明图像
+    """
+    coverage = rasterize_text(text, _font_chain(family), _pixel_size(font_size, dpi))
+    if coverage is None:
+        return np.zeros((1, 1, 4), dtype=np.uint8)
+    return trim_image(coverage_sprite(coverage), margin=0)
+
+def _render_text_matplotlib(text, font_size, chinese_font, dpi, debug=False):
+    """
+    用 matplotlib 图形渲染（已转换为 Unicode 的）文本（字形图集不可用时的回退路径），出错时抛出异常
+
+    Returns:
+        紧致裁剪的预乘 BGRA 文本图像
+    """
+    # 新的画布尺寸计算
+    char_w_inch = font_size * 0.55 / 72  # 每个字符宽度（英寸）
+    fig_width = max(char_w_inch * len(text), 2)  # 最小2英寸
+    fig_height = max(font_size * 1.3 / 72, 1)    # 字体高度加行距
+    
+    # 创建matplotlib图形，使用动态大小
+    fig = plt.figure(figsize=(fig_width, fig_height), dpi=dpi, facecolor='none')
+    ax = fig.add_subplot(111)
+    
+    # 设置背景完全透明
+    fig.patch.set_alpha(0.0)
+    ax.set_facecolor((0, 0, 0, 0))
+    ax.patch.set_alpha(0.0)
+    
+    # 渲染文本
+    if chinese_font:
+        ax.text(0.5, 0.5, text, 
+               fontsize=font_size,
+               color='white',
+               ha='center', va='center',
+               transform=ax.transAxes,
+               family=chinese_font,
+               usetex=False,          # 明确关闭 LaTeX
+               parse_math=False)      # 正确：关闭 mathtext
+    else:
+        # 如果没有找到合适的中文字体，尝试用sans-serif字体族
+        ax.text(0.5, 0.5, text, 
+               fontsize=font_size,
+               color='white',
+               ha='center', va='center',
+               transform=ax.transAxes,
+               family='sans-serif',
+               usetex=False,          # 明确关闭 LaTeX
+               parse_math=False)      # 正确：关闭 mathtext
+        if debug and any('\u4e00' <= c <= '\u9fff' for c in text):
+            logger.warning("未找到中文字体，使用sans-serif族")
+    
+    # 移除坐标轴和边框
+    ax.axis('off')
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    
+    # 调整边距
+    plt.tight_layout(pad=0)
+    
+    # 将图形转换为图像
+    buf = io.BytesIO()
+    plt.savefig(buf, format='png', 
+               bbox_inches='tight',
+               pad_inches=0.05,
+               facecolor='none',
+               edgecolor='none',
+               transparent=True)
+    plt.close(fig)
+    
+    # 读取图像数据
+    buf.seek(0)
+    img = cv2.imdecode(np.frombuffer(buf.read(), np.uint8), cv2.IMREAD_UNCHANGED)
+    
+    # 转换为紧致裁剪的预乘 BGRA 精灵：透明背景不参与混合
+    return trim_image(premultiply_image(img), margin=0)
+
+def render_text_as_image(text, font_size, debug=False, scale=1.0):
+    """
+    将文本渲染为图像。字形由按字体、字号缓存的字形图集（见 glyph_atlas.py）直接拷贝，失败时回退到 matplotlib 图形。
+    结果按文本、字号、DPI、字体及其回退链中字体文件的版本缓存在磁盘上（见 sprite_cache.py），
+    同一节点上重复出现的文本（如选项标签、几何图形标签）只渲染一次
     
     Args:
         text: 文本内容
         font_size: 字体大小
         debug: 是否输出调试信息
+        scale: 光栅化比例，图像像素尺寸约为 scale=1.0 时的 scale 倍
         
     Returns:
-        文本图像
+        紧致裁剪的预乘 BGRA 文本图像
     """
     try:
         logger.info(f"渲染文本: {text}, 字体大小: {font_size}")
-        
-        # 新的画布尺寸计算
-        dpi = 200  # 保持高清
-        char_w_inch = font_size * 0.55 / 72  # 每个字符宽度（英寸）
-        fig_width = max(char_w_inch * len(text), 2)  # 最小2英寸
-        fig_height = max(font_size * 1.3 / 72, 1)    # 字体高度加行距
-        
-        # 创建matplotlib图形，使用动态大小
-        fig = plt.figure(figsize=(fig_width, fig_height), dpi=dpi, facecolor='none')
-        ax = fig.add_subplot(111)
-        
-        # 设置背景完全透明
-        fig.patch.set_alpha(0.0)
-        ax.set_facecolor((0, 0, 0, 0))
-        ax.patch.set_alpha(0.0)
-        
+        dpi = max(1, int(round(RENDER_DPI * scale)))  # 默认保持高清
         # --- 转成 Unicode，彻底关闭 mathtext ---
-        for k, v in UNICODE_REPLACEMENTS.items():
-            text = text.replace(k, v)
-        
-        # 尝试检测可用的中文字体
-        chinese_font = None
-        if any('\u4e00' <= c <= '\u9fff' for c in text):
+        unicode_text = _to_unicode(text)
+        chinese_font = _find_chinese_font(unicode_text, debug)
+        family = chinese_font or 'sans-serif'
+
+        def render():
             try:
-                from matplotlib.font_manager import fontManager
-                font_priorities = [
-                    'Noto Sans CJK SC', 
-                    'Noto Sans CJK JP', 
-                    'Source Han Sans CN', 
-                    'WenQuanYi Micro Hei', 
-                    'WenQuanYi Zen Hei', 
-                    'Microsoft YaHei', 
-                    'SimHei', 
-                    'STHeiti'
-                ]
-                
-                for font in font_priorities:
-                    matching_fonts = [f.name for f in fontManager.ttflist if font.lower() in f.name.lower()]
-                    if matching_fonts:
-                        chinese_font = matching_fonts[0]
-                        if debug:
-                            logger.info(f"文本渲染使用中文字体: {chinese_font}")
-                        break
+                return _render_text_glyphs(unicode_text, font_size, family, dpi)
             except Exception as e:
-                if debug:
-                    logger.warning(f"检测中文字体失败: {str(e)}")
-            
-        # 渲染文本
-        if chinese_font:
-            ax.text(0.5, 0.5, text, 
-                   fontsize=font_size,
-                   color='white',
-                   ha='center', va='center',
-                   transform=ax.transAxes,
-                   family=chinese_font,
-                   usetex=False,          # 明确关闭 LaTeX
-                   parse_math=False)      # 正确：关闭 mathtext
-        else:
-            # 如果没有找到合适的中文字体，尝试用sans-serif字体族
-            ax.text(0.5, 0.5, text, 
-                   fontsize=font_size,
-                   color='white',
-                   ha='center', va='center',
-                   transform=ax.transAxes,
-                   family='sans-serif',
-                   usetex=False,          # 明确关闭 LaTeX
-                   parse_math=False)      # 正确：关闭 mathtext
-            if debug and any('\u4e00' <= c <= '\u9fff' for c in text):
-                logger.warning("未找到中文字体，使用sans-serif族")
-        
-        # 移除坐标轴和边框
-        ax.axis('off')
-        for spine in ax.spines.values():
-            spine.set_visible(False)
-        
-        # 调整边距
-        plt.tight_layout(pad=0)
-        
-        # 将图形转换为图像
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', 
-                   bbox_inches='tight',
-                   pad_inches=0.05,
-                   facecolor='none',
-                   edgecolor='none',
-                   transparent=True)
-        plt.close(fig)
-        
-        # 读取图像数据
-        buf.seek(0)
-        img = cv2.imdecode(np.frombuffer(buf.read(), np.uint8), cv2.IMREAD_UNCHANGED)
-        
-        # 处理透明通道 (BGRA -> RGB)
-        if img.shape[2] == 4:  # BGRA
-            # 创建一个与黑板背景颜色匹配的画布
-            canvas = np.ones((img.shape[0], img.shape[1], 3), dtype=np.uint8) * np.array([30, 30, 30], dtype=np.uint8)
-            
-            # 提取透明通道作为蒙版
-            alpha = img[:, :, 3] / 255.0
-            
-            # 只将非透明部分渲染为白色
-            for c in range(3):  # RGB通道
-                canvas[:, :, c] = canvas[:, :, c] * (1 - alpha) + 255 * alpha
-            
-            # 裁剪图像
-            canvas = trim_image(canvas)
-            return canvas
-        else:
-            return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+                logger.warning(f"字形图集渲染失败，回退到 matplotlib: {e}")
+                return _render_text_matplotlib(unicode_text, font_size, chinese_font, dpi, debug)
+
+        return cached_sprite(render, 'text', TEXT_RENDERER_VERSION, unicode_text, font_size, dpi, 'white', family,
+                             _font_fingerprint(family))
             
     except Exception as e:
         logger.error(f"渲染文本为图像时出错: {str(e)}")
         # 创建一个默认图像
-        img = np.zeros((100, max(len(text) * 20, 200), 3), dtype=np.uint8)
-        cv2.putText(img, "Text Error", (10, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-        return img
+        return text_placeholder("Text Error", (100, max(len(text) * 20, 200)), (10, 50), thickness=2, scale=scale)
 
-def render_text(text, font_size, debug=False):
+def render_text(text, font_size, debug=False, scale=1.0):
     """
     渲染文本的外部接口函数
     
@@ -163,15 +262,16 @@ def render_text(text, font_size, debug=False):
         text: 文本内容
         font_size: 字体大小
         debug: 是否输出调试信息
+        scale: 光栅化比例（最大尺寸限制同比缩放）
         
     Returns:
-        文本图像
+        预乘 BGRA 文本图像
     """
-    img = render_text_as_image(text, font_size, debug)
+    img = render_text_as_image(text, font_size, debug, scale)
     
     # 检查是否需要缩放图像
-    max_width = 1920  # 最大宽度
-    max_height = 1080  # 最大高度
+    max_width = int(1920 * scale)  # 最大宽度
+    max_height = int(1080 * scale)  # 最大高度
 
     # 考虑右侧安全区
     safe_right = 0.40  # 右侧40%留给教师视频
@@ -0,0 +1,196 @@
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Tuple, Optional
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 底部 15% 高度专门留给字幕
+MIN_BOTTOM_SAFE = 0.15
+# 安全区各边的默认值（0-1 的比例值）
+DEFAULT_SAFE_ZONE = {'left': 0.05, 'top': 0.05, 'bottom': MIN_BOTTOM_SAFE, 'right': 0.40}
+DEFAULT_VERTICAL_SPACING = 0.02
+DEFAULT_FONT_SIZE = 32
+ELEMENT_TYPES = ('text', 'formula', 'geometry')
+
+def _optional_float(value: Any, name: str) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} 必须是数值: {value!r}")
+
+@dataclass(slots=True)
+class SafeZone:
+    """步骤的安全区（0-1 的比例值），元素只在 left/top/right/bottom 围成的内容区内布局"""
+
+    left: float = DEFAULT_SAFE_ZONE['left']
+    top: float = DEFAULT_SAFE_ZONE['top']
+    bottom: float = DEFAULT_SAFE_ZONE['bottom']
+    right: float = DEFAULT_SAFE_ZONE['right']
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> 'SafeZone':
+        """解析 JSON 中的 safe_zone，底部边距不小于 MIN_BOTTOM_SAFE"""
+        data = data or {}
+        values = {key: _optional_float(data.get(key), f"safe_zone.{key}") for key in DEFAULT_SAFE_ZONE}
+        values = {key: DEFAULT_SAFE_ZONE[key] if value is None else value for key, value in values.items()}
+        values['bottom'] = max(values['bottom'], MIN_BOTTOM_SAFE)
+        return cls(**values)
+
+    @property
+    def width(self) -> float:
+        return 1.0 - self.left - self.right
+
+    @property
+    def height(self) -> float:
+        return 1.0 - self.top - self.bottom
+
+@dataclass(slots=True)
+class Element:
+    """
+    步骤中的一个元素。
+    前半部分字段解析自 JSON；image / size / center 由布局阶段填写，之后的时间轴与合成阶段直接读取。
+    """
+
+    type: str
+    content: Any
+    font_size: int = DEFAULT_FONT_SIZE
+    scale: float = 1.0
+    # JSON 中的位置，相对于安全区（0-1 的比例值）；x 为 None 时水平居中
+    position: Optional[Tuple[Optional[float], Optional[float]]] = None
+    animation: Dict[str, Any] = field(default_factory=dict)
+    # 元素在步骤内的出现/消失时间（秒，相对于步骤开始），end_time 为 None 时持续到步骤结束
+    start_time: float = 0.0
+    end_time: Optional[float] = None
+
+    # ---- 布局结果 ----
+    # 渲染并缩放后的预乘 BGRA 图像
+    image: Optional[np.ndarray] = None
+    # 图像尺寸占帧宽/帧高的比例 (w, h)
+    size: Tuple[float, float] = (0.0, 0.0)
+    # 测量阶段求得的元素自身光栅化比例（把渲染器的最大宽度限制折算进光栅化 DPI）
+    raster_scale: float = 1.0
+    # 元素中心在帧中的全局位置（0-1 的比例值）
+    center: Optional[Tuple[float, float]] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Element':
+        """解析 JSON 中的元素；字段类型错误时抛出 ValueError"""
+        if not isinstance(data, dict):
+            raise ValueError(f"元素必须是对象: {data!r}")
+        element_type = data.get('type')
+        if element_type not in ELEMENT_TYPES:
+            logger.warning(f"未知的元素类型 {element_type}，元素将以占位图像显示")
+        position = data.get('position')
+        if position is not None:
+            if not isinstance(position, (list, tuple)) or len(position) != 2:
+                raise ValueError(f"元素 position 必须是长度为 2 的数组: {position!r}")
+            position = (_optional_float(position[0], 'position[0]'), _optional_float(position[1], 'position[1]'))
+        animation = data.get('animation') or {}
+        if not isinstance(animation, dict):
+            logger.warning(f"元素 animation 不是对象，已忽略: {animation!r}")
+            animation = {}
+        return cls(
+            type=element_type,
+            content=data.get('content'),
+            font_size=data.get('font_size', DEFAULT_FONT_SIZE),
+            scale=_optional_float(data.get('scale', 1.0), 'scale'),
+            position=position,
+            animation=animation,
+            start_time=_optional_float(data.get('start_time', 0), 'start_time') or 0.0,
+            end_time=_optional_float(data.get('end_time'), 'end_time'),
+        )
+
+    def release(self) -> None:
+        """释放布局阶段生成的图像"""
+        self.image = None
+
+@dataclass(slots=True)
+class Step:
+    """黑板视频的一个步骤"""
+
+    step_id: Any
+    duration: float
+    elements: List[Element]
+    safe_zone: SafeZone = field(default_factory=SafeZone)
+    layout: Optional[str] = None
+    # 元素间的纵向间距（帧高的比例）；布局阶段会按缩放因子更新
+    vertical_spacing: float = DEFAULT_VERTICAL_SPACING
+    title: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Step':
+        """解析 JSON 中的步骤及其所有元素"""
+        if not isinstance(data, dict):
+            raise ValueError(f"步骤必须是对象: {data!r}")
+        vertical_spacing = _optional_float(data.get('vertical_spacing'), 'vertical_spacing')
+        return cls(
+            step_id=data.get('step_id', 'N/A'),
+            duration=_optional_float(data.get('duration', 0), 'duration') or 0.0,
+            elements=[Element.from_dict(element) for element in data.get('elements') or []],
+            safe_zone=SafeZone.from_dict(data.get('safe_zone')),
+            layout=data.get('layout'),
+            vertical_spacing=DEFAULT_VERTICAL_SPACING if vertical_spacing is None else vertical_spacing,
+            title=data.get('title'),
+        )
+
+    def total_frames(self, fps: int) -> int:
+        return int(self.duration * fps)
+
+    def release(self) -> None:
+        """释放所有元素的图像（流式模式下步骤渲染完成后调用）"""
+        for element in self.elements:
+            element.release()
+
+@dataclass(slots=True)
+class Scene:
+    """
+    从题目 JSON 的 blackboard 字段编译得到的场景，只解析和校验一次，
+    由布局、时间轴和合成各阶段共享
+    """
+
+    steps: List[Step]
+    resolution: Optional[Tuple[int, int]] = None
+    background: Optional[str] = None
+    background_seed: Optional[int] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Scene':
+        """解析 blackboard 数据；结构或字段类型错误时抛出 ValueError"""
+        if not isinstance(data, dict):
+            raise ValueError(f"blackboard 数据必须是对象: {data!r}")
+        resolution = data.get('resolution')
+        if resolution is not None:
+            if not isinstance(resolution, (list, tuple)) or len(resolution) < 2:
+                raise ValueError(f"resolution 必须是 [width, height]: {resolution!r}")
+            resolution = (int(resolution[0]), int(resolution[1]))
+        return cls(
+            steps=[Step.from_dict(step) for step in data.get('steps') or []],
+            resolution=resolution,
+            background=data.get('background'),
+            background_seed=data.get('background_seed'),
+        )
+
+@dataclass(slots=True)
+class TimelineItem:
+    """时间轴上的一个元素：布局后的图像、全局位置及以帧为单位的出现/消失与动画区间"""
+
+    type: str
+    # 预乘 BGRA 图像（或视为完全不透明的 BGR 图像）
+    content: np.ndarray
+    # 元素中心在帧中的全局位置（0-1 的比例值）
+    position: Tuple[float, float]
+    start_frame: int
+    end_frame: int
+    fade_in_frames: int = 0
+    fade_out_frames: int = 0
+    # 入场/退场效果，见 animations.py；None 表示没有对应的动画
+    enter: Optional[str] = None
+    exit: Optional[str] = None
+    # draw_path 入场的增量路径动画器（GeometryPathAnimator）
+    path_animator: Any = None
+    z_index: int = 0
+    # 预先生成的图像变体（如高亮着色版本），见 prepare_item_variants
+    variants: Dict[str, np.ndarray] = field(default_factory=dict)
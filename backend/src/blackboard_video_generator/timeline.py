@@ -0,0 +1,61 @@
+from typing import List, Tuple
+import bisect
+import logging
+
+from .scene import TimelineItem
+
+logger = logging.getLogger(__name__)
+
+class ActiveSet:
+    """
+    用扫描线维护时间轴中当前可见的元素集合。
+    所有元素的出现/消失在构造时转换为按帧排序的事件，帧序号单调递增时只需处理新越过的事件，
+    因此每帧的开销只与发生变化的元素数量有关，与时间轴总长度无关。
+    """
+
+    def __init__(self, timeline: List[TimelineItem]):
+        """
+        Args:
+            timeline: 按 z_index 排序的时间轴元素列表
+        """
+        events = []
+        for idx, item in enumerate(timeline):
+            if item.start_frame >= item.end_frame:
+                continue
+            # 同一帧上先处理消失事件 (0) 再处理出现事件 (1)
+            events.append((item.end_frame, 0, idx))
+            events.append((item.start_frame, 1, idx))
+        events.sort()
+        self._events: List[Tuple[int, int, int]] = events
+        self.reset()
+
+    def reset(self) -> None:
+        """回到时间轴起点"""
+        self._cursor = 0
+        self._frame = -1
+        self._active: List[int] = []
+
+    def at(self, frame_idx: int) -> List[int]:
+        """
+        推进到指定帧并返回当前可见元素的序号
+
+        Args:
+            frame_idx: 帧序号（相对于步骤开始）；小于上一次的帧序号时从头重新扫描
+
+        Returns:
+            按 z 顺序（时间轴序号）排列的可见元素序号列表，调用方不得修改
+        """
+        if frame_idx < self._frame:
+            self.reset()
+        events = self._events
+        cursor = self._cursor
+        while cursor < len(events) and events[cursor][0] <= frame_idx:
+            _, is_enter, idx = events[cursor]
+            if is_enter:
+                bisect.insort(self._active, idx)
+            else:
+                self._active.remove(idx)
+            cursor += 1
+        self._cursor = cursor
+        self._frame = frame_idx
+        return self._active
@@ -1,10 +1,13 @@
 from .image_utils import trim_image, blend_image_to_frame, create_blackboard_background
-from .video_utils import compress_video, get_z_index
+from .video_utils import compress_video, create_video_writer, PipelinedFrameWriter, concat_segments, get_z_index
 
 __all__ = [
     'trim_image',
     'blend_image_to_frame',
     'create_blackboard_background',
     'compress_video',
+    'create_video_writer',
+    'PipelinedFrameWriter',
+    'concat_segments',
     'get_z_index'
 ] 
\ No newline at end of file
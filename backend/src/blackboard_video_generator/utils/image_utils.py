@@ -1,128 +1,377 @@
+import functools
 import numpy as np
 import cv2
 import logging
 
 logger = logging.getLogger(__name__)
 
-def trim_image(img):
+def alpha_bbox(img):
     """
-    裁剪图像，只保留非背景部分
+    计算图像中不透明部分（alpha > 0）的紧致外接矩形
+    
+    Args:
+        img: BGRA 图像；BGR 图像视为完全不透明
+        
+    Returns:
+        (x_start, y_start, x_end, y_end)；图像完全透明时返回 None
+    """
+    height, width = img.shape[:2]
+    if img.shape[2] != 4:
+        return (0, 0, width, height) if height > 0 and width > 0 else None
+    alpha = img[:, :, 3]
+    rows = np.flatnonzero(alpha.any(axis=1))
+    if len(rows) == 0:
+        return None
+    cols = np.flatnonzero(alpha.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+def trim_bbox(img, margin=2):
+    """
+    计算图像中非背景部分（含边距）的外接矩形
     
     Args:
         img: 输入图像 (RGB或RGBA)
+        margin: 四周保留的边距像素数
         
     Returns:
-        裁剪后的图像
+        (x_start, y_start, x_end, y_end)；图像中没有非背景像素时返回 None
     """
     # 如果是RGBA图像，使用alpha通道
     if img.shape[2] == 4:
-        # 寻找非透明区域
-        mask = img[:,:,3] > 0
+        bbox = alpha_bbox(img)
+        if bbox is None:
+            return None
+        x_min, y_min, x_max, y_max = bbox[0], bbox[1], bbox[2] - 1, bbox[3] - 1
     else:
         # RGB图像，假设背景是暗色的(30,30,30)
         mask = np.any(img > 60, axis=2)
+        
+        # 寻找非零区域的边界
+        coords = np.argwhere(mask)
+        if len(coords) == 0:
+            return None
+        
+        y_min, x_min = coords.min(axis=0)
+        y_max, x_max = coords.max(axis=0)
     
-    # 寻找非零区域的边界
-    coords = np.argwhere(mask)
-    if len(coords) == 0:
-        return img
+    # 添加边距
+    y_min = max(0, y_min - margin)
+    x_min = max(0, x_min - margin)
+    y_max = min(img.shape[0] - 1, y_max + margin)
+    x_max = min(img.shape[1] - 1, x_max + margin)
     
-    y_min, x_min = coords.min(axis=0)
-    y_max, x_max = coords.max(axis=0)
+    return int(x_min), int(y_min), int(x_max) + 1, int(y_max) + 1
+
+def trim_image(img, margin=2):
+    """
+    裁剪图像，只保留非背景部分
     
-    # 添加小边距(2像素)
-    y_min = max(0, y_min - 2)
-    x_min = max(0, x_min - 2)
-    y_max = min(img.shape[0] - 1, y_max + 2)
-    x_max = min(img.shape[1] - 1, x_max + 2)
+    Args:
+        img: 输入图像 (RGB或RGBA)
+        margin: 四周保留的边距像素数；预乘 BGRA 精灵使用 0 得到紧致裁剪
+        
+    Returns:
+        裁剪后的图像
+    """
+    bbox = trim_bbox(img, margin)
+    if bbox is None:
+        return img
     
     # 裁剪图像
-    return img[y_min:y_max+1, x_min:x_max+1]
+    x_start, y_start, x_end, y_end = bbox
+    return img[y_start:y_end, x_start:x_end]
+
+def compute_blend_rect(img_shape, frame_shape, x, y):
+    """
+    计算以 (x, y) 为中心放置图像时在帧中占据的矩形区域
+    
+    Args:
+        img_shape: 图像尺寸 (h, w, ...)
+        frame_shape: 帧尺寸 (h, w, ...)
+        x: 中心 x 坐标（0-1的比例值）
+        y: 中心 y 坐标（0-1的比例值）
+        
+    Returns:
+        (x_start, y_start, x_end, y_end)，已保证位于帧内
+    """
+    img_h, img_w = img_shape[:2]
+    frame_h, frame_w = frame_shape[:2]
+    
+    # 将0-1的比例转换为实际像素位置
+    pixel_x = int(x * frame_w)
+    pixel_y = int(y * frame_h)
+    
+    # 计算左上角坐标（考虑图像尺寸的一半），并确保在有效范围内
+    x_start = max(0, min(pixel_x - img_w // 2, frame_w - img_w))
+    y_start = max(0, min(pixel_y - img_h // 2, frame_h - img_h))
+    
+    # 计算结束位置，确保不超出边界
+    x_end = min(x_start + img_w, frame_w)
+    y_end = min(y_start + img_h, frame_h)
+    return x_start, y_start, x_end, y_end
+
+@functools.lru_cache(maxsize=None)
+def alpha_ramp(frame_count):
+    """
+    预先计算淡入/淡出的 8 位透明度斜坡
+    
+    Args:
+        frame_count: 淡入/淡出的帧数
+        
+    Returns:
+        只读的 uint8 数组，ramp[i] = round(i / frame_count * 255)，i 取 0..frame_count
+    """
+    ramp = np.round(np.arange(frame_count + 1) * 255.0 / max(frame_count, 1)).astype(np.uint8)
+    ramp.setflags(write=False)
+    return ramp
+
+def _div255(x, tmp):
+    """
+    对 uint16 数组原地做带舍入的除以 255（x 取值不超过 65280）
+    (x + 128 + ((x + 128) >> 8)) >> 8
+    """
+    x += 128
+    np.right_shift(x, 8, out=tmp)
+    x += tmp
+    x >>= 8
+
+def premultiply_image(img):
+    """
+    把直通 alpha 的 BGRA 图像（如解码后的 PNG）转换为预乘 alpha 的 BGRA 精灵
+    
+    Args:
+        img: BGR 或 BGRA 图像；BGR 图像视为完全不透明
+        
+    Returns:
+        (h, w, 4) 的 uint8 预乘 BGRA 图像：颜色通道已乘以 alpha/255
+    """
+    if img.shape[2] != 4:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
+    alpha = img[:, :, 3:4]
+    product = img[:, :, :3].astype(np.uint16) * alpha
+    _div255(product, np.empty_like(product))
+    sprite = np.empty(img.shape, dtype=np.uint8)
+    sprite[:, :, :3] = product
+    sprite[:, :, 3:4] = alpha
+    return sprite
+
+def unpremultiply_image(img):
+    """
+    把预乘 alpha 的 BGRA 精灵还原为直通 alpha（用于写出 PNG 等外部格式）
+    
+    Args:
+        img: 预乘 BGRA 图像
+        
+    Returns:
+        (h, w, 4) 的 uint8 直通 alpha BGRA 图像，完全透明像素的颜色为 0
+    """
+    alpha = img[:, :, 3:4].astype(np.uint16)
+    color = (img[:, :, :3].astype(np.uint16) * 255 + alpha // 2) // np.maximum(alpha, 1)
+    straight = np.empty(img.shape, dtype=np.uint8)
+    straight[:, :, :3] = np.minimum(color, 255)
+    straight[:, :, 3:4] = img[:, :, 3:4]
+    return straight
+
+def coverage_sprite(alpha, color=(255, 255, 255)):
+    """
+    由覆盖率（alpha）生成单色的预乘 BGRA 精灵，颜色通道直接由 alpha 缩放得到，无需逐通道循环
+    
+    Args:
+        alpha: uint8 的 (h, w) 覆盖率
+        color: 颜色 (BGR)
+        
+    Returns:
+        (h, w, 4) 的 uint8 预乘 BGRA 图像
+    """
+    sprite = np.empty(alpha.shape[:2] + (4,), dtype=np.uint8)
+    sprite[:, :, 3] = alpha
+    if all(c == 255 for c in color):
+        # 白色：预乘后的颜色等于 alpha
+        sprite[:, :, :3] = alpha[:, :, None]
+        return sprite
+    product = alpha[:, :, None].astype(np.uint16) * np.array(color, dtype=np.uint16)
+    _div255(product, np.empty_like(product))
+    sprite[:, :, :3] = product
+    return sprite
+
+def text_placeholder(text, size, org, font_scale=0.7, color=(255, 255, 255), thickness=1, scale=1.0):
+    """
+    渲染失败时使用的占位文字精灵（预乘 BGRA）。
+    文字先画在单通道覆盖率上再着色：直接在 4 通道图像上画粗线时，笔画重叠处的颜色可能大于 alpha，
+    不满足预乘形式的约束，定点混合内核会因此溢出
+
+    Args:
+        text: 文字内容
+        size: 图像尺寸 (height, width)
+        org: 文字基线左端的位置 (x, y)
+        font_scale: 字体缩放
+        color: 颜色 (BGR)
+        thickness: 笔画粗细
+        scale: 光栅化比例，尺寸、位置、字体与笔画都按此比例缩放（与正常渲染的元素同比）
+
+    Returns:
+        (h, w, 4) 的 uint8 预乘 BGRA 图像
+    """
+    size = tuple(max(1, int(round(v * scale))) for v in size)
+    org = tuple(int(round(v * scale)) for v in org)
+    coverage = np.zeros(size, dtype=np.uint8)
+    cv2.putText(coverage, text, org, cv2.FONT_HERSHEY_SIMPLEX, font_scale * scale, 255,
+                max(1, int(round(thickness * scale))))
+    return coverage_sprite(coverage, color)
+
+def split_premultiplied(img):
+    """
+    把精灵拆分为混合内核使用的颜色与 alpha 两部分
+    
+    Args:
+        img: 预乘 BGRA 图像，或视为完全不透明的 BGR 图像
+        
+    Returns:
+        (premultiplied_bgr, alpha)：alpha 为 uint8 的 (h, w, 1) 视图；
+        BGR 图像 alpha 返回 None，两者都是 img 的视图
+    """
+    if img.shape[2] != 4:
+        return img, None
+    return img[:, :, :3], img[:, :, 3:4]
+
+class BlendScratch:
+    """
+    定点混合内核的预分配临时缓冲。按最大尺寸分配一次，之后每次混合只取视图，不再分配内存。
+    """
+
+    __slots__ = ('color', 'color_tmp', 'alpha', 'alpha_tmp')
+
+    def __init__(self, height, width):
+        self.color = np.empty((height, width, 3), dtype=np.uint16)
+        self.color_tmp = np.empty((height, width, 3), dtype=np.uint16)
+        self.alpha = np.empty((height, width, 1), dtype=np.uint16)
+        self.alpha_tmp = np.empty((height, width, 1), dtype=np.uint16)
+
+    def views(self, height, width):
+        return (self.color[:height, :width], self.color_tmp[:height, :width],
+                self.alpha[:height, :width], self.alpha_tmp[:height, :width])
+
+def blend_premultiplied(region, premultiplied, alpha_map, alpha=255, scratch=None):
+    """
+    定点（uint8/uint16）预乘 alpha 混合内核，原地写入目标区域：
+        A   = a * g / 255
+        out = (dst * (255 - A) + src_premultiplied * g) / 255
+    
+    Args:
+        region: 目标区域（帧的视图，uint8 BGR）
+        premultiplied: 预乘后的 uint8 BGR 图像，与 region 同尺寸
+        alpha_map: uint8 的 (h, w, 1) alpha；None 表示完全不透明
+        alpha: 全局透明度，0-255 的整数
+        scratch: 可选的 BlendScratch；不提供时临时分配
+    """
+    alpha = int(alpha)
+    if alpha <= 0:
+        return
+    if alpha_map is None and alpha >= 255:
+        np.copyto(region, premultiplied)
+        return
+
+    height, width = region.shape[:2]
+    if scratch is None:
+        scratch = BlendScratch(height, width)
+    color, color_tmp, alpha_acc, alpha_tmp = scratch.views(height, width)
+
+    if alpha_map is None:
+        np.multiply(region, 255 - alpha, out=color, dtype=np.uint16)
+    else:
+        # A = a * g / 255，inverse = 255 - A
+        np.multiply(alpha_map, alpha, out=alpha_acc, dtype=np.uint16)
+        _div255(alpha_acc, alpha_tmp)
+        np.subtract(255, alpha_acc, out=alpha_acc, dtype=np.uint16)
+        np.multiply(region, alpha_acc, out=color, dtype=np.uint16)
 
-def blend_image_to_frame(frame, img, x, y, alpha=1.0, debug=False):
+    np.multiply(premultiplied, alpha, out=color_tmp, dtype=np.uint16)
+    color += color_tmp
+    _div255(color, color_tmp)
+    np.copyto(region, color, casting='unsafe')
+
+def blend_image_to_frame(frame, img, x, y, alpha=1.0, debug=False, offset=(0, 0)):
     """
-    将图像混合到帧中
+    将图像混合到帧中（定点预乘混合，见 blend_premultiplied）
     
     Args:
         frame: 目标帧
-        img: 要混合的图像
+        img: 要混合的图像（预乘 BGRA 或不透明 BGR）
         x: x坐标（0-1的比例值）
         y: y坐标（0-1的比例值）
-        alpha: 透明度
+        alpha: 透明度（0-1），按 1/255 量化
         debug: 是否输出调试信息
+        offset: 在放置区域基础上的像素平移 (dx, dy)，平移后的区域须位于帧内
     """
     try:
         if img is None:
             return
             
-        # 获取图像尺寸
-        img_h, img_w = img.shape[:2]
-        frame_h, frame_w = frame.shape[:2]
-        
-        # 将0-1的比例转换为实际像素位置
-        pixel_x = int(x * frame_w)
-        pixel_y = int(y * frame_h)
-        
-        # 计算左上角坐标（考虑图像尺寸的一半）
-        x_start = pixel_x - img_w // 2
-        y_start = pixel_y - img_h // 2
-        
-        # 确保坐标在有效范围内
-        x_start = max(0, min(x_start, frame_w - img_w))
-        y_start = max(0, min(y_start, frame_h - img_h))
-        
-        # 计算结束位置
-        x_end = x_start + img_w
-        y_end = y_start + img_h
-        
-        # 确保不超出边界
-        if x_end > frame_w:
-            img = img[:, :-(x_end - frame_w)]
-            x_end = frame_w
-        if y_end > frame_h:
-            img = img[:-(y_end - frame_h), :]
-            y_end = frame_h
+        # 计算图像在帧中的放置区域，超出边界的部分被裁剪
+        x_start, y_start, x_end, y_end = compute_blend_rect(img.shape, frame.shape, x, y)
+        img = img[:y_end - y_start, :x_end - x_start]
+        dx, dy = offset
+        x_start, x_end = x_start + dx, x_end + dx
+        y_start, y_end = y_start + dy, y_end + dy
             
-        # 在开始添加日志
-        if img is not None and debug:
+        if debug:
             logger.info(f"混合图像: 位置=({x:.2f}, {y:.2f}), 尺寸={img.shape}")
             
-        # 如果是RGBA图像
-        if img.shape[2] == 4:
-            # 提取alpha通道并应用全局alpha
-            src_alpha = img[:, :, 3] / 255.0 * alpha
-            src_alpha = np.expand_dims(src_alpha, axis=2)
-            
-            # 将源图像转换为RGB
-            src_rgb = img[:, :, :3]
-            
-            # 提取目标区域
-            dst_region = frame[y_start:y_end, x_start:x_end]
-            
-            # 混合图像
-            blended = dst_region * (1 - src_alpha) + src_rgb * src_alpha
-            frame[y_start:y_end, x_start:x_end] = blended.astype(np.uint8)
-        else:
-            # RGB图像的混合
-            dst_region = frame[y_start:y_end, x_start:x_end]
-            blended = cv2.addWeighted(dst_region, 1 - alpha, img, alpha, 0)
-            frame[y_start:y_end, x_start:x_end] = blended
+        premultiplied, alpha_map = split_premultiplied(img)
+        alpha_u8 = min(255, max(0, int(round(alpha * 255))))
+        blend_premultiplied(frame[y_start:y_end, x_start:x_end], premultiplied, alpha_map, alpha_u8)
             
     except Exception as e:
         logger.error(f"图像混合失败: {str(e)}")
         logger.error(f"frame shape: {frame.shape}, img shape: {img.shape}, position: ({x}, {y})")
 
-def create_blackboard_background(width, height):
-    """创建黑板背景"""
-    # 创建黑色背景
-    background = np.ones((height, width, 3), dtype=np.uint8) * np.array([30, 30, 30], dtype=np.uint8)
+def blend_image_to_frame_reference(frame, img, x, y, alpha=1.0, offset=(0, 0)):
+    """
+    blend_image_to_frame 的 float64 参考实现，仅供测试核对定点内核的精度、基准测试对比吞吐量；
+    每次调用都分配整块浮点临时数组，生产代码不应调用
+    
+    Args:
+        frame: 目标帧
+        img: 要混合的图像（预乘 BGRA 或不透明 BGR）
+        x: x坐标（0-1的比例值）
+        y: y坐标（0-1的比例值）
+        alpha: 透明度（0-1）
+        offset: 在放置区域基础上的像素平移 (dx, dy)，平移后的区域须位于帧内
+    """
+    x_start, y_start, x_end, y_end = compute_blend_rect(img.shape, frame.shape, x, y)
+    img = img[:y_end - y_start, :x_end - x_start]
+    dx, dy = offset
+    x_start, x_end = x_start + dx, x_end + dx
+    y_start, y_end = y_start + dy, y_end + dy
+    dst_region = frame[y_start:y_end, x_start:x_end]
+    if img.shape[2] == 4:
+        # 源像素的有效透明度（精灵 alpha 乘以全局透明度）；颜色已预乘，只需按全局透明度缩放
+        src_alpha = img[:, :, 3:4] / 255.0 * alpha
+        blended = dst_region * (1 - src_alpha) + img[:, :, :3] * alpha
+        frame[y_start:y_end, x_start:x_end] = np.clip(blended + 0.5, 0, 255).astype(np.uint8)
+    else:
+        frame[y_start:y_end, x_start:x_end] = cv2.addWeighted(dst_region, 1 - alpha, img, alpha, 0)
+
+def create_blackboard_background(width, height, seed=None):
+    """
+    创建黑板背景
+    
+    Args:
+        width: 宽度
+        height: 高度
+        seed: 噪点与粉笔灰的随机种子；相同种子与尺寸生成逐像素相同的背景，None 时每次不同
+        
+    Returns:
+        (height, width, 3) 的 uint8 BGR 图像
+    """
+    rng = np.random.default_rng(seed)
     
-    # 添加轻微噪点和纹理
-    noise = np.random.normal(0, 5, background.shape).astype(np.int16)
-    background = np.clip(background.astype(np.int16) + noise, 10, 50).astype(np.uint8)
+    # 黑色背景 (30,30,30) 上添加轻微噪点和纹理
+    noise = (rng.standard_normal((height, width, 3), dtype=np.float32) * 5).astype(np.int16)
+    background = np.clip(noise + 30, 10, 50).astype(np.uint8)
     
     # 添加一些粉笔灰
-    dust_mask = np.random.random(background.shape[:2]) > 0.995
+    dust_mask = rng.random((height, width), dtype=np.float32) > 0.995
     background[dust_mask] = np.array([70, 70, 70])
     
-    return background 
\ No newline at end of file
+    return background
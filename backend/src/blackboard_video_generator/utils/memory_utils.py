@@ -0,0 +1,41 @@
+import os
+import sys
+import logging
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+def current_rss_bytes():
+    """
+    获取当前进程的常驻内存（RSS）字节数
+
+    Returns:
+        RSS 字节数；当前平台无法获取时返回 None
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def peak_rss_bytes():
+    """
+    获取当前进程从启动至今的峰值常驻内存字节数
+
+    Returns:
+        峰值 RSS 字节数；当前平台无法获取时返回 None
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 下单位是 KB，macOS 下是字节
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def bytes_to_mb(value):
+    """字节数转换为 MB，None 保持为 None"""
+    return None if value is None else value / (1024 * 1024)
@@ -1,7 +1,14 @@
 import os
+import shutil
 import subprocess
+import tempfile
+import threading
+import queue
+import time
 import logging
 import traceback
+import cv2
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
@@ -45,6 +52,448 @@ def compress_video(input_path, logger=None):
             logger.error(f"压缩视频时出错: {str(e)}")
             logger.error(traceback.format_exc())
 
+class FFmpegFrameWriter:
+    """
+    通过管道把原始BGR帧直接送入常驻的ffmpeg/libx264进程，一次编码得到最终的H.264文件。
+    接口与 cv2.VideoWriter 保持一致（write / isOpened / release），另有出错时使用的 abort。
+    """
+
+    def __init__(self, output_path, fps, width, height, preset='medium', crf=23, threads=None, logger=None,
+                 extra_args=None):
+        """
+        Args:
+            output_path: 输出视频文件路径
+            fps: 帧率
+            width: 视频宽度
+            height: 视频高度
+            preset: libx264 预设
+            crf: libx264 质量参数
+            threads: 编码线程数，None 表示由ffmpeg自动决定
+            logger: 日志记录器
+            extra_args: 追加在输出路径之前的额外输出参数
+        """
+        self.output_path = output_path
+        self.frame_size = (width, height)
+        self.logger = logger
+        # stderr 写入临时文件，避免管道写满导致ffmpeg阻塞
+        self._stderr = tempfile.TemporaryFile()
+        command = [
+            'ffmpeg', '-y',
+            '-loglevel', 'error',
+            '-f', 'rawvideo',
+            '-pix_fmt', 'bgr24',
+            '-s', f'{width}x{height}',
+            '-r', str(fps),
+            '-i', '-',
+            '-an',
+            '-c:v', 'libx264',
+            '-preset', preset,
+            '-crf', str(crf),
+            '-pix_fmt', 'yuv420p',
+        ]
+        if threads:
+            command += ['-threads', str(threads)]
+        command += list(extra_args or [])
+        command.append(output_path)
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self._stderr)
+
+    def isOpened(self):
+        return self.process is not None and self.process.poll() is None
+
+    def write(self, frame):
+        """写入一帧 BGR 图像"""
+        if frame.shape[1::-1] != self.frame_size:
+            raise ValueError(f"帧尺寸 {frame.shape[1::-1]} 与编码器尺寸 {self.frame_size} 不一致")
+        try:
+            # 连续内存直接交给管道，避免 tobytes() 的额外拷贝
+            self.process.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).data)
+        except BrokenPipeError:
+            raise RuntimeError(f"ffmpeg编码进程意外退出: {self._read_stderr()}")
+
+    def write_hold(self, frame, frame_count):
+        """把同一帧连续写入 frame_count 次（恒定帧率输出）"""
+        for _ in range(frame_count):
+            self.write(frame)
+
+    def release(self):
+        """关闭管道并等待ffmpeg完成编码"""
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self.process.wait()
+        self.process = None
+        stderr = self._read_stderr()
+        self._stderr.close()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg编码失败 (返回码 {returncode}): {stderr}")
+        if self.logger:
+            self.logger.info(f"ffmpeg单次编码完成: {self.output_path}")
+
+    def abort(self):
+        """出错时中止编码：结束ffmpeg进程并删除不完整的输出文件，不抛出异常"""
+        if self.process is None:
+            return
+        process, self.process = self.process, None
+        process.kill()
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+        process.wait()
+        self._stderr.close()
+        try:
+            os.unlink(self.output_path)
+        except OSError:
+            pass
+
+    def _read_stderr(self):
+        self._stderr.seek(0)
+        return self._stderr.read().decode(errors='replace').strip()
+
+
+class OpenCVFrameWriter:
+    """
+    基于 cv2.VideoWriter (mp4v) 的后备写入器，release 时再调用 compress_video 转为 H.264。
+    """
+
+    def __init__(self, output_path, fps, width, height, logger=None):
+        self.output_path = output_path
+        self.logger = logger
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        self.writer = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+
+    def isOpened(self):
+        return self.writer.isOpened()
+
+    def write(self, frame):
+        self.writer.write(frame)
+
+    def write_hold(self, frame, frame_count):
+        for _ in range(frame_count):
+            self.writer.write(frame)
+
+    def release(self):
+        self.writer.release()
+        compress_video(self.output_path, self.logger)
+
+    def abort(self):
+        """出错时中止写入：关闭文件，不再压缩"""
+        self.writer.release()
+
+
+class VFRFrameWriter:
+    """
+    可变帧率写入器：每个不同的画面只通过管道以原始 BGR 帧送入常驻的 ffmpeg/libx264 进程编码一次
+    （不写中间图片），并记录其显示帧数。中间文件的时间基为 1/fps，每个画面占一个时间刻度；
+    release 时用 setts 位流滤镜（ffmpeg 4.4+）按记录的帧数改写时间戳，流拷贝得到最终的 VFR 文件，不重新编码。
+    静止的黑板画面只编码为一帧长时长帧，过渡动画仍按原帧率逐帧输出。
+    """
+
+    def __init__(self, output_path, fps, width, height, preset='medium', crf=23, threads=None, logger=None):
+        self.output_path = output_path
+        self.fps = fps
+        self.frame_size = (width, height)
+        self.logger = logger
+        self.work_dir = tempfile.mkdtemp(prefix='vfr_', dir=os.path.dirname(output_path) or None)
+        self.intermediate_path = os.path.join(self.work_dir, 'frames.mp4')
+        self.durations = []  # 每个画面的显示帧数
+        # 长时长帧与B帧重排同时出现时，mp4 的 dts/时长会被算错，因此关闭B帧
+        self._writer = FFmpegFrameWriter(self.intermediate_path, fps, width, height, preset=preset, crf=crf,
+                                         threads=threads,
+                                         extra_args=['-bf', '0', '-video_track_timescale', str(fps)])
+
+    def isOpened(self):
+        return self._writer is not None and self._writer.isOpened()
+
+    def write(self, frame):
+        self.write_hold(frame, 1)
+
+    def write_hold(self, frame, frame_count):
+        """写入一个画面，并指定它持续 frame_count 帧"""
+        if frame_count <= 0:
+            return
+        self._writer.write(frame)
+        self.durations.append(frame_count)
+
+    def _timestamp_filter(self):
+        """
+        setts 位流滤镜参数：第 N 个画面的时间戳为之前所有画面的帧数之和。
+        每个画面占一个刻度，只需为持续多帧的画面累加多出的帧数；表达式是扁平的加法，不受嵌套深度限制
+        """
+        terms = ['N'] + [f"gte(N,{idx + 1})*{frame_count - 1}"
+                         for idx, frame_count in enumerate(self.durations[:-1]) if frame_count > 1]
+        timestamps = '+'.join(terms)
+        # 最后一个画面的时长无法由下一个时间戳推出，单独指定
+        duration = f"if(eq(N,{len(self.durations) - 1}),{self.durations[-1]},1)"
+        # 位流滤镜参数中的逗号须转义，否则被当作滤镜链的分隔符
+        return f"setts=pts={timestamps}:dts={timestamps}:duration={duration}".replace(',', r'\,')
+
+    def release(self):
+        """结束编码，并按记录的帧数流拷贝改写时间戳"""
+        if self._writer is None:
+            return
+        try:
+            self._writer.release()
+            if not self.durations:
+                raise RuntimeError("VFR写入器没有收到任何帧")
+            command = [
+                'ffmpeg', '-y',
+                '-loglevel', 'error',
+                '-i', self.intermediate_path,
+                '-c', 'copy',
+                '-bsf:v', self._timestamp_filter(),
+                self.output_path,
+            ]
+            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            if result.returncode != 0:
+                raise RuntimeError(f"VFR时间戳改写失败: {result.stderr.decode(errors='replace').strip()}")
+            if self.logger:
+                self.logger.info(f"VFR编码完成: {self.output_path}，{len(self.durations)} 个独立画面 / "
+                                 f"{sum(self.durations)} 帧时长")
+        finally:
+            self._writer = None
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def abort(self):
+        """出错时中止编码：结束ffmpeg进程并删除中间文件，不抛出异常"""
+        if self._writer is None:
+            return
+        writer, self._writer = self._writer, None
+        writer.abort()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+VIDEO_WRITER_BACKENDS = ('ffmpeg', 'opencv')
+
+def create_video_writer(output_path, fps, width, height, backend='ffmpeg', preset='medium', crf=23,
+                        vfr=False, threads=None, logger=None):
+    """
+    创建视频帧写入器
+    
+    Args:
+        output_path: 输出视频文件路径
+        fps: 帧率
+        width: 视频宽度
+        height: 视频高度
+        backend: 'ffmpeg'（管道直送libx264，单次编码）或 'opencv'（mp4v + compress_video）
+        preset: libx264 预设（仅 ffmpeg 后端）
+        crf: libx264 质量参数（仅 ffmpeg 后端）
+        vfr: 是否输出可变帧率视频（仅 ffmpeg 后端）
+        threads: 编码线程数（仅 ffmpeg 后端），None 表示自动
+        logger: 日志记录器
+        
+    Returns:
+        具有 write / write_hold / isOpened / release / abort 接口的写入器
+    """
+    if backend not in VIDEO_WRITER_BACKENDS:
+        raise ValueError(f"未知的视频编码后端: {backend}，可选值: {VIDEO_WRITER_BACKENDS}")
+
+    if backend == 'ffmpeg':
+        if shutil.which('ffmpeg'):
+            if vfr:
+                return VFRFrameWriter(output_path, fps, width, height, preset=preset, crf=crf,
+                                      threads=threads, logger=logger)
+            return FFmpegFrameWriter(output_path, fps, width, height, preset=preset, crf=crf,
+                                     threads=threads, logger=logger)
+        if logger:
+            logger.warning("未找到ffmpeg，回退到OpenCV写入器")
+
+    if vfr and logger:
+        logger.warning("OpenCV写入器不支持VFR输出，将使用恒定帧率")
+
+    return OpenCVFrameWriter(output_path, fps, width, height, logger=logger)
+
+class PipelineMetrics:
+    """
+    流水线写入器的背压统计。
+    producer_stall 高说明编码端是瓶颈（合成线程在等空闲缓冲），
+    consumer_stall 高说明合成端是瓶颈（编码线程在等新帧）。
+    """
+
+    __slots__ = ('frames_submitted', 'frames_encoded', 'producer_stall', 'consumer_stall',
+                 'encode_time', 'max_queue_depth', '_depth_total', '_depth_samples')
+
+    def __init__(self):
+        self.frames_submitted = 0
+        self.frames_encoded = 0
+        self.producer_stall = 0.0
+        self.consumer_stall = 0.0
+        self.encode_time = 0.0
+        self.max_queue_depth = 0
+        self._depth_total = 0
+        self._depth_samples = 0
+
+    def record_depth(self, depth):
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+        self._depth_total += depth
+        self._depth_samples += 1
+
+    @property
+    def mean_queue_depth(self):
+        return self._depth_total / self._depth_samples if self._depth_samples else 0.0
+
+    def as_dict(self):
+        return {
+            'frames_submitted': self.frames_submitted,
+            'frames_encoded': self.frames_encoded,
+            'producer_stall': self.producer_stall,
+            'consumer_stall': self.consumer_stall,
+            'encode_time': self.encode_time,
+            'max_queue_depth': self.max_queue_depth,
+            'mean_queue_depth': self.mean_queue_depth,
+        }
+
+    def summary(self):
+        return (f"合成等待 {self.producer_stall:.2f}s, 编码等待 {self.consumer_stall:.2f}s, "
+                f"编码耗时 {self.encode_time:.2f}s, 队列深度 平均 {self.mean_queue_depth:.1f} / 最大 {self.max_queue_depth}")
+
+
+class PipelinedFrameWriter:
+    """
+    在独立线程中驱动被包装的写入器，使帧合成与编码/管道写入重叠执行。
+    两者之间是一个有界队列和一组可复用的帧缓冲：write 把帧拷贝进空闲缓冲后立即返回，
+    缓冲用完时合成线程阻塞（背压），编码线程写完后把缓冲归还到空闲池。
+    接口与被包装的写入器一致（write / write_hold / isOpened / release / abort）。
+    """
+
+    _STOP = object()
+
+    def __init__(self, writer, queue_size=4, logger=None):
+        """
+        Args:
+            writer: 被包装的视频帧写入器
+            queue_size: 帧缓冲数量，即合成端最多领先编码端的帧数
+            logger: 日志记录器
+        """
+        if queue_size < 1:
+            raise ValueError(f"queue_size 必须为正整数: {queue_size}")
+        self.writer = writer
+        self.queue_size = queue_size
+        self.logger = logger
+        self.metrics = PipelineMetrics()
+        self._free = queue.Queue()
+        self._pending = queue.Queue()
+        self._buffers_allocated = 0
+        self._error = None
+        self._thread = threading.Thread(target=self._consume, name='frame-encoder', daemon=True)
+        self._thread.start()
+
+    def isOpened(self):
+        return self._thread.is_alive() and self.writer.isOpened()
+
+    def write(self, frame):
+        """写入一帧"""
+        self.write_hold(frame, 1)
+
+    def write_hold(self, frame, frame_count):
+        """把同一帧连续写入 frame_count 次；只占用一个缓冲"""
+        if frame_count <= 0:
+            return
+        buffer = self._acquire_buffer(frame)
+        np.copyto(buffer, frame)
+        self._pending.put((buffer, frame_count))
+        self.metrics.frames_submitted += frame_count
+        self.metrics.record_depth(self._pending.qsize())
+
+    def _acquire_buffer(self, frame):
+        if self._error is not None:
+            raise RuntimeError(f"编码线程出错: {self._error}") from self._error
+        try:
+            buffer = self._free.get_nowait()
+        except queue.Empty:
+            if self._buffers_allocated < self.queue_size:
+                # 缓冲按需分配，总数不超过 queue_size
+                self._buffers_allocated += 1
+                return np.empty_like(frame)
+            start = time.perf_counter()
+            buffer = self._free.get()
+            self.metrics.producer_stall += time.perf_counter() - start
+        if buffer.shape != frame.shape:
+            buffer = np.empty_like(frame)
+        return buffer
+
+    def _consume(self):
+        while True:
+            start = time.perf_counter()
+            item = self._pending.get()
+            self.metrics.consumer_stall += time.perf_counter() - start
+            if item is self._STOP:
+                return
+            buffer, frame_count = item
+            if self._error is None:
+                start = time.perf_counter()
+                try:
+                    if frame_count == 1:
+                        self.writer.write(buffer)
+                    else:
+                        self.writer.write_hold(buffer, frame_count)
+                    self.metrics.frames_encoded += frame_count
+                except Exception as e:
+                    # 记录错误后继续回收缓冲，避免合成线程在背压处永久阻塞
+                    self._error = e
+                self.metrics.encode_time += time.perf_counter() - start
+            self._free.put(buffer)
+
+    def release(self):
+        """等待队列中的帧写完，再释放被包装的写入器"""
+        if self._thread.is_alive():
+            self._pending.put(self._STOP)
+            self._thread.join()
+        if self.logger:
+            self.logger.info(f"流水线写入完成，{self.metrics.frames_encoded} 帧；{self.metrics.summary()}")
+        if self._error is not None:
+            try:
+                self.writer.release()
+            except Exception:
+                pass
+            raise RuntimeError(f"编码线程出错: {self._error}") from self._error
+        self.writer.release()
+
+    def abort(self):
+        """
+        出错时中止：先中止被包装的写入器（阻塞在管道写入上的编码线程随之出错返回），
+        再结束编码线程并丢弃队列中的帧，不抛出异常
+        """
+        self.writer.abort()
+        if self._thread.is_alive():
+            self._pending.put(self._STOP)
+            self._thread.join()
+
+
+def concat_segments(segment_paths, output_path, logger=None):
+    """
+    使用 ffmpeg concat demuxer 以流拷贝方式（不重新编码）拼接编码参数一致的视频片段
+    
+    Args:
+        segment_paths: 按播放顺序排列的片段路径
+        output_path: 输出视频文件路径
+        logger: 日志记录器
+    """
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False, encoding='utf-8') as list_file:
+        for segment_path in segment_paths:
+            list_file.write(f"file '{os.path.abspath(segment_path)}'\n")
+        list_path = list_file.name
+
+    try:
+        command = [
+            'ffmpeg', '-y',
+            '-loglevel', 'error',
+            '-f', 'concat', '-safe', '0',
+            '-i', list_path,
+            '-c', 'copy',
+            output_path
+        ]
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise RuntimeError(f"视频片段拼接失败: {result.stderr.decode(errors='replace').strip()}")
+        if logger:
+            logger.info(f"已流拷贝拼接 {len(segment_paths)} 个视频片段: {output_path}")
+    finally:
+        os.unlink(list_path)
+
 def get_z_index(element_type):
     """
     获取元素的z-index值
@@ -12,6 +12,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
 # 导入视频合成器
 from backend.src.video_composer import main as compose_video
+from backend.src.blackboard_video_generator.blackboard_video_generator import EXECUTION_MODES
 
 # 配置loguru日志
 log_path = Path(os.path.dirname(os.path.dirname(__file__))) / "logs" / "pipeline.log"
@@ -23,6 +24,10 @@ def parse_args():
     parser = argparse.ArgumentParser(description="数学问题视频生成流程")
     parser.add_argument("json_file", help="输入的JSON数据文件路径")
     parser.add_argument("--output_dir", default="backend/output", help="输出目录")
+    parser.add_argument("--draft", action="store_true",
+                        help="草稿模式：半分辨率、15fps、ultrafast 编码，跳过教师视频与字幕，用于快速审核布局与时间轴")
+    parser.add_argument("--mode", choices=EXECUTION_MODES, default="serial",
+                        help="黑板视频帧合成的执行方式（说明见 blackboard_video_generator.py 中的 EXECUTION_MODES），默认 serial")
     
     return parser.parse_args()
 
@@ -44,11 +49,13 @@ def main():
     try:
         # 从输入JSON文件名构造期望的输出文件名
         # 例如: "path/to/sample_math_problem_015.json" -> "sample_math_problem_015.mp4"
+        # 草稿输出带 _draft 后缀，避免与正式视频混淆
         json_filename_stem = Path(args.json_file).stem
-        desired_output_filename = f"{json_filename_stem}.mp4"
+        desired_output_filename = f"{json_filename_stem}_draft.mp4" if args.draft else f"{json_filename_stem}.mp4"
         
         # 运行视频合成流程，传递期望的输出文件名
-        compose_video(args.json_file, args.output_dir, final_output_filename=desired_output_filename)
+        compose_video(args.json_file, args.output_dir, final_output_filename=desired_output_filename,
+                      draft=args.draft, mode=args.mode)
         
         # 检查最终输出文件是否生成
         expected_output_file_path = os.path.join(args.output_dir, desired_output_filename)
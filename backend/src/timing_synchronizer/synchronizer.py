@@ -334,7 +334,7 @@ class TimingSynchronizer:
     def adjust_animation_timings(self) -> None:
         """
         调整步骤内动画的持续时间，以适应步骤的新持续时间。
-        如果步骤持续时间发生变化，等比例调整动画的进入/退出时间。
+        如果步骤持续时间发生变化，等比例调整动画时长以及元素的 start_time / end_time。
         """
         if not self.content_json:
             self.load_data()
@@ -356,6 +356,10 @@ class TimingSynchronizer:
                         animation = element["animation"]
                         if "duration" in animation:
                             animation["duration"] = round(animation["duration"] * scale_factor, 1)
+                    # 元素在步骤内的出现/消失时间同样按比例缩放，保持与旁白的相对位置
+                    for time_key in ("start_time", "end_time"):
+                        if element.get(time_key) is not None:
+                            element[time_key] = round(element[time_key] * scale_factor, 2)
                             
                 logger.info(f"步骤 {step_id} 的动画时间已按比例 {scale_factor:.2f} 调整")
     
@@ -16,6 +16,8 @@ from config import Config
 # 添加项目根目录到系统路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
+from backend.src.blackboard_video_generator.blackboard_video_generator import STREAMING_EXECUTION_MODES
+
 # 配置loguru日志
 log_path = Path(os.path.dirname(os.path.dirname(__file__))) / "logs" / "video_composer.log"
 os.makedirs(log_path.parent, exist_ok=True)
@@ -185,13 +187,15 @@ def synchronize_timing(audio_metadata_path: str, json_path: str) -> str:
         logger.error("时间同步失败")
         return ""
 
-def generate_blackboard_video(json_path: str, output_path: str) -> bool:
+def generate_blackboard_video(json_path: str, output_path: str, draft: bool = False, mode: str = "serial") -> bool:
     """
     生成黑板视频
     
     Args:
         json_path: 输入JSON文件路径
         output_path: 输出视频文件路径
+        draft: 是否以草稿模式渲染（低分辨率、低帧率、ultrafast 编码）
+        mode: 帧合成的执行方式，见 blackboard_video_generator.EXECUTION_MODES
         
     Returns:
         生成是否成功
@@ -202,6 +206,18 @@ def generate_blackboard_video(json_path: str, output_path: str) -> bool:
         json_path,
         output_path
     ]
+    if getattr(Config, 'BLACKBOARD_VFR', False):
+        # 静止画面编码为单个长时长帧，后续 ffmpeg 步骤均可接受VFR输入
+        cmd.append("--vfr")
+    if getattr(Config, 'BLACKBOARD_STREAMING', False):
+        if mode in STREAMING_EXECUTION_MODES:
+            # 逐个步骤渲染并释放，限制长题目的峰值内存
+            cmd.append("--streaming")
+        else:
+            logger.warning(f"执行方式 {mode} 不支持流式模式，忽略 BLACKBOARD_STREAMING")
+    if draft:
+        cmd.append("--draft")
+    cmd.extend(["--mode", mode])
     
     if run_command(cmd):
         if os.path.exists(output_path):
@@ -216,7 +232,7 @@ def generate_blackboard_video(json_path: str, output_path: str) -> bool:
 
 def compose_video(video_path: str, audio_metadata_path: str, output_path: str) -> bool:
     """
-    合成视频和音频
+    合成视频和音频。视频流直接拷贝，因此黑板视频可以是VFR（保留原时间戳）。
     
     Args:
         video_path: 视频文件路径
@@ -590,6 +606,7 @@ def overlay_teacher_video(main_video: str, teacher_videos: List[str], output_pat
     teacher_video_margin_y = getattr(Config, 'TEACHER_VIDEO_MARGIN_Y', 10)
     video_encoding_crf = getattr(Config, 'VIDEO_ENCODING_CRF', 23) # 假设默认CRF为23
     video_encoding_preset = getattr(Config, 'VIDEO_ENCODING_PRESET', "medium") # 假设默认preset为medium
+    video_fps = getattr(Config, 'VIDEO_FPS', 30)
 
     final_overlay_cmd = [
         "ffmpeg", "-y", 
@@ -602,7 +619,9 @@ def overlay_teacher_video(main_video: str, teacher_videos: List[str], output_pat
         # TODO: 考虑将教师视频缩放到特定尺寸或比例，而不是依赖其原始尺寸
         # 例如: "[1:v]scale=iw*0.2:-1[scaled_teacher];[0:v][scaled_teacher]overlay=main_w-overlay_w-10:main_h-overlay_h-10:shortest=1[out_v]",
         # 为了简化，暂时保持原有逻辑，但这里的overlay参数值得回顾
-        f"[0:v][1:v]overlay=main_w-overlay_w-{teacher_video_margin_x}:main_h-overlay_h-{teacher_video_margin_y}:shortest=1[out_v]",
+        # 主视频可能是VFR（静止画面为长时长帧），先还原为恒定帧率，保证教师视频逐帧叠加
+        f"[0:v]fps={video_fps}[main_v];"
+        f"[main_v][1:v]overlay=main_w-overlay_w-{teacher_video_margin_x}:main_h-overlay_h-{teacher_video_margin_y}:shortest=1[out_v]",
         "-map", "[out_v]",
         "-map", "0:a?", # 映射主视频的音频流（如果存在）
         "-c:v", "libx264", # 最终输出的视频编码
@@ -724,11 +743,14 @@ def add_subtitle_to_video(video_path: str, subtitle_path: str, output_path: str)
         # Alignment: 字幕对齐方式 (ASS标准: 1=左下, 2=中下, 3=右下 ... 默认为2，通常无需更改)
         subtitle_style = "Fontsize=18,PrimaryColour=&HFFFFFF&,OutlineColour=&H000000&,BorderStyle=1,MarginV=25,WrapStyle=3"
         
+        # 输入可能是VFR的黑板视频：字幕可能在长时长帧的中途切换，先还原为恒定帧率再烧录
+        video_fps = getattr(Config, 'VIDEO_FPS', 30)
+        
         # 使用FFmpeg添加字幕
         cmd = [
             "ffmpeg", "-y",
             "-i", video_path,
-            "-vf", f"subtitles={subtitle_path}:force_style='{subtitle_style}'",
+            "-vf", f"fps={video_fps},subtitles={subtitle_path}:force_style='{subtitle_style}'",
             "-c:a", "copy",
             output_path
         ]
@@ -745,7 +767,8 @@ def add_subtitle_to_video(video_path: str, subtitle_path: str, output_path: str)
         logger.error(f"添加字幕过程出错: {str(e)}")
         return False
 
-def main(json_path: str, output_dir: str, final_output_filename: str = "output.mp4"):
+def main(json_path: str, output_dir: str, final_output_filename: str = "output.mp4", draft: bool = False,
+         mode: str = "serial"):
     """
     主函数
     
@@ -753,6 +776,9 @@ def main(json_path: str, output_dir: str, final_output_filename: str = "output.m
         json_path: 输入JSON文件路径
         output_dir: 输出目录
         final_output_filename: 最终输出文件名
+        draft: 草稿模式，用于快速审核布局与时间轴：黑板视频以草稿模式渲染，
+               并跳过教师视频生成/叠加和字幕烧录（这两步都会对整片重新编码）
+        mode: 黑板视频帧合成的执行方式，见 blackboard_video_generator.EXECUTION_MODES
     """
     try:
         # 确保输出目录存在
@@ -782,7 +808,7 @@ def main(json_path: str, output_dir: str, final_output_filename: str = "output.m
             
         # 步骤3: 生成黑板视频（使用调整后的JSON）
         logger.info(f"步骤3: 生成黑板视频 (使用{synchronized_json_path})")
-        if not generate_blackboard_video(synchronized_json_path, temp_video_path):
+        if not generate_blackboard_video(synchronized_json_path, temp_video_path, draft=draft, mode=mode):
             logger.error("黑板视频生成失败，终止")
             return
             
@@ -793,7 +819,7 @@ def main(json_path: str, output_dir: str, final_output_filename: str = "output.m
             return
 
         # 独立控制是否生成教师视频
-        if Config.ENABLE_TEACHER_VIDEO_GENERATION:
+        if Config.ENABLE_TEACHER_VIDEO_GENERATION and not draft:
             # 步骤5: 生成教师视频
             logger.info("步骤5: 生成教师视频")
             if not process_teacher_video(json_path, output_dir):
@@ -801,7 +827,7 @@ def main(json_path: str, output_dir: str, final_output_filename: str = "output.m
                 # 注意这里不return，继续执行
         
         # 独立控制是否叠加教师视频 - 不再嵌套在生成判断中
-        if Config.ENABLE_TEACHER_VIDEO_OVERLAY:
+        if Config.ENABLE_TEACHER_VIDEO_OVERLAY and not draft:
             # 步骤6: 叠加教师视频
             logger.info("步骤6: 叠加教师视频")
             teacher_video_dir = os.path.join(output_dir, "teacher_video")
@@ -834,32 +860,35 @@ def main(json_path: str, output_dir: str, final_output_filename: str = "output.m
             os.rename(temp_with_audio_path, final_output_path)
             logger.info(f"视频制作完成（无教师视频叠加）: {final_output_path}")
             
-        # 步骤7: 生成字幕文件
-        logger.info("步骤7: 生成字幕文件")
         subtitle_path = os.path.join(output_dir, "subtitle.srt")
-        audio_metadata_path = os.path.join(output_dir, "audio_segments", "audio_metadata.json")
+        temp_final_path = os.path.join(output_dir, "temp_final.mp4")
+        if draft:
+            logger.info(f"草稿视频制作完成（跳过教师视频与字幕）: {final_output_path}")
+        else:
+            # 步骤7: 生成字幕文件
+            logger.info("步骤7: 生成字幕文件")
+            audio_metadata_path = os.path.join(output_dir, "audio_segments", "audio_metadata.json")
         
-        if not os.path.exists(audio_metadata_path):
-            logger.error("音频元数据文件不存在")
-            return
+            if not os.path.exists(audio_metadata_path):
+                logger.error("音频元数据文件不存在")
+                return
             
-        # 使用同步后的JSON生成字幕，以确保字幕与音频同步
-        if not generate_subtitle_file(synchronized_json_path, audio_metadata_path, subtitle_path):
-            logger.error("字幕文件生成失败")
-            return
+            # 使用同步后的JSON生成字幕，以确保字幕与音频同步
+            if not generate_subtitle_file(synchronized_json_path, audio_metadata_path, subtitle_path):
+                logger.error("字幕文件生成失败")
+                return
             
-        # 步骤8: 添加字幕
-        logger.info("步骤8: 添加字幕")
-        temp_final_path = os.path.join(output_dir, "temp_final.mp4")
-        os.rename(final_output_path, temp_final_path)
+            # 步骤8: 添加字幕
+            logger.info("步骤8: 添加字幕")
+            os.rename(final_output_path, temp_final_path)
         
-        if add_subtitle_to_video(temp_final_path, subtitle_path, final_output_path):
-            logger.info(f"视频制作完成: {final_output_path}")
-        else:
-            logger.error("字幕添加失败")
-            # 如果添加字幕失败，至少保留原始视频
-            if os.path.exists(temp_final_path):
-                os.rename(temp_final_path, final_output_path)
+            if add_subtitle_to_video(temp_final_path, subtitle_path, final_output_path):
+                logger.info(f"视频制作完成: {final_output_path}")
+            else:
+                logger.error("字幕添加失败")
+                # 如果添加字幕失败，至少保留原始视频
+                if os.path.exists(temp_final_path):
+                    os.rename(temp_final_path, final_output_path)
             
         # 清理临时文件
         for temp_file in [temp_video_path, temp_with_audio_path, temp_final_path, subtitle_path]:
@@ -881,19 +910,24 @@ def main(json_path: str, output_dir: str, final_output_filename: str = "output.m
         logger.error(f"视频制作过程中出现错误: {str(e)}")
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print("用法: python video_composer.py <输入JSON文件路径> [输出目录] [最终输出文件名]")
-        sys.exit(1)
-        
-    json_arg = sys.argv[1]
-    output_dir_arg = sys.argv[2] if len(sys.argv) > 2 else "backend/output"
+    import argparse
+    from backend.src.blackboard_video_generator.blackboard_video_generator import EXECUTION_MODES
+
+    parser = argparse.ArgumentParser(description="将黑板视频和音频片段合成为完整视频")
+    parser.add_argument("json_path", help="输入JSON文件路径")
+    parser.add_argument("output_dir", nargs="?", default="backend/output", help="输出目录")
     # 如果直接运行，默认输出文件名基于输入JSON名
-    final_filename_arg = sys.argv[3] if len(sys.argv) > 3 else f"{Path(json_arg).stem}.mp4"
+    parser.add_argument("final_filename", nargs="?", help="最终输出文件名")
+    parser.add_argument("--draft", action="store_true", help="草稿模式：跳过教师视频与字幕，用于快速审核布局与时间轴")
+    parser.add_argument("--mode", choices=EXECUTION_MODES, default="serial",
+                        help="黑板视频帧合成的执行方式（说明见 blackboard_video_generator.py 中的 EXECUTION_MODES），默认 serial")
+    args = parser.parse_args()
+    final_filename_arg = args.final_filename or f"{Path(args.json_path).stem}.mp4"
     
     # 配置日志（如果这个文件可能被独立运行）
     if not logger.handlers: # 避免重复添加处理器
-        log_file_path = Path(output_dir_arg) / "video_composer_direct_run.log"
-        os.makedirs(Path(output_dir_arg), exist_ok=True)
+        log_file_path = Path(args.output_dir) / "video_composer_direct_run.log"
+        os.makedirs(Path(args.output_dir), exist_ok=True)
         logger.add(log_file_path, rotation="10 MB", retention="1 week", level="DEBUG", encoding="utf-8")
 
-    main(json_arg, output_dir_arg, final_output_filename=final_filename_arg) 
\ No newline at end of file
+    main(args.json_path, args.output_dir, final_output_filename=final_filename_arg, draft=args.draft, mode=args.mode)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 测试以仓库根目录为包根导入 backend.src.blackboard_video_generator
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,76 @@
+import numpy as np
+
+from backend.src.blackboard_video_generator.atlas import SpriteAtlas
+
+def _sprites(count, seed=0, max_width=1000):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(1, 256, (int(h), int(w), 4), dtype=np.uint8)
+            for h, w in zip(rng.integers(20, 160, count), rng.integers(30, max_width, count))]
+
+def test_pack_returns_equal_non_overlapping_views():
+    images = _sprites(20)
+    packed = SpriteAtlas().pack(images)
+    # 视图相互重叠时，后复制的精灵会覆盖先复制的精灵
+    for view, img in zip(packed, images):
+        assert np.array_equal(view, img)
+
+def test_pack_sizes_pages_to_content():
+    images = _sprites(12)
+    atlas = SpriteAtlas()
+    atlas.pack(images)
+    stats = atlas.stats()
+    assert stats['page_bytes'] == stats['used_bytes']
+    assert stats['sprite_bytes'] == sum(img.nbytes for img in images)
+    assert stats['fragmentation'] < 0.35
+
+def test_pack_small_step_does_not_allocate_a_full_page():
+    images = [np.full((60, 200, 4), 255, dtype=np.uint8), np.full((40, 300, 4), 255, dtype=np.uint8)]
+    atlas = SpriteAtlas(page_size=2048)
+    atlas.pack(images)
+    assert atlas.stats()['page_bytes'] < 4 * sum(img.nbytes for img in images)
+
+def test_oversized_sprite_gets_its_own_page():
+    wide = np.full((10, 3000, 4), 7, dtype=np.uint8)
+    atlas = SpriteAtlas(page_size=1024)
+    packed = atlas.pack([wide, np.full((10, 10, 4), 9, dtype=np.uint8)])
+    assert np.array_equal(packed[0], wide)
+    assert atlas.stats()['pages'] == 2
+
+def test_pack_passes_through_unsupported_images():
+    bgr = np.zeros((5, 5, 3), dtype=np.uint8)
+    packed = SpriteAtlas().pack([None, bgr])
+    assert packed[0] is None and packed[1] is bgr
+
+def test_add_after_pack_uses_a_new_page():
+    atlas = SpriteAtlas(page_size=256)
+    packed = atlas.pack(_sprites(3, max_width=200))
+    before = [view.copy() for view in packed]
+    coverage = np.full((30, 40), 200, dtype=np.uint8)
+    glyphs = SpriteAtlas(page_size=256, channels=1)
+    assert np.array_equal(glyphs.add(coverage), coverage)
+    added = atlas.add(np.full((50, 50, 4), 1, dtype=np.uint8))
+    assert added.base is not packed[0].base
+    assert all(np.array_equal(view, old) for view, old in zip(packed, before))
+
+def test_sprites_blend_from_atlas_pages_without_copying():
+    from backend.src.blackboard_video_generator.compositor import Sprite
+
+    images = _sprites(4, max_width=200)
+    atlas = SpriteAtlas()
+    packed = atlas.pack(images)
+    frame = np.zeros((400, 800, 3), dtype=np.uint8)
+    for view in packed:
+        sprite = Sprite(view, 0.5, 0.5, frame.shape)
+        assert np.shares_memory(sprite.premultiplied, view)
+        assert sprite.alpha is None or np.shares_memory(sprite.alpha, view)
+        sprite.blend(frame, 128)
+    assert frame.any()
+
+def test_stats_report_private_images():
+    atlas = SpriteAtlas()
+    atlas.pack(_sprites(2))
+    canvas = np.zeros((50, 60, 4), dtype=np.uint8)
+    atlas.track_private(canvas)
+    assert atlas.stats()['private_bytes'] == canvas.nbytes
+    atlas.clear()
+    assert atlas.stats()['private_bytes'] == 0
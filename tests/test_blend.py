@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from backend.src.blackboard_video_generator.utils.image_utils import (
+    BlendScratch,
+    blend_image_to_frame,
+    blend_image_to_frame_reference,
+    blend_premultiplied,
+    split_premultiplied,
+)
+
+def _premultiplied_sprite(rng, height, width):
+    sprite = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    # 预乘形式：颜色不大于 alpha
+    sprite[..., :3] = np.minimum(sprite[..., :3], sprite[..., 3:4])
+    sprite[0, 0, 3] = 0
+    sprite[0, 0, :3] = 0
+    sprite[0, 1] = 255
+    return sprite
+
+def _float_reference(region, sprite, alpha):
+    """浮点参考实现：out = dst * (1 - a * g) + src * g"""
+    g = alpha / 255.0
+    src_alpha = sprite[..., 3:4] / 255.0 * g
+    blended = region * (1 - src_alpha) + sprite[..., :3] * g
+    return np.clip(blended + 0.5, 0, 255).astype(np.uint8)
+
+@pytest.mark.parametrize('alpha', [1, 37, 128, 254, 255])
+def test_fixed_point_blend_matches_float_reference(alpha):
+    rng = np.random.default_rng(alpha)
+    sprite = _premultiplied_sprite(rng, 48, 64)
+    region = rng.integers(0, 256, (48, 64, 3), dtype=np.uint8)
+    expected = _float_reference(region, sprite, alpha)
+
+    premultiplied, alpha_map = split_premultiplied(sprite)
+    blend_premultiplied(region, premultiplied, alpha_map, alpha, BlendScratch(48, 64))
+    assert int(np.abs(region.astype(int) - expected).max()) <= 1
+
+def test_blend_image_to_frame_matches_float_reference():
+    rng = np.random.default_rng(0)
+    sprite = _premultiplied_sprite(rng, 30, 40)
+    frame = rng.integers(0, 256, (90, 160, 3), dtype=np.uint8)
+    expected = frame.copy()
+    blend_image_to_frame_reference(expected, sprite, 0.5, 0.5, alpha=100 / 255)
+
+    blend_image_to_frame(frame, sprite, 0.5, 0.5, alpha=100 / 255)
+    assert int(np.abs(frame.astype(int) - expected).max()) <= 1
+
+def test_blend_image_to_frame_uses_fixed_point_kernel():
+    rng = np.random.default_rng(2)
+    sprite = _premultiplied_sprite(rng, 30, 40)
+    frame = rng.integers(0, 256, (90, 160, 3), dtype=np.uint8)
+    expected = frame.copy()
+    blend_image_to_frame(frame, sprite, 0.5, 0.5, alpha=100 / 255, offset=(3, -2))
+
+    # compute_blend_rect 把 40x30 的精灵以 (80, 45) 为中心放在 (60, 30)，再平移 (3, -2)
+    premultiplied, alpha_map = split_premultiplied(sprite)
+    blend_premultiplied(expected[28:58, 63:103], premultiplied, alpha_map, 100)
+    assert np.array_equal(frame, expected)
+
+def test_opaque_sprite_and_scratch_reuse():
+    rng = np.random.default_rng(1)
+    scratch = BlendScratch(32, 32)
+    bgr = rng.integers(0, 256, (16, 24, 3), dtype=np.uint8)
+    region = rng.integers(0, 256, (16, 24, 3), dtype=np.uint8)
+    original = region.copy()
+
+    blend_premultiplied(region, bgr, None, 0, scratch)
+    assert np.array_equal(region, original)
+
+    blend_premultiplied(region, bgr, None, 90, scratch)
+    expected = np.clip(original * (1 - 90 / 255) + bgr * (90 / 255) + 0.5, 0, 255).astype(np.uint8)
+    assert int(np.abs(region.astype(int) - expected).max()) <= 1
+
+    blend_premultiplied(region, bgr, None, 255, scratch)
+    assert np.array_equal(region, bgr)
@@ -0,0 +1,135 @@
+import cv2
+import numpy as np
+import pytest
+
+from backend.src.blackboard_video_generator.animations import item_offset, prepare_item_variants
+from backend.src.blackboard_video_generator.compositor import StepCompositor, compose_frame
+from backend.src.blackboard_video_generator.renderers.geometry_renderer import GeometryPathAnimator
+from backend.src.blackboard_video_generator.scene import TimelineItem
+from backend.src.blackboard_video_generator.utils.image_utils import compute_blend_rect
+
+HEIGHT, WIDTH = 180, 320
+
+def _disc(height, width, color):
+    """抗锯齿边缘的预乘 BGRA 圆盘"""
+    img = np.zeros((height, width, 4), dtype=np.uint8)
+    cv2.circle(img, (width // 2, height // 2), min(height, width) // 2 - 2, (*color, 255), -1, lineType=cv2.LINE_AA)
+    alpha = img[..., 3:4].astype(np.float32) / 255
+    img[..., :3] = (img[..., :3] * alpha + 0.5).astype(np.uint8)
+    return img
+
+def _item(position, start, end, fade_in=0, fade_out=0, enter='fade_in', size=(40, 60), color=(200, 180, 240)):
+    return TimelineItem('text', _disc(*size, color), position, start, end, fade_in, fade_out,
+                        enter, 'fade_out' if fade_out else None)
+
+@pytest.fixture
+def background():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 80, (HEIGHT, WIDTH, 3)).astype(np.uint8)
+
+def _assert_matches_reference(background, timeline, frame_indices, tolerance=2):
+    compositor = StepCompositor(background, timeline)
+    for frame_idx in frame_indices:
+        expected = compose_frame(background, timeline, frame_idx)
+        diff = int(cv2.absdiff(compositor.compose(frame_idx), expected).max())
+        assert diff <= tolerance, f"第 {frame_idx} 帧最大差异 {diff}"
+
+def test_dirty_rect_compositor_matches_full_frame_fades(background):
+    timeline = [
+        _item((0.3, 0.5), 0, 40, fade_in=10, fade_out=10),
+        # 与上一个元素重叠，z 顺序在其之上，淡入时下层元素已静止
+        _item((0.4, 0.5), 15, 50, fade_in=10, fade_out=5, color=(90, 250, 120)),
+        # 显示时间短于淡入 + 淡出，两者重叠
+        _item((0.8, 0.3), 5, 12, fade_in=6, fade_out=6, size=(30, 30)),
+        # 没有动画的静态元素
+        _item((0.7, 0.8), 0, 60, size=(30, 90), color=(255, 255, 255)),
+    ]
+    _assert_matches_reference(background, timeline, range(60))
+
+def test_dirty_rect_compositor_handles_non_sequential_frames(background):
+    timeline = [_item((0.3, 0.5), 0, 40, fade_in=10, fade_out=10),
+                _item((0.4, 0.5), 15, 50, fade_in=10, fade_out=5, color=(90, 250, 120))]
+    # 静止区间只合成一次，逐帧与跳帧合成的结果都须与整帧合成一致
+    _assert_matches_reference(background, timeline, [0, 5, 30, 12, 49, 20, 45, 0])
+
+def test_static_overlap_chain_keeps_z_order(background):
+    # A 淡入；B 与 A 重叠被提升为精灵；C 只与 B 重叠，z 顺序最高，同样须在 B 之后混合
+    timeline = [
+        _item((0.3, 0.5), 0, 40, fade_in=20, size=(60, 60)),
+        _item((0.4, 0.5), 0, 40, size=(60, 60), color=(90, 250, 120)),
+        _item((0.5, 0.5), 0, 40, size=(60, 60), color=(255, 255, 255)),
+    ]
+    _assert_matches_reference(background, timeline, range(25))
+
+@pytest.mark.parametrize('enter', ['slide_in_left', 'slide_in_right', 'slide_in_top', 'slide_in_bottom', 'highlight'])
+def test_dirty_rect_compositor_matches_full_frame_effects(background, enter):
+    timeline = [
+        _item((0.5, 0.5), 2, 40, fade_in=12, fade_out=8, enter=enter),
+        # 与动画元素重叠的静态元素：须在动画元素之后重新混合
+        _item((0.55, 0.55), 0, 50, size=(30, 40), color=(255, 255, 255)),
+        # 靠近帧边缘，平移量被限制在帧内
+        _item((0.03, 0.97), 0, 30, fade_in=15, enter=enter, size=(30, 50)),
+    ]
+    for item in timeline:
+        prepare_item_variants(item)
+    _assert_matches_reference(background, timeline, range(50))
+
+def test_slide_stays_inside_frame():
+    item = _item((0.02, 0.5), 0, 30, fade_in=15, enter='slide_in_left', size=(30, 50))
+    rect = compute_blend_rect(item.content.shape, (HEIGHT, WIDTH, 3), *item.position)
+    for frame_idx in range(30):
+        dx, dy = item_offset(item, frame_idx, rect, (HEIGHT, WIDTH, 3))
+        assert rect[0] + dx >= 0 and rect[2] + dx <= WIDTH and dy == 0
+
+GEOMETRY = {
+    'circle': {'type': 'circle', 'cx': 50, 'cy': 50, 'r': 40},
+    'line': [
+        {'path': 'M 18 74 L 82 74', 'style': {'stroke': 'white', 'stroke-width': 2}},
+        {'path': 'M 50 50 L 82 74', 'style': {'stroke': 'yellow', 'stroke-width': 2}},
+    ],
+}
+
+def _draw_path_item(position, start, end, fade_in, fade_out=0, target_size=(120, 120)):
+    animator = GeometryPathAnimator(GEOMETRY, 1.0, target_size)
+    return TimelineItem('geometry', animator.final_image, position, start, end, fade_in, fade_out,
+                        'draw_path', 'fade_out' if fade_out else None, path_animator=animator)
+
+def test_dirty_rect_compositor_matches_full_frame_draw_path():
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 80, (360, 640, 3)).astype(np.uint8)
+    timeline = [
+        _draw_path_item((0.3, 0.5), 0, 40, fade_in=20, fade_out=5),
+        # 与路径绘制区域重叠、z 顺序在其之上的淡入元素
+        _item((0.32, 0.5), 10, 45, fade_in=8),
+        _draw_path_item((0.75, 0.5), 5, 45, fade_in=30, target_size=(90, 150)),
+    ]
+    _assert_matches_reference(background, timeline, range(50))
+
+def test_draw_path_final_frame_matches_static_image():
+    animator = GeometryPathAnimator(GEOMETRY, 1.0, (120, 120))
+    final = animator.final_image.copy()
+    assert final[..., 3].any()
+    for progress in np.linspace(0, 1, 11):
+        animator.advance(progress)
+    # 增量绘制到终点与完整图形一致，动画结束时画面不跳变
+    assert int(cv2.absdiff(animator.image, final).max()) <= 1
+    assert int(cv2.absdiff(animator.render_full(1.0), final).max()) <= 1
+
+def test_compose_into_rotating_output_buffers():
+    # 共享内存帧环形缓冲的用法：同一合成器轮流合成进几个槽位，每个槽位只重绘相对自己上一次内容的脏矩形
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 80, (360, 640, 3)).astype(np.uint8)
+    timeline = [
+        _draw_path_item((0.3, 0.5), 0, 40, fade_in=20, fade_out=5),
+        _item((0.32, 0.5), 10, 45, fade_in=8, enter='slide_in_left'),
+        _item((0.7, 0.3), 0, 50, size=(40, 90), color=(255, 255, 255)),
+    ]
+    for item in timeline:
+        prepare_item_variants(item)
+    compositor = StepCompositor(background, timeline)
+    slots = np.zeros((3,) + background.shape, dtype=np.uint8)
+    for frame_idx in range(50):
+        slot = slots[frame_idx % len(slots)]
+        assert compositor.compose(frame_idx, out=slot) is slot
+        diff = int(cv2.absdiff(slot, compose_frame(background, timeline, frame_idx)).max())
+        assert diff <= 2, f"第 {frame_idx} 帧最大差异 {diff}"
@@ -0,0 +1,104 @@
+import shutil
+
+import cv2
+import numpy as np
+import pytest
+
+from backend.src.blackboard_video_generator.animations import prepare_item_variants
+from backend.src.blackboard_video_generator.blackboard_video_generator import BlackboardVideoGenerator
+from backend.src.blackboard_video_generator.compositor import StepCompositor
+from backend.src.blackboard_video_generator.filtergraph import (
+    filtergraph_supports,
+    iter_step_frames,
+    write_step_sprites,
+)
+from backend.src.blackboard_video_generator.scene import TimelineItem
+
+pytestmark = pytest.mark.skipif(not shutil.which('ffmpeg'), reason='需要 ffmpeg')
+
+FPS = 30
+HEIGHT, WIDTH = 180, 320
+
+def _disc(height, width, color):
+    """抗锯齿边缘的预乘 BGRA 圆盘，平移一个像素就会产生明显差异"""
+    img = np.zeros((height, width, 4), dtype=np.uint8)
+    cv2.circle(img, (width // 2, height // 2), min(height, width) // 2 - 2, (*color, 255), -1, lineType=cv2.LINE_AA)
+    alpha = img[..., 3:4].astype(np.float32) / 255
+    img[..., :3] = (img[..., :3] * alpha + 0.5).astype(np.uint8)
+    return img
+
+def _item(enter, position, start, end, fade_in=12, fade_out=8, size=(40, 60)):
+    item = TimelineItem('text', _disc(*size, (200, 180, 240)), position, start, end, fade_in, fade_out,
+                        enter, 'fade_out' if fade_out else None)
+    prepare_item_variants(item)
+    return item
+
+@pytest.fixture
+def background():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 80, (HEIGHT, WIDTH, 3)).astype(np.uint8)
+
+def _max_diff(background, timeline, total_frames, tmp_path):
+    background_path = str(tmp_path / 'background.png')
+    cv2.imwrite(background_path, background)
+    compositor = StepCompositor(background, timeline)
+    max_diff = 0
+    frame_count = 0
+    for frame_idx, frame in enumerate(iter_step_frames(background_path, timeline, background.shape, total_frames,
+                                                       FPS, str(tmp_path), 'step')):
+        max_diff = max(max_diff, int(cv2.absdiff(compositor.compose(frame_idx), frame).max()))
+        frame_count += 1
+    assert frame_count == total_frames
+    return max_diff
+
+@pytest.mark.parametrize('enter', ['fade_in', 'slide_in_left', 'slide_in_right', 'slide_in_top',
+                                   'slide_in_bottom', 'highlight'])
+def test_filtergraph_matches_compositor(background, tmp_path, enter):
+    timeline = [_item(enter, (0.5, 0.5), 3, 40)]
+    assert _max_diff(background, timeline, 48, tmp_path) <= 2
+
+def test_filtergraph_matches_compositor_mixed(background, tmp_path):
+    timeline = [
+        _item('slide_in_left', (0.15, 0.3), 0, 40),
+        _item('highlight', (0.4, 0.45), 4, 44),
+        _item('slide_in_bottom', (0.6, 0.55), 8, 48),
+        # 位移被限制在帧内的滑入
+        _item('slide_in_left', (0.02, 0.5), 0, 30, fade_in=15, fade_out=0, size=(30, 50)),
+        # 显示时间短于入场时间、与淡出重叠的高亮
+        _item('highlight', (0.97, 0.9), 5, 12, fade_in=10, fade_out=4, size=(30, 30)),
+    ]
+    assert _max_diff(background, timeline, 56, tmp_path) <= 2
+
+def test_draw_path_is_not_expressible(tmp_path):
+    timeline = [_item('fade_in', (0.5, 0.5), 0, 10), _item('draw_path', (0.3, 0.3), 0, 10)]
+    assert not filtergraph_supports(timeline)
+    with pytest.raises(ValueError):
+        write_step_sprites(timeline, (HEIGHT, WIDTH, 3), str(tmp_path), 'step')
+
+def test_filtergraph_execution_renders_draw_path_steps(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    scene = {
+        'resolution': [WIDTH, HEIGHT],
+        'steps': [
+            {'step_id': 1, 'duration': 1, 'elements': [
+                {'type': 'geometry', 'position': [50, 50],
+                 'content': {'line': [{'path': 'M 10 10 L 90 10 L 90 90', 'style': {'stroke': 'white'}}]},
+                 'animation': {'enter': 'draw_path', 'exit': 'fade_out', 'duration': 0.5}}]},
+            {'step_id': 2, 'duration': 1, 'elements': [
+                {'type': 'text', 'content': 'abc', 'position': [50, 50], 'font_size': 28,
+                 'animation': {'enter': 'slide_in_left', 'exit': 'fade_out', 'duration': 0.5}}]},
+        ],
+    }
+    generator = BlackboardVideoGenerator(width=WIDTH, height=HEIGHT, execution='filtergraph')
+    rendered = []
+    render_step = generator._render_step
+    monkeypatch.setattr(generator, '_render_step',
+                        lambda *args: rendered.append(args[2].step_id) or render_step(*args))
+    output_path = generator.generate_video(scene)
+    assert output_path
+    # 只有含路径绘制的步骤回退到 Python 合成器
+    assert rendered == [1]
+    capture = cv2.VideoCapture(output_path)
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.release()
+    assert frame_count == 2 * generator.fps
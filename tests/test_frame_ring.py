@@ -0,0 +1,36 @@
+import numpy as np
+
+from backend.src.blackboard_video_generator.compositor import compose_frame
+from backend.src.blackboard_video_generator.frame_ring import render_with_frame_ring
+from backend.src.blackboard_video_generator.scene import TimelineItem
+
+class _CollectingWriter:
+    def __init__(self):
+        self.frames = []
+
+    def write(self, frame):
+        self.frames.append(frame.copy())
+
+    def write_hold(self, frame, count):
+        self.frames.extend(frame.copy() for _ in range(count))
+
+def _square(size, value):
+    img = np.zeros((size, size, 4), dtype=np.uint8)
+    img[2:-2, 2:-2] = value
+    return img
+
+def test_frame_ring_matches_full_frame_compose():
+    background = np.random.default_rng(0).integers(0, 80, (90, 160, 3)).astype(np.uint8)
+    timelines = [
+        [TimelineItem('text', _square(30, 200), (0.3, 0.5), 0, 20, 8, 6, 'fade_in', 'fade_out'),
+         TimelineItem('text', _square(20, 255), (0.35, 0.5), 0, 26, 0, 0, None, None)],
+        [TimelineItem('text', _square(24, 150), (0.6, 0.4), 5, 30, 10, 0, 'fade_in', None)],
+    ]
+    frame_counts = [26, 30]
+    writer = _CollectingWriter()
+    render_with_frame_ring(writer, background, timelines, frame_counts, workers=2)
+    expected = [compose_frame(background, timeline, frame_idx)
+                for timeline, count in zip(timelines, frame_counts) for frame_idx in range(count)]
+    assert len(writer.frames) == len(expected)
+    for frame_idx, (frame, reference) in enumerate(zip(writer.frames, expected)):
+        assert int(np.abs(frame.astype(int) - reference).max()) <= 2, f"第 {frame_idx} 帧"
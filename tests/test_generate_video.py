@@ -0,0 +1,61 @@
+import shutil
+
+import pytest
+
+from backend.src.blackboard_video_generator.blackboard_video_generator import BlackboardVideoGenerator
+
+SCENE = {
+    'resolution': [320, 180],
+    'steps': [{
+        'step_id': 1,
+        'duration': 2,
+        'elements': [{'type': 'text', 'content': 'abc', 'position': [10, 10], 'font_size': 28,
+                      'animation': {'enter': 'fade_in', 'exit': 'fade_out', 'duration': 1}}],
+    }],
+}
+
+@pytest.mark.parametrize('execution', ['serial', 'pipelined'])
+def test_failed_render_aborts_writer(tmp_path, monkeypatch, execution):
+    monkeypatch.chdir(tmp_path)
+    aborted = []
+    generator = BlackboardVideoGenerator(width=320, height=180, execution=execution)
+
+    def failing_render_step(video_writer, background, step, fps):
+        original_abort = video_writer.abort
+        def abort():
+            aborted.append(video_writer)
+            original_abort()
+        video_writer.abort = abort
+        video_writer.write(background)
+        raise RuntimeError('合成失败')
+
+    monkeypatch.setattr(generator, '_render_step', failing_render_step)
+    assert generator.generate_video(SCENE) == ''
+    assert len(aborted) == 1
+    assert not aborted[0].isOpened()
+    # ffmpeg 后端中止时删除不完整的输出文件
+    if shutil.which('ffmpeg'):
+        assert not list((tmp_path / 'backend' / 'output').glob('*.mp4'))
+
+def test_failed_step_segment_is_not_finalized(tmp_path, monkeypatch):
+    import numpy as np
+    from backend.src.blackboard_video_generator import blackboard_video_generator as module
+
+    released = []
+
+    def failing_render_step(self, video_writer, background, step, fps):
+        original_release = video_writer.release
+        def release():
+            released.append(video_writer)
+            original_release()
+        video_writer.release = release
+        video_writer.write(background)
+        raise RuntimeError('合成失败')
+
+    monkeypatch.setattr(BlackboardVideoGenerator, '_render_step', failing_render_step)
+    monkeypatch.setattr(module, '_worker_background', np.zeros((180, 320, 3), dtype=np.uint8))
+    segment_path = tmp_path / 'step_0000.mp4'
+    with pytest.raises(RuntimeError, match='合成失败'):
+        module._render_step_segment({'width': 320, 'height': 180}, None, 30, 320, 180, str(segment_path), 1)
+    assert released == []
+    assert not segment_path.exists()
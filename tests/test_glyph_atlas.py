@@ -0,0 +1,43 @@
+import pytest
+
+from backend.src.blackboard_video_generator.renderers import text_renderer
+from backend.src.blackboard_video_generator.renderers.glyph_atlas import get_glyph_atlas
+
+TEXTS = ['Hello, World', 'AVATAR Wave', 'x = 3.14', 'Line one\nsecond', 'a\nbb\nccc']
+
+def _render_both(text, scale):
+    dpi = max(1, int(round(text_renderer.RENDER_DPI * scale)))
+    glyphs = text_renderer._render_text_glyphs(text, 32, 'sans-serif', dpi)
+    reference = text_renderer._render_text_matplotlib(text, 32, None, dpi)
+    return glyphs, reference
+
+@pytest.mark.parametrize('scale', [1.0, 0.5])
+@pytest.mark.parametrize('text', TEXTS)
+def test_measure_equals_rendered_size(text, scale):
+    dpi = max(1, int(round(text_renderer.RENDER_DPI * scale)))
+    width, height = text_renderer.measure_text(text, 32, scale)
+    image = text_renderer._render_text_glyphs(text, 32, 'sans-serif', dpi)
+    assert image.shape[:2] == (height, width)
+
+@pytest.mark.parametrize('text', TEXTS)
+def test_glyph_layout_matches_matplotlib(text):
+    glyphs, reference = _render_both(text, 1.0)
+    assert abs(glyphs.shape[0] - reference.shape[0]) <= 2
+    assert abs(glyphs.shape[1] - reference.shape[1]) <= 2
+    # 墨迹总量一致（字形相同，只是光栅化位置可能差亚像素）
+    ink = glyphs[..., 3].sum(dtype=float) / reference[..., 3].sum(dtype=float)
+    assert ink == pytest.approx(1.0, abs=0.02)
+
+@pytest.mark.parametrize('text', TEXTS)
+def test_draft_scale_stays_close_to_matplotlib(text):
+    # 低 DPI 下 matplotlib 的字形微调与 FreeType 默认渲染略有差异
+    glyphs, reference = _render_both(text, 0.5)
+    assert abs(glyphs.shape[0] - reference.shape[0]) <= 3
+    assert glyphs.shape[1] == pytest.approx(reference.shape[1], rel=0.03, abs=2)
+
+def test_kerning_follows_kern_table():
+    path = text_renderer._font_chain('sans-serif')[0]
+    atlas = get_glyph_atlas(path, 32 * text_renderer.RENDER_DPI / 72)
+    # DejaVu Sans 的 kern 表收紧 AV，不调整没有条目的字母对
+    assert atlas.kerning('A', 'V') < -3
+    assert atlas.kerning('x', 'x') == 0
@@ -0,0 +1,116 @@
+import multiprocessing
+import os
+import subprocess
+import threading
+
+import numpy as np
+import pytest
+
+from backend.src.blackboard_video_generator.renderers import latex_service
+from backend.src.blackboard_video_generator.renderers.latex_service import LatexService, LatexServiceError
+
+@pytest.fixture
+def built_formats(monkeypatch):
+    """用假的格式预编译代替 latex -ini，记录调用线程"""
+    calls = []
+
+    def fake_build_format(work_dir, preamble):
+        calls.append(threading.get_ident())
+        open(os.path.join(work_dir, f'{latex_service.FORMAT_NAME}.fmt'), 'w').close()
+        return latex_service.FORMAT_NAME
+
+    monkeypatch.setattr(latex_service, '_build_format', fake_build_format)
+    return calls
+
+@pytest.fixture
+def service(built_formats):
+    service = LatexService('', workers=2)
+    yield service
+    service.close()
+
+def test_format_is_built_once_at_init_without_worker_processes(built_formats):
+    service = LatexService('', workers=3)
+    try:
+        assert built_formats == [threading.get_ident()]
+        workers = list(service._idle.queue)
+        assert len(workers) == 3
+        for worker in workers:
+            assert os.path.exists(os.path.join(worker.work_dir, f'{latex_service.FORMAT_NAME}.fmt'))
+        assert multiprocessing.active_children() == []
+    finally:
+        service.close()
+    assert all(not os.path.exists(worker.work_dir) for worker in workers)
+
+def test_concurrent_renders_use_separate_work_dirs(service, monkeypatch):
+    active = set()
+    seen = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(2)
+
+    def fake_compile(work_dir, fmt, preamble, source, font_size, dpi):
+        with lock:
+            assert work_dir not in active
+            active.add(work_dir)
+            seen.append(work_dir)
+        # 两个调用同时处于排版中
+        barrier.wait(timeout=5)
+        with lock:
+            active.discard(work_dir)
+        return np.zeros((2, 2, 4), dtype=np.uint8)
+
+    monkeypatch.setattr(latex_service, '_compile_formula', fake_compile)
+    service.prefetch([('a', 12, 100), ('b', 12, 100)])
+    assert len(set(seen)) == 2
+    assert service._idle.qsize() == 2
+
+@pytest.mark.parametrize('error, expected', [
+    (LatexServiceError('排版失败'), LatexServiceError),
+    (subprocess.TimeoutExpired('latex', 60), LatexServiceError),
+    (FileNotFoundError('dvipng'), LatexServiceError),
+    (KeyboardInterrupt(), KeyboardInterrupt),
+])
+def test_worker_slot_is_returned_after_errors(service, monkeypatch, error, expected):
+    def fail(*args):
+        raise error
+
+    monkeypatch.setattr(latex_service, '_compile_formula', fail)
+    with pytest.raises(expected):
+        service.render('x', 12, 100)
+    assert service._idle.qsize() == 2
+
+def test_closed_service_rejects_requests(service):
+    service.close()
+    with pytest.raises(LatexServiceError):
+        service.render('x', 12, 100)
+
+def test_replaced_batch_is_kept_until_rasterize_finishes(service):
+    observed = {}
+
+    def fake_call(payload):
+        if payload[0] == 'batch':
+            _, output_dir, jobname, entries = payload
+            dvi_path = os.path.join(output_dir, f'{jobname}.dvi')
+            with open(dvi_path, 'wb') as f:
+                f.write(b'dvi')
+            return dvi_path, [(10.0, 8.0, 2.0)] * len(entries)
+        dvi_path = payload[1]
+        # 光栅化期间另一个线程开始了下一道题的批量排版
+        service.compile_batch([('y', 12)])
+        observed['dvi_during_rasterize'] = os.path.exists(dvi_path)
+        return np.zeros((2, 2, 4), dtype=np.uint8)
+
+    service._call = fake_call
+    assert service.compile_batch([('x', 12)]) == 1
+    first_dir = service._batch_dir
+    service.render('x', 12, 100)
+
+    assert observed['dvi_during_rasterize']
+    # 读取结束后被替换的批次目录才删除，新批次使用另一个目录
+    assert not os.path.exists(first_dir)
+    assert service._batch_dir != first_dir and os.path.isdir(service._batch_dir)
+    assert service.batch_metrics('y', 12) == (10.0, 8.0, 2.0)
+    assert service.batch_metrics('x', 12) is None
+
+    second_dir = service._batch_dir
+    service.close()
+    assert not os.path.exists(second_dir)
@@ -0,0 +1,75 @@
+import pytest
+
+from backend.src.blackboard_video_generator.renderers import formula_renderer
+from backend.src.blackboard_video_generator.renderers.mathtext_renderer import (
+    mathtext_supported, measure_mathtext, render_mathtext_as_image)
+
+@pytest.mark.parametrize('latex', [
+    r'$x^2+1$',
+    r'$\frac{a}{b}$',
+    r'$\sqrt{x}+\alpha_i$',
+    r'$\sum_{i=1}^{n} i$',
+])
+def test_simple_formulas_use_mathtext(latex):
+    assert mathtext_supported(latex)
+
+@pytest.mark.parametrize('latex', [
+    r'$$',
+    r'$ $',
+    r'$\begin{cases} x & x>0 \\ 0 & x\le 0 \end{cases}$',
+    r'$a \\ b$',
+    r'$a & b$',
+    r'$\begin{pmatrix} 1 & 0 \end{pmatrix}$',
+    r'$\sum_{\substack{i<n \\ j<m}} a_{ij}$',
+    r'$x = \text{速度}$',
+    r'$\frac{a}{$',
+    r'$\notacommand{x}$',
+])
+def test_tex_only_formulas_are_rejected(latex):
+    assert not mathtext_supported(latex)
+
+def test_measure_matches_rendered_size():
+    width, height = measure_mathtext(r'$\frac{a}{b}+x^2$', 32)
+    image = render_mathtext_as_image(r'$\frac{a}{b}+x^2$', 32)
+    assert image.shape[2] == 4
+    # 测量使用盒子尺寸，比裁剪后的墨迹略大
+    assert image.shape[1] <= width + 1
+    assert image.shape[0] <= height + 1
+    assert image.shape[1] >= width * 0.8
+    assert image.shape[0] >= height * 0.6
+
+def test_render_latex_fragment_routes_by_support(monkeypatch):
+    tex_calls = []
+
+    def fake_tex(latex, font_size, **kwargs):
+        tex_calls.append(latex)
+        return render_mathtext_as_image(r'$x$', font_size)
+
+    monkeypatch.setattr(formula_renderer, 'render_latex_as_image', fake_tex)
+    monkeypatch.setenv('BLACKBOARD_SPRITE_CACHE_DIR', '')
+    formula_renderer.reset_formula_route_stats()
+    formula_renderer.render_latex_fragment(r'$x^2+1$', 32)
+    formula_renderer.render_latex_fragment(r'$a \\ b$', 32)
+    formula_renderer.render_latex_fragment(r'$x = \text{速度}$', 32)
+    assert tex_calls == [r'$a \\ b$', r'$x = \text{速度}$']
+    stats = formula_renderer.formula_route_stats()
+    assert (stats['mathtext'], stats['tex']) == (1, 2)
+    assert stats['hit_rate'] == pytest.approx(1 / 3)
+
+def test_mathtext_failure_falls_back_to_tex(monkeypatch):
+    tex_calls = []
+
+    def broken(*args, **kwargs):
+        raise RuntimeError('boom')
+
+    def fake_tex(latex, font_size, **kwargs):
+        tex_calls.append(latex)
+        return render_mathtext_as_image(r'$x$', font_size)
+
+    monkeypatch.setattr(formula_renderer, 'render_mathtext_as_image', broken)
+    monkeypatch.setattr(formula_renderer, 'render_latex_as_image', fake_tex)
+    monkeypatch.setenv('BLACKBOARD_SPRITE_CACHE_DIR', '')
+    formula_renderer.reset_formula_route_stats()
+    formula_renderer.render_latex_fragment(r'$y+1$', 32)
+    assert tex_calls == [r'$y+1$']
+    assert formula_renderer.formula_route_stats()['tex'] == 1
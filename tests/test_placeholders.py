@@ -0,0 +1,20 @@
+import pytest
+
+from backend.src.blackboard_video_generator.renderers import formula_renderer
+from backend.src.blackboard_video_generator.utils.image_utils import text_placeholder
+
+@pytest.mark.parametrize('scale', [1.0, 0.5, 2.0])
+def test_text_placeholder_scales_with_render_scale(scale):
+    img = text_placeholder("Formula Error", (50, 200), (10, 30), color=(255, 0, 0), scale=scale)
+    assert img.shape == (round(50 * scale), round(200 * scale), 4)
+    assert img[..., 3].any()
+
+def test_formula_error_placeholder_follows_scale(monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr(formula_renderer, '_formula_parts', fail)
+    full = formula_renderer.render_formula('x+1', 32, scale=1.0)
+    draft = formula_renderer.render_formula('x+1', 32, scale=0.5)
+    assert full.shape[:2] == (50, 200)
+    assert draft.shape[:2] == (25, 100)
@@ -0,0 +1,136 @@
+import os
+
+import numpy as np
+import pytest
+
+from backend.src.blackboard_video_generator.renderers import sprite_cache
+from backend.src.blackboard_video_generator.renderers.sprite_cache import (
+    SpriteCache, cached_sprite, sprite_cache_key)
+
+def _files(cache_dir):
+    return sorted(os.path.relpath(os.path.join(root, name), cache_dir)
+                  for root, _, names in os.walk(cache_dir) for name in names
+                  if name != '.evict.lock')
+
+def _sprite(seed, size=32):
+    return np.random.default_rng(seed).integers(0, 256, (size, size, 4), dtype=np.uint8)
+
+def test_put_get_round_trip(tmp_path):
+    cache = SpriteCache(str(tmp_path), 1 << 30)
+    key = sprite_cache_key('text', 1, 'x+1', 32)
+    sprite = _sprite(0)
+    assert cache.get(key) is None
+    assert cache.put(key, sprite=sprite, metrics=(1.5, 2.5))
+    got_sprite, got_metrics = cache.get(key)
+    np.testing.assert_array_equal(got_sprite, sprite)
+    np.testing.assert_array_equal(got_metrics, [1.5, 2.5])
+    # 只留下最终文件，没有临时文件
+    assert _files(str(tmp_path)) == [os.path.join(key[:2], f"{key}.npz")]
+
+def test_failed_write_leaves_no_partial_file(tmp_path, monkeypatch):
+    cache = SpriteCache(str(tmp_path), 1 << 30)
+    key = sprite_cache_key('text', 1, 'broken')
+
+    def fail(*args, **kwargs):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(sprite_cache.np, 'savez_compressed', fail)
+    assert not cache.put(key, sprite=_sprite(1))
+    assert _files(str(tmp_path)) == []
+    assert not cache.contains(key)
+
+def test_corrupt_entry_is_dropped(tmp_path):
+    cache = SpriteCache(str(tmp_path), 1 << 30)
+    key = sprite_cache_key('text', 1, 'corrupt')
+    cache.put(key, sprite=_sprite(2))
+    with open(cache._path(key), 'wb') as f:
+        f.write(b'not a zip file')
+    assert cache.get(key) is None
+    assert not cache.contains(key)
+
+def test_eviction_removes_least_recently_used(tmp_path):
+    probe = SpriteCache(str(tmp_path / 'probe'), 1 << 30)
+    probe.put('00probe', sprite=_sprite(0))
+    entry_size = os.path.getsize(probe._path('00probe'))
+
+    # 上限容纳 4 个多一点的条目
+    max_bytes = int(entry_size * 4.5)
+    cache = SpriteCache(str(tmp_path / 'cache'), max_bytes)
+    keys = [sprite_cache_key('text', 1, i) for i in range(4)]
+    for i, key in enumerate(keys):
+        cache.put(key, sprite=_sprite(i))
+        os.utime(cache._path(key), (1000 + i, 1000 + i))
+    # 命中更新修改时间，最早写入的条目因此变为最近使用
+    assert cache.get(keys[0]) is not None
+
+    extra = sprite_cache_key('text', 1, 'extra')
+    cache.put(extra, sprite=_sprite(4))
+    remaining = [key for key in keys + [extra] if cache.contains(key)]
+    # 淘汰到上限的 90% 以下，从最久未使用的 keys[1] 开始
+    assert not cache.contains(keys[1])
+    assert cache.contains(keys[0]) and cache.contains(extra)
+    total = sum(os.path.getsize(cache._path(key)) for key in remaining)
+    assert total <= max_bytes * sprite_cache._EVICT_TARGET
+    assert cache._approx_bytes == total
+
+def test_cached_sprite_renders_once(tmp_path, monkeypatch):
+    monkeypatch.setenv(sprite_cache.SPRITE_CACHE_ENV, str(tmp_path))
+    calls = []
+
+    def render():
+        calls.append(1)
+        return _sprite(5)
+
+    first = cached_sprite(render, 'text', 1, 'hello', 32)
+    second = cached_sprite(render, 'text', 1, 'hello', 32)
+    np.testing.assert_array_equal(first, second)
+    assert len(calls) == 1
+    cached_sprite(render, 'text', 1, 'hello', 40)
+    assert len(calls) == 2
+
+def test_cached_sprite_does_not_cache_failures(tmp_path, monkeypatch):
+    monkeypatch.setenv(sprite_cache.SPRITE_CACHE_ENV, str(tmp_path))
+
+    def render():
+        raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        cached_sprite(render, 'text', 1, 'bad')
+    assert _files(str(tmp_path)) == []
+
+def test_empty_cache_dir_disables_cache(monkeypatch):
+    monkeypatch.setenv(sprite_cache.SPRITE_CACHE_ENV, '')
+    assert sprite_cache.get_sprite_cache() is None
+    calls = []
+    cached_sprite(lambda: calls.append(1) or _sprite(6), 'text', 1, 'nocache')
+    cached_sprite(lambda: calls.append(1) or _sprite(6), 'text', 1, 'nocache')
+    assert len(calls) == 2
+
+def test_text_cache_key_follows_installed_fonts(tmp_path, monkeypatch):
+    from backend.src.blackboard_video_generator.renderers import text_renderer
+
+    monkeypatch.setenv(sprite_cache.SPRITE_CACHE_ENV, str(tmp_path / 'cache'))
+    font = tmp_path / 'font.ttf'
+    font.write_bytes(b'v1')
+    monkeypatch.setattr(text_renderer, '_font_chain', lambda family: (str(font),))
+    calls = []
+
+    def fake_render(text, font_size, family, dpi):
+        calls.append(text)
+        return _sprite(7)
+
+    monkeypatch.setattr(text_renderer, '_render_text_glyphs', fake_render)
+    text_renderer.render_text_as_image('hello', 32)
+    text_renderer.render_text_as_image('hello', 32)
+    assert len(calls) == 1
+    # 字体文件被替换（大小与修改时间变化）后不再命中旧条目
+    font.write_bytes(b'version 2')
+    os.utime(font, (2000, 2000))
+    text_renderer.render_text_as_image('hello', 32)
+    assert len(calls) == 2
+    # 回退链变化（如新装了中文字体）同样使旧条目失效
+    other = tmp_path / 'cjk.ttf'
+    other.write_bytes(b'cjk')
+    monkeypatch.setattr(text_renderer, '_font_chain', lambda family: (str(font), str(other)))
+    text_renderer.render_text_as_image('hello', 32)
+    assert len(calls) == 3
@@ -0,0 +1,33 @@
+import numpy as np
+
+from backend.src.blackboard_video_generator.scene import TimelineItem
+from backend.src.blackboard_video_generator.timeline import ActiveSet
+
+def _timeline(spans):
+    content = np.zeros((1, 1, 4), dtype=np.uint8)
+    return [TimelineItem('text', content, (0.5, 0.5), start, end) for start, end in spans]
+
+def _expected(timeline, frame_idx):
+    return [idx for idx, item in enumerate(timeline) if item.start_frame <= frame_idx < item.end_frame]
+
+SPANS = [(0, 10), (5, 5), (5, 20), (10, 15), (0, 30), (12, 13), (29, 30), (20, 10)]
+
+def test_active_set_forward_sweep():
+    timeline = _timeline(SPANS)
+    active = ActiveSet(timeline)
+    for frame_idx in range(35):
+        assert active.at(frame_idx) == _expected(timeline, frame_idx)
+
+def test_active_set_rescans_when_frame_index_goes_backwards():
+    timeline = _timeline(SPANS)
+    active = ActiveSet(timeline)
+    for frame_idx in [0, 12, 29, 5, 4, 19, 19, 10, 9, 30, 0, 13]:
+        assert active.at(frame_idx) == _expected(timeline, frame_idx)
+
+def test_active_set_random_access():
+    rng = np.random.default_rng(0)
+    starts = rng.integers(0, 100, 40)
+    timeline = _timeline([(int(start), int(start + length)) for start, length in zip(starts, rng.integers(0, 50, 40))])
+    active = ActiveSet(timeline)
+    for frame_idx in rng.integers(0, 160, 300):
+        assert active.at(int(frame_idx)) == _expected(timeline, int(frame_idx))
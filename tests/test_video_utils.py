@@ -0,0 +1,52 @@
+import os
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+from backend.src.blackboard_video_generator.utils.video_utils import VFRFrameWriter
+
+pytestmark = pytest.mark.skipif(not shutil.which('ffmpeg'), reason='需要 ffmpeg')
+
+FPS = 30
+WIDTH, HEIGHT = 64, 48
+
+def _packet_times(path):
+    """用 framemd5 复用器列出视频包的 (pts, duration)，单位为帧"""
+    output = subprocess.run(['ffmpeg', '-v', 'error', '-i', str(path), '-map', '0:v', '-c', 'copy', '-f', 'framemd5', '-'],
+                            check=True, capture_output=True, text=True).stdout
+    timebase = next(line.split(':')[-1].strip() for line in output.splitlines() if line.startswith('#tb'))
+    num, den = (int(part) for part in timebase.split('/'))
+    packets = []
+    for line in output.splitlines():
+        if line and not line.startswith('#'):
+            _, _, pts, duration = (field.strip() for field in line.split(',')[:4])
+            packets.append((int(pts) * num * FPS / den, int(duration) * num * FPS / den))
+    return sorted(packets)
+
+def _frame(value):
+    return np.full((HEIGHT, WIDTH, 3), value, dtype=np.uint8)
+
+def test_vfr_holds_become_long_frames(tmp_path):
+    output_path = tmp_path / 'out.mp4'
+    writer = VFRFrameWriter(str(output_path), FPS, WIDTH, HEIGHT, preset='ultrafast')
+    writer.write(_frame(0))
+    writer.write_hold(_frame(80), 45)
+    writer.write(_frame(160))
+    writer.write_hold(_frame(240), 10)
+    writer.release()
+
+    packets = _packet_times(output_path)
+    # 每个保持段只编码一帧，时间戳按帧数累加
+    assert [pts for pts, _ in packets] == [0, 1, 46, 47]
+    assert packets[-1][1] == 10
+    assert not os.path.exists(writer.work_dir)
+
+def test_vfr_abort_removes_partial_output(tmp_path):
+    output_path = tmp_path / 'out.mp4'
+    writer = VFRFrameWriter(str(output_path), FPS, WIDTH, HEIGHT, preset='ultrafast')
+    writer.write_hold(_frame(0), 5)
+    writer.abort()
+    assert not output_path.exists()
+    assert not os.path.exists(writer.work_dir)